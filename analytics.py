@@ -0,0 +1,254 @@
+"""Module for aggregating the availability history into insights, updated incrementally as polls arrive."""
+
+import numpy as np
+import pandas as pd
+from dateutil.tz import tzlocal
+
+from availability_history import AvailabilityHistory
+from scheduler import HOURS_PER_WEEK
+
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+# the number of polls unpacked from the availability history at once
+BATCH_SIZE = 4096
+
+
+def hours_of_week(timestamps: np.ndarray) -> np.ndarray:
+    """Get the hour of the week (0 is Monday 00:00 local time) of epoch timestamps in nanoseconds."""
+    times = pd.to_datetime(timestamps, utc=True).tz_convert(tzlocal())
+    return (times.dayofweek * 24 + times.hour).to_numpy()
+
+
+def format_hour_of_week(hour: int) -> str:
+    return f"{DAY_NAMES[hour // 24]} {hour % 24:02d}:00"
+
+
+def format_duration(nanoseconds: float) -> str:
+    """Format a duration in nanoseconds in the largest whole unit."""
+    if not np.isfinite(nanoseconds):
+        return "unknown"
+    minutes = nanoseconds / (60 * 10**9)
+    if minutes < 60:
+        return f"{round(minutes, 1)} minutes"
+    if minutes < 48 * 60:
+        return f"{round(minutes / 60, 1)} hours"
+    return f"{round(minutes / (24 * 60), 1)} days"
+
+
+def get_ranks(cells: np.ndarray) -> np.ndarray:
+    """Get the rank of each element within its run of equal values, for an array sorted by value."""
+    return np.arange(len(cells)) - np.searchsorted(cells, cells, side="left")
+
+
+class AvailabilityAnalytics:
+    """Class keeping running aggregates of the availability history, so insights are answered without scanning the history again.
+
+    The aggregates are the availability rate by hour of the week, by store and by part, and per store and part the total duration of the restocks and the total time between restocks.
+    Every aggregate is a sum or count that is updated with numpy operations over the new polls only.
+    """
+
+    def __init__(self):
+        """Initialization."""
+        # the availability history opened by `read`, only ever read as another instance appends to it
+        self.history: AvailabilityHistory = None
+        self.reset()
+
+    def reset(self):
+        """Clear the aggregates."""
+        self.count_polls = 0
+        self.store_numbers: list[str] = list()
+        self.part_numbers: list[str] = list()
+        self.polls_per_hour = np.zeros(HOURS_PER_WEEK, dtype=np.int64)
+        self.available_per_hour = np.zeros(HOURS_PER_WEEK, dtype=np.int64)
+        self.available_per_store = np.zeros(0, dtype=np.int64)
+        self.available_per_part = np.zeros(0, dtype=np.int64)
+        self.available_per_cell = np.zeros((0, 0), dtype=np.int64)
+        # per store and part: the state after the last poll and the running sums of the restocks
+        self.previous = np.zeros((0, 0), dtype=bool)
+        self.available_since = np.zeros((0, 0), dtype=np.int64)
+        self.last_restock = np.full((0, 0), -1, dtype=np.int64)
+        self.duration_sum = np.zeros((0, 0))
+        self.duration_count = np.zeros((0, 0), dtype=np.int64)
+        self.gap_sum = np.zeros((0, 0))
+        self.gap_count = np.zeros((0, 0), dtype=np.int64)
+
+    def resize(self, stores: int, parts: int):
+        """Make room for new stores and parts."""
+        old_stores, old_parts = self.previous.shape
+        if (stores, parts) == (old_stores, old_parts):
+            return
+        self.available_per_store = np.pad(
+            self.available_per_store, (0, stores - old_stores)
+        )
+        self.available_per_part = np.pad(
+            self.available_per_part, (0, parts - old_parts)
+        )
+        padding = ((0, stores - old_stores), (0, parts - old_parts))
+        for name in (
+            "available_per_cell",
+            "previous",
+            "available_since",
+            "duration_sum",
+            "duration_count",
+            "gap_sum",
+            "gap_count",
+        ):
+            setattr(self, name, np.pad(getattr(self, name), padding))
+        self.last_restock = np.pad(self.last_restock, padding, constant_values=-1)
+
+    @staticmethod
+    def get_events(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Get the poll and flat cell index of the set elements of a (polls, stores, parts) mask, sorted by cell and then poll."""
+        polls, stores, parts = np.nonzero(mask)
+        cells = stores * mask.shape[2] + parts
+        order = np.lexsort((polls, cells))
+        return polls[order], cells[order]
+
+    def add(self, timestamps: np.ndarray, grids: np.ndarray):
+        """Add a batch of polls, with their timestamps and their (polls, stores, parts) availability."""
+        if len(timestamps) == 0:
+            return
+        self.resize(grids.shape[1], grids.shape[2])
+        self.count_polls += len(timestamps)
+
+        # availability rates
+        hours = hours_of_week(timestamps)
+        np.add.at(self.polls_per_hour, hours, 1)
+        np.add.at(self.available_per_hour, hours, grids.any(axis=(1, 2)))
+        self.available_per_store += grids.any(axis=2).sum(axis=0)
+        self.available_per_part += grids.any(axis=1).sum(axis=0)
+        self.available_per_cell += grids.sum(axis=0)
+
+        # the restocks (became available) and sell-outs (became unavailable) of each cell
+        stacked = np.concatenate([self.previous[np.newaxis], grids])
+        rise_polls, rise_cells = self.get_events(stacked[1:] & ~stacked[:-1])
+        fall_polls, fall_cells = self.get_events(stacked[:-1] & ~stacked[1:])
+        rise_times = timestamps[rise_polls]
+        previous = self.previous.reshape(-1)
+        available_since = self.available_since.reshape(-1)
+        last_restock = self.last_restock.reshape(-1)
+
+        # restock durations: each sell-out ends the latest restock of its cell, which may lie before this batch
+        rise_index = get_ranks(fall_cells) - previous[fall_cells]
+        rise_position = (
+            np.searchsorted(rise_cells, fall_cells, side="left") + rise_index
+        )
+        candidates = np.append(rise_times, 0)
+        started = np.where(
+            rise_index >= 0,
+            candidates[np.clip(rise_position, 0, len(rise_times))],
+            available_since[fall_cells],
+        )
+        np.add.at(
+            self.duration_sum.reshape(-1), fall_cells, timestamps[fall_polls] - started
+        )
+        np.add.at(self.duration_count.reshape(-1), fall_cells, 1)
+
+        # time between restocks: from the previous restock of the same cell, which may lie before this batch
+        first = get_ranks(rise_cells) == 0
+        previous_rise = np.empty_like(rise_times)
+        previous_rise[1:] = rise_times[:-1]
+        previous_rise[first] = last_restock[rise_cells[first]]
+        has_previous = previous_rise >= 0
+        np.add.at(
+            self.gap_sum.reshape(-1),
+            rise_cells[has_previous],
+            (rise_times - previous_rise)[has_previous],
+        )
+        np.add.at(self.gap_count.reshape(-1), rise_cells[has_previous], 1)
+
+        # carry the state of the last restock of each cell over to the next batch
+        last = np.append(rise_cells[1:] != rise_cells[:-1], True)[: len(rise_cells)]
+        last_restock[rise_cells[last]] = rise_times[last]
+        available_since[rise_cells[last]] = rise_times[last]
+        self.previous = grids[-1].copy()
+
+    def update(self, history: AvailabilityHistory):
+        """Add the polls that were appended to the availability history since the last update."""
+        count = len(history)
+        if count < self.count_polls:
+            # the history was replaced, start over
+            self.reset()
+        timestamps = history.get_timestamps()
+        while self.count_polls < count:
+            stop = min(count, self.count_polls + BATCH_SIZE)
+            self.add(
+                np.asarray(timestamps[self.count_polls : stop]),
+                history.unpack(self.count_polls, stop),
+            )
+        self.store_numbers = list(history.store_numbers)
+        self.part_numbers = list(history.part_numbers)
+
+    def read(self, path):
+        """Add the polls appended to the availability history file since the last read. Blocking, e.g. runs in a background thread.
+
+        The file is opened read-only, so a record that is still being appended to it is left alone.
+        """
+        if self.history is None:
+            self.history = AvailabilityHistory(path, read_only=True)
+        else:
+            # pick up new stores and parts and a grown file
+            self.history.load()
+        self.update(self.history)
+
+    def get_rate_by_hour(self) -> np.ndarray:
+        """The fraction of polls in which anything was available, per hour of the week (NaN for hours without polls)."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.available_per_hour / self.polls_per_hour
+
+    def get_rate_by_store(self) -> dict[str, float]:
+        """The fraction of polls in which anything was available, per store."""
+        return {
+            number: self.available_per_store[row] / self.count_polls
+            for row, number in enumerate(self.store_numbers)
+        }
+
+    def get_rate_by_part(self) -> dict[str, float]:
+        """The fraction of polls in which the part was available anywhere, per part."""
+        return {
+            number: self.available_per_part[column] / self.count_polls
+            for column, number in enumerate(self.part_numbers)
+        }
+
+    def get_mean_duration(self, axis=None) -> np.ndarray:
+        """The mean duration of a restock in nanoseconds, overall or per store (axis 1) or part (axis 0)."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.duration_sum.sum(axis=axis) / self.duration_count.sum(axis=axis)
+
+    def get_mean_gap(self, axis=None) -> np.ndarray:
+        """The mean time between restocks in nanoseconds, overall or per store (axis 1) or part (axis 0)."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.gap_sum.sum(axis=axis) / self.gap_count.sum(axis=axis)
+
+    def get_summary(
+        self, store_names: dict = None, part_titles: dict = None, top=5
+    ) -> str:
+        """Generate a HTML message with the insights."""
+        if self.count_polls == 0:
+            return "There is no availability history yet."
+        store_names = store_names or {}
+        part_titles = part_titles or {}
+        message = f"<b>Insights</b> over {self.count_polls} polls \n"
+        message += f"Something was available in {round(self.available_per_hour.sum() / self.count_polls * 100, 1)}% of the polls. \n"
+        message += f"A restock lasted {format_duration(self.get_mean_duration())} on average, with {format_duration(self.get_mean_gap())} between restocks. \n"
+
+        rates = self.get_rate_by_hour()
+        hours = [hour for hour in np.argsort(-np.nan_to_num(rates)) if rates[hour] > 0]
+        if len(hours) > 0:
+            message += "\n<b>Most likely hours</b>\n"
+            for hour in hours[:top]:
+                message += f"{format_hour_of_week(int(hour))}: {round(rates[hour] * 100, 1)}%\n"
+
+        message += "\n<b>By store</b>\n"
+        for number, rate in sorted(
+            self.get_rate_by_store().items(), key=lambda item: -item[1]
+        )[:top]:
+            message += f"{store_names.get(number, number)} ({number}): {round(rate * 100, 1)}%\n"
+
+        message += "\n<b>By model</b>\n"
+        durations = self.get_mean_duration(axis=0)
+        gaps = self.get_mean_gap(axis=0)
+        for column, (number, rate) in sorted(
+            enumerate(self.get_rate_by_part().items()), key=lambda item: -item[1][1]
+        )[:top]:
+            message += f"{part_titles.get(number) or number} ({number}): {round(rate * 100, 1)}%, restocks last {format_duration(durations[column])}, every {format_duration(gaps[column])}\n"
+        return message.strip("\n")
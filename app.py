@@ -12,8 +12,43 @@ freeze_support()  # noqa
 
 # UI
 from nicegui import native, ui, run  # noqa: E402
+from pathlib import Path
 from multiprocessing import Manager
-from monitor import next_search_backoff
+from monitor import Monitor, next_search_backoff
+from confighandler import ConfigHandler
+from analytics import AvailabilityAnalytics
+
+# the insights of each search (None for the main search) are kept up to date with the polls the monitor appends to its availability history
+analytics_per_search: dict[str, AvailabilityAnalytics] = dict()
+
+
+def get_insights() -> str:
+    """Update the insights of every search with the new polls in its availability history and render them as HTML."""
+    confighandler = ConfigHandler(auto_update=False)
+    path = confighandler.get(
+        ["general", "availability_history_path"], "availability.bin"
+    )
+    searches = [None] + [
+        profile.get("name", "profile") for profile, _ in confighandler.get_profiles()
+    ]
+    sections = list()
+    for search in searches:
+        # each search profile has its own availability history
+        search_path = Monitor.get_profile_path(path, search) if path else None
+        if not search_path or not Path(search_path).exists():
+            continue
+        analytics = analytics_per_search.setdefault(search, AvailabilityAnalytics())
+        # read-only, as the monitor may be appending to the file at the same time
+        analytics.read(search_path)
+        summary = analytics.get_summary()
+        sections.append(
+            f"<b>Search profile {search}</b>\n{summary}" if search else summary
+        )
+    if len(sections) == 0:
+        return (
+            "There is no availability history yet, start a search to collect insights."
+        )
+    return "\n\n".join(sections).replace("\n", "<br>")
 
 
 @ui.page("/")  # normal index page (e.g. the entry point of the app)
@@ -93,8 +128,13 @@ def main():
             ui.label("🛠️ Remote notifications are coming soon! 🚧")
             # TODO explain and allow configuration of remote notifications
         with ui.tab_panel("Insights"):
-            ui.label("🛠️ Insights are coming soon! 🚧")
-            # TODO provide plots and data
+            insights = ui.html(get_insights())
+
+            async def refresh_insights():
+                # reading the history can take a while, so it does not block the UI
+                insights.set_content(await run.io_bound(get_insights))
+
+            ui.button("Refresh", icon="refresh", on_click=refresh_insights)
 
 
 ui.run(
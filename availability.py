@@ -0,0 +1,151 @@
+"""Module with the availability matrix (stores × parts) that is the result of a poll."""
+
+import numpy as np
+
+from decoding import StoreRecord
+
+
+class AvailabilityIndex:
+    """Stable indices of stores and parts with their side tables, new stores and parts are appended so indices never change."""
+
+    def __init__(self):
+        """Initialization."""
+        self.stores: dict[str, int] = dict()
+        self.store_numbers: list[str] = list()
+        self.store_names: list[str] = list()
+        self.store_cities: list[str] = list()
+        self.store_sequences: list[int] = list()
+        self.parts: dict[str, int] = dict()
+        self.part_numbers: list[str] = list()
+        self.part_titles: list[str] = list()
+        self.part_links: list[str] = list()
+
+    def get_store(self, store: StoreRecord) -> int:
+        """Get the index of a store, adding it if it is new."""
+        index = self.stores.get(store.store_number)
+        if index is None:
+            index = len(self.store_numbers)
+            self.stores[store.store_number] = index
+            self.store_numbers.append(store.store_number)
+            self.store_names.append(store.name)
+            self.store_cities.append(store.city)
+            self.store_sequences.append(store.sequence)
+        else:
+            self.store_sequences[index] = store.sequence
+        return index
+
+    def get_part(self, part_number: str, title: str = None) -> int:
+        """Get the index of a part, adding it if it is new."""
+        index = self.parts.get(part_number)
+        if index is None:
+            index = len(self.part_numbers)
+            self.parts[part_number] = index
+            self.part_numbers.append(part_number)
+            self.part_titles.append(title)
+            self.part_links.append(None)
+        elif title is not None:
+            self.part_titles[index] = title
+        return index
+
+    def set_links(self, device_list: list[dict]):
+        """Set the product links of the parts from the device list."""
+        for device in device_list:
+            if device.get("link") is not None:
+                self.part_links[self.get_part(device.get("model"))] = device.get("link")
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.store_numbers), len(self.part_numbers)
+
+
+class AvailabilityMatrix:
+    """Dense boolean matrix of the availability of each part (columns) in each store (rows) in a poll.
+
+    `available` tells whether a part can be picked up in a store, `listed` whether the store reported the part at all.
+    """
+
+    __slots__ = ("index", "available", "listed")
+
+    def __init__(
+        self, index: AvailabilityIndex, available: np.ndarray, listed: np.ndarray
+    ):
+        self.index = index
+        self.available = available
+        self.listed = listed
+
+    @classmethod
+    def from_stores(
+        cls, stores: list[StoreRecord], index: AvailabilityIndex
+    ) -> "AvailabilityMatrix":
+        """Build the matrix of a poll from the merged store records."""
+        cells = list()
+        for store in stores:
+            store_index = index.get_store(store)
+            for part in store.parts.values():
+                cells.append(
+                    (
+                        store_index,
+                        index.get_part(part.part_number, part.title),
+                        part.available,
+                    )
+                )
+        available = np.zeros(index.shape, dtype=bool)
+        listed = np.zeros(index.shape, dtype=bool)
+        if len(cells) > 0:
+            rows, columns, values = zip(*cells)
+            listed[rows, columns] = True
+            available[rows, columns] = values
+        return cls(index, available, listed)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.available.shape
+
+    def any_available(self) -> bool:
+        """Whether any part is available in any store."""
+        return bool(self.available.any())
+
+    def count_per_store(self) -> np.ndarray:
+        """The number of available parts per store."""
+        return self.available.sum(axis=1)
+
+    def count_per_part(self) -> np.ndarray:
+        """The number of stores each part is available in."""
+        return self.available.sum(axis=0)
+
+    def resized(self, shape: tuple[int, int]) -> "AvailabilityMatrix":
+        """Get the matrix padded to a larger shape, for comparing with a later poll that has more stores or parts."""
+        if self.shape == shape:
+            return self
+        available = np.zeros(shape, dtype=bool)
+        available[: self.shape[0], : self.shape[1]] = self.available
+        listed = np.zeros(shape, dtype=bool)
+        listed[: self.shape[0], : self.shape[1]] = self.listed
+        return AvailabilityMatrix(self.index, available, listed)
+
+    def carried_forward(self, previous: "AvailabilityMatrix") -> "AvailabilityMatrix":
+        """Get the matrix with the cells that were not listed in this poll, e.g. because their request failed, taken from the previous poll."""
+        if previous is None:
+            return self
+        before = previous.resized(self.shape)
+        return AvailabilityMatrix(
+            self.index,
+            np.where(self.listed, self.available, before.available),
+            self.listed | before.listed,
+        )
+
+    def diff(self, previous: "AvailabilityMatrix") -> tuple[np.ndarray, np.ndarray]:
+        """Compare with the previous poll, returns the masks of the cells that became available and that became unavailable.
+
+        Only the cells listed in this poll are compared, so a part missing because its request failed does not count as a change.
+        """
+        before = (
+            previous.resized(self.shape).available
+            if previous is not None
+            else np.zeros(self.shape, dtype=bool)
+        )
+        return self.available & ~before, self.listed & before & ~self.available
+
+    def packed(self) -> np.ndarray:
+        """The availability packed into bits row by row, for compactly appending it to a history."""
+        return np.packbits(self.available, axis=None)
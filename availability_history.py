@@ -0,0 +1,281 @@
+"""Module for keeping the availability of every store and part of every poll in a memory-mapped append-only file."""
+
+import os
+import json
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from availability import AvailabilityIndex, AvailabilityMatrix
+
+MAGIC = b"ASNAVAIL"
+FORMAT_VERSION = 1
+# magic, format version, reserved header size, store capacity, part capacity
+PREAMBLE = struct.Struct("<8sIIII")
+# the number of records rewritten at once when the file grows
+GROW_BATCH_SIZE = 4096
+
+
+class AvailabilityHistory:
+    """Class to append the availability matrix of every poll to a file as packed bits, and to query it through memory-mapped numpy views.
+
+    The file starts with a preamble and a JSON header with the store and part numbers (the dictionary), padded to a reserved size.
+    After that follows a fixed size record per poll: the timestamp in nanoseconds since the epoch and the availability packed into bits, a row of `part_capacity` bits per store.
+    When the dictionary outgrows the capacity or the reserved header, the file is rewritten once with double the size.
+    """
+
+    def __init__(
+        self,
+        path,
+        store_capacity: int = 64,
+        part_capacity: int = 16,
+        header_size=16384,
+        read_only=False,
+    ):
+        """Open (and create if needed) the file.
+
+        Args:
+            path (str): the path to the file.
+            store_capacity (int, optional): the initial number of stores a record has room for. Defaults to 64.
+            part_capacity (int, optional): the initial number of parts a record has room for. Defaults to 16.
+            header_size (int, optional): the initial number of bytes reserved for the dictionary. Defaults to 16384.
+            read_only (bool, optional): whether the file is only read, e.g. while another instance appends to it. The file must exist and is never modified. Defaults to False.
+        """
+        self.path = Path(path)
+        self.store_numbers: list[str] = list()
+        self.part_numbers: list[str] = list()
+        self.stores: dict[str, int] = dict()
+        self.parts: dict[str, int] = dict()
+        self.store_capacity = store_capacity
+        self.part_capacity = part_capacity
+        self.header_size = header_size
+        self.read_only = read_only
+        self.view: np.memmap = None
+        # the file rows and columns of the stores and parts of the last index, and the last packed record
+        self.mapped_index: tuple = None
+        self.rows: np.ndarray = None
+        self.columns: np.ndarray = None
+        self.packed_version = None
+        self.packed: bytes = None
+        if self.path.exists() or read_only:
+            self.load()
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("wb") as fp:
+                self.write_header(fp)
+
+    @property
+    def bits_size(self) -> int:
+        """The number of bytes of the packed availability of a record."""
+        return -(-self.store_capacity * self.part_capacity // 8)
+
+    @property
+    def record_size(self) -> int:
+        """The number of bytes of a record, aligned to 8 bytes."""
+        return -(-(8 + self.bits_size) // 8) * 8
+
+    @property
+    def data_offset(self) -> int:
+        return PREAMBLE.size + self.header_size
+
+    def get_dtype(self) -> np.dtype:
+        return np.dtype(
+            {
+                "names": ["timestamp", "bits"],
+                "formats": ["<i8", ("u1", (self.bits_size,))],
+                "offsets": [0, 8],
+                "itemsize": self.record_size,
+            }
+        )
+
+    def __len__(self) -> int:
+        return (self.path.stat().st_size - self.data_offset) // self.record_size
+
+    def encode_header(self) -> bytes:
+        return json.dumps(
+            {"stores": self.store_numbers, "parts": self.part_numbers}
+        ).encode()
+
+    def write_header(self, fp):
+        """Write the preamble and the dictionary at the start of the file."""
+        header = self.encode_header()
+        fp.seek(0)
+        fp.write(
+            PREAMBLE.pack(
+                MAGIC,
+                FORMAT_VERSION,
+                self.header_size,
+                self.store_capacity,
+                self.part_capacity,
+            )
+        )
+        fp.write(header.ljust(self.header_size, b" "))
+
+    def load(self):
+        """Read the preamble and the dictionary, and drop a record that was only partially written.
+
+        A read-only instance can call this again to pick up new stores and parts and a grown file, a partially written record is then left alone and ignored.
+        """
+        with self.path.open("rb") as fp:
+            magic, version, header_size, store_capacity, part_capacity = (
+                PREAMBLE.unpack(fp.read(PREAMBLE.size))
+            )
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"{self.path} is not an availability history file")
+            self.header_size = header_size
+            self.store_capacity = store_capacity
+            self.part_capacity = part_capacity
+            header = json.loads(fp.read(header_size))
+        self.store_numbers = header["stores"]
+        self.part_numbers = header["parts"]
+        self.stores = {number: row for row, number in enumerate(self.store_numbers)}
+        self.parts = {number: column for column, number in enumerate(self.part_numbers)}
+        self.view = None
+        size = self.data_offset + len(self) * self.record_size
+        if not self.read_only and self.path.stat().st_size != size:
+            os.truncate(self.path, size)
+
+    def map_index(self, index: AvailabilityIndex):
+        """Map the stores and parts of the index to the rows and columns of the file, adding the new ones to the dictionary."""
+        key = (id(index), index.shape)
+        if self.mapped_index == key:
+            return
+        added = False
+        for number in index.store_numbers:
+            if number not in self.stores:
+                self.stores[number] = len(self.store_numbers)
+                self.store_numbers.append(number)
+                added = True
+        for number in index.part_numbers:
+            if number not in self.parts:
+                self.parts[number] = len(self.part_numbers)
+                self.part_numbers.append(number)
+                added = True
+        if added:
+            self.save_dictionary()
+        self.rows = np.array(
+            [self.stores[number] for number in index.store_numbers], dtype=int
+        )
+        self.columns = np.array(
+            [self.parts[number] for number in index.part_numbers], dtype=int
+        )
+        self.mapped_index = key
+        self.packed_version = None
+
+    def save_dictionary(self):
+        """Write the dictionary to the file, growing the file if it no longer fits."""
+        store_capacity, part_capacity, header_size = (
+            self.store_capacity,
+            self.part_capacity,
+            self.header_size,
+        )
+        while len(self.store_numbers) > store_capacity:
+            store_capacity *= 2
+        while len(self.part_numbers) > part_capacity:
+            part_capacity *= 2
+        while len(self.encode_header()) > header_size:
+            header_size *= 2
+        if (store_capacity, part_capacity, header_size) != (
+            self.store_capacity,
+            self.part_capacity,
+            self.header_size,
+        ):
+            self.grow(store_capacity, part_capacity, header_size)
+            return
+        with self.path.open("r+b") as fp:
+            self.write_header(fp)
+
+    def grow(self, store_capacity: int, part_capacity: int, header_size: int):
+        """Rewrite the file with a larger capacity and header, replacing it atomically."""
+        old = self.get_view()
+        old_shape = (self.store_capacity, self.part_capacity)
+        self.view = None
+        self.store_capacity = store_capacity
+        self.part_capacity = part_capacity
+        self.header_size = header_size
+        temporary_path = self.path.with_suffix(".tmp")
+        with temporary_path.open("wb") as fp:
+            self.write_header(fp)
+            for start in range(0, len(old), GROW_BATCH_SIZE):
+                batch = old[start : start + GROW_BATCH_SIZE]
+                grids = np.unpackbits(
+                    batch["bits"], axis=1, count=old_shape[0] * old_shape[1]
+                ).reshape(len(batch), *old_shape)
+                records = np.zeros(len(batch), dtype=self.get_dtype())
+                records["timestamp"] = batch["timestamp"]
+                grown = np.zeros(
+                    (len(batch), store_capacity, part_capacity), dtype=np.uint8
+                )
+                grown[:, : old_shape[0], : old_shape[1]] = grids
+                records["bits"] = np.packbits(grown.reshape(len(batch), -1), axis=1)
+                fp.write(records.tobytes())
+        del old
+        os.replace(temporary_path, self.path)
+        self.packed_version = None
+
+    def pack(self, timestamp: int, matrix: AvailabilityMatrix) -> bytes:
+        """Pack the availability of a poll into a record."""
+        self.map_index(matrix.index)
+        grid = np.zeros((self.store_capacity, self.part_capacity), dtype=bool)
+        rows, columns = matrix.shape
+        grid[np.ix_(self.rows[:rows], self.columns[:columns])] = matrix.available
+        record = np.zeros(1, dtype=self.get_dtype())
+        record["timestamp"] = timestamp
+        record["bits"] = np.packbits(grid, axis=None)
+        return record.tobytes()
+
+    def append(self, timestamp: int, matrix: AvailabilityMatrix, version: int = None):
+        """Append the availability of a poll, the bits are only packed again if the matrix version changed."""
+        self.map_index(matrix.index)
+        if version is None or version != self.packed_version:
+            self.packed = self.pack(timestamp, matrix)
+            self.packed_version = version
+        record = np.frombuffer(self.packed, dtype=self.get_dtype()).copy()
+        record["timestamp"] = timestamp
+        with self.path.open("ab") as fp:
+            fp.write(record.tobytes())
+
+    def get_view(self) -> np.ndarray:
+        """Get a read-only memory-mapped view of all records, with a `timestamp` and a `bits` field."""
+        count = len(self)
+        if count == 0:
+            return np.zeros(0, dtype=self.get_dtype())
+        if self.view is None or len(self.view) != count:
+            self.view = np.memmap(
+                self.path,
+                dtype=self.get_dtype(),
+                mode="r",
+                offset=self.data_offset,
+                shape=(count,),
+            )
+        return self.view
+
+    def get_timestamps(self) -> np.ndarray:
+        """Get a view of the timestamps of all polls."""
+        return self.get_view()["timestamp"]
+
+    def get_series(self, store_number: str, part_number: str) -> np.ndarray:
+        """Get the availability of a part in a store over all polls, or None if it was never seen."""
+        row = self.stores.get(store_number)
+        column = self.parts.get(part_number)
+        if row is None or column is None:
+            return None
+        position = row * self.part_capacity + column
+        # only a single byte per record is read from the file
+        bits = self.get_view()["bits"][:, position // 8]
+        return ((bits >> (7 - position % 8)) & 1).astype(bool)
+
+    def unpack(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """Unpack the availability of a range of polls to a (polls, stores, parts) array, limited to the stores and parts in the dictionary."""
+        records = self.get_view()[start:stop]
+        grids = np.unpackbits(
+            records["bits"], axis=1, count=self.store_capacity * self.part_capacity
+        ).reshape(len(records), self.store_capacity, self.part_capacity)
+        return grids[:, : len(self.store_numbers), : len(self.part_numbers)].astype(
+            bool
+        )
+
+    def close(self):
+        """Release the memory-mapped view."""
+        self.view = None
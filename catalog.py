@@ -0,0 +1,87 @@
+"""Module for caching the product catalog of a device family on disk and matching the configured devices in it."""
+
+import re
+import json
+import time
+from pathlib import Path
+
+
+class DeviceMatcher:
+    """Class to match products against the configured models and carriers, using a precompiled pattern."""
+
+    def __init__(self, models: list[str], carriers: list[str]):
+        """Compile the models into a single pattern, models are partially matched. Empty lists match everything."""
+        self.pattern = (
+            re.compile("|".join(re.escape(model) for model in models))
+            if len(models) > 0
+            else None
+        )
+        self.carriers = frozenset(carriers)
+
+    def matches(self, model: str, carrier: str) -> bool:
+        """Whether the product with this model and carrier is requested."""
+        return (
+            self.pattern is None
+            or (model is not None and self.pattern.search(model) is not None)
+        ) and (len(self.carriers) == 0 or carrier in self.carriers)
+
+    def filter(self, products: list[dict]) -> list[dict]:
+        """Get the requested products from a catalog."""
+        return [
+            product
+            for product in products
+            if self.matches(product.get("model"), product.get("carrier"))
+        ]
+
+
+def diff_devices(old: list[dict], new: list[dict]) -> tuple[list[dict], list[dict]]:
+    """Compare two device lists by model, returns the added and the removed devices."""
+    old_models = set(device.get("model") for device in old)
+    new_models = set(device.get("model") for device in new)
+    added = [device for device in new if device.get("model") not in old_models]
+    removed = [device for device in old if device.get("model") not in new_models]
+    return added, removed
+
+
+class CatalogCache:
+    """Class for storing product catalogs on disk, keyed by country code and device family, with a time-to-live."""
+
+    def __init__(self, settings: dict = None):
+        """Initialization.
+
+        Args:
+            settings (dict, optional): the `[cache]` section of the configuration. Defaults to None, in which case the defaults are used.
+        """
+        settings = settings or {}
+        self.directory = Path(settings.get("path", "cache"))
+        self.ttl_seconds = settings.get("catalog_ttl_seconds", 6 * 60 * 60)
+
+    def get_path(self, country_code: str, device_family: str) -> Path:
+        """Get the path of the cache file of a catalog."""
+        key = re.sub(r"[^\w-]", "_", f"{country_code}_{device_family}".lower())
+        return self.directory / f"catalog_{key}.json"
+
+    def load(self, country_code: str, device_family: str) -> tuple[list[dict], float]:
+        """Load a catalog from disk, returns the products and the epoch time they were fetched, or None if it is not cached."""
+        path = self.get_path(country_code, device_family)
+        if not path.exists():
+            return None
+        try:
+            with path.open() as fp:
+                cached = json.load(fp)
+            return cached["products"], cached["fetched_at"]
+        except (ValueError, KeyError):
+            return None
+
+    def save(self, country_code: str, device_family: str, products: list[dict]):
+        """Atomically write a catalog to disk."""
+        path = self.get_path(country_code, device_family)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix(".tmp")
+        with temporary_path.open("w") as fp:
+            json.dump({"fetched_at": time.time(), "products": products}, fp)
+        temporary_path.replace(path)
+
+    def is_expired(self, fetched_at: float) -> bool:
+        """Whether a catalog fetched at the given epoch time should be refreshed."""
+        return time.time() - fetched_at > self.ttl_seconds
@@ -34,13 +34,16 @@ class ConfigHandler:
         with self.configfile_path.open("w+") as fp:
             dump(self.__doc, fp)
 
-    def get(self, keys: list[str]):
-        """Get a value from the config."""
+    def get(self, keys: list[str], default=None):
+        """Get a value from the config, or the default if it or one of its tables is missing (e.g. in configs of earlier versions)."""
         val = self.__doc.get(keys.pop(0)) if len(keys) > 0 else self.__doc
         while len(keys) > 0:
             key = keys.pop(0)
-            val = val[key]
-        return val
+            try:
+                val = val[key]
+            except (KeyError, IndexError, TypeError):
+                return default
+        return default if val is None else val
 
     def set(self, keys: list[str], value: any):
         """Set a value in the config. Auto-update config on disk if enabled."""
@@ -51,6 +54,14 @@ class ConfigHandler:
         if self.auto_update:
             self.write()
 
+    def get_profiles(self) -> list[tuple[dict, "Configuration"]]:
+        """Get the additional search profiles, each with its search configuration."""
+        profiles = self.__doc.get("profiles") or []
+        return [
+            (profile, Configuration(self, ["profiles", index, "search"]))
+            for index, profile in enumerate(profiles)
+        ]
+
     def is_outdated(self) -> bool:
         """Checks if the in-memory doc is outdated compared to the on-disk file."""
         return self.__get_contents_on_disk() != self.__doc
@@ -72,8 +83,8 @@ class ConfigHandler:
 class Configuration:
     """Create a configuration of the device and region to search."""
 
-    def __init__(self, confighandler: ConfigHandler):
-        searchconfig = confighandler.get(["search"])
+    def __init__(self, confighandler: ConfigHandler, keys: list = None):
+        searchconfig = confighandler.get(keys if keys is not None else ["search"])
         self.country_code = searchconfig.get("country_code", "us")
         self.device_family = searchconfig.get("device_family")
         self.zip_code = searchconfig.get("zip_code", None)
@@ -81,6 +92,9 @@ class Configuration:
         self.selected_carriers = searchconfig.get("carriers", [])
         self.selected_stores = searchconfig.get("stores", [])
         self.appointment_stores = searchconfig.get("appointment_stores", [])
+        self.appointment_interval_seconds = searchconfig.get(
+            "appointment_interval_seconds", 900
+        )
         self.regions = self.get_regions()
 
     def get_regions(self) -> list[str]:
@@ -0,0 +1,110 @@
+"""Module for decoding Apple availability responses once into compact records with only the fields that are used."""
+
+import sys
+import time
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    # orjson is optional, it only speeds up the decoding
+    import json
+
+    loads = json.loads
+
+
+class PartRecord:
+    """The availability of a part (device model) in a store."""
+
+    __slots__ = ("part_number", "title", "available")
+
+    def __init__(self, part_number: str, title: str, available: bool):
+        self.part_number = part_number
+        self.title = title
+        self.available = available
+
+    def __repr__(self) -> str:
+        return f"PartRecord({self.part_number!r}, {self.title!r}, {self.available!r})"
+
+
+class StoreRecord:
+    """A store with the availability of the requested parts, keyed by part number."""
+
+    __slots__ = ("store_number", "name", "city", "sequence", "parts")
+
+    def __init__(
+        self,
+        store_number: str,
+        name: str,
+        city: str,
+        sequence: int,
+        parts: dict[str, PartRecord],
+    ):
+        self.store_number = store_number
+        self.name = name
+        self.city = city
+        self.sequence = sequence
+        self.parts = parts
+
+    def with_parts(self, parts: dict[str, PartRecord]) -> "StoreRecord":
+        """Get a copy of the store with other parts."""
+        return StoreRecord(
+            self.store_number, self.name, self.city, self.sequence, parts
+        )
+
+    def __repr__(self) -> str:
+        return f"StoreRecord({self.store_number!r}, {self.name!r}, parts={list(self.parts.values())!r})"
+
+
+def decode_part(part_number: str, part: dict) -> PartRecord:
+    """Decode the availability of a single part."""
+    regular = (part.get("messageTypes") or {}).get("regular") or {}
+    return PartRecord(
+        part.get("partNumber", part_number),
+        regular.get("storePickupProductTitle"),
+        bool(regular.get("storeSelectionEnabled")),
+    )
+
+
+def decode_availability(content: bytes) -> list[StoreRecord]:
+    """Decode a pickup-message response body into store records, returns None if it is not a valid response."""
+    try:
+        document = loads(content)
+        stores = document.get("body").get("stores")
+        if stores is None:
+            return None
+        return [
+            StoreRecord(
+                store.get("storeNumber"),
+                store.get("storeName"),
+                store.get("city"),
+                store.get("storeListNumber"),
+                {
+                    part_number: decode_part(part_number, part)
+                    for part_number, part in (
+                        store.get("partsAvailability") or {}
+                    ).items()
+                },
+            )
+            for store in stores
+        ]
+    except (ValueError, AttributeError, TypeError):
+        # an unexpected payload, e.g. a field that is not an object
+        return None
+
+
+def benchmark_decoding(content: bytes, repeat=100) -> float:
+    """Measure the average time in seconds it takes to decode a response body."""
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        decode_availability(content)
+    return (time.perf_counter() - start_time) / repeat
+
+
+if __name__ == "__main__":
+    # benchmark the decoding of a stored response, e.g. `python decoding.py response.json`
+    with open(sys.argv[1], "rb") as fp:
+        content = fp.read()
+    print(f"Backend: {loads.__module__}")
+    print(f"Decoding took {round(benchmark_decoding(content) * 1000, 3)} ms on average")
@@ -0,0 +1,253 @@
+"""Module for forecasting the restocks of every store and part from the availability history."""
+
+import time
+import asyncio
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+
+from analytics import hours_of_week, format_duration
+from availability_history import AvailabilityHistory
+from scheduler import HOURS_PER_WEEK, hour_of_week
+
+# the number of polls unpacked from the availability history at once
+BATCH_SIZE = 4096
+NANOSECONDS_PER_HOUR = 3600 * 10**9
+
+
+class RestockForecaster:
+    """Class estimating per store and part the probability of a restock within the next minutes and the expected time until the next restock.
+
+    Restocks are modelled as a Poisson process with a rate per hour of the week: the number of restocks in that hour divided by the time the part was sold out in that hour.
+    The rates are shrunk towards the overall rate of the store and part, which is shrunk towards the rate of all stores and parts, so hours with little history still get a sensible estimate.
+    The counts are updated with only the polls appended since the last fit, in a background thread.
+    The fitted model is replaced at once, so queries never see a partial fit.
+    """
+
+    def __init__(self, path, settings: dict = None):
+        """Initialization.
+
+        Args:
+            path (str): the path to the availability history file, which is only read.
+            settings (dict, optional): the `[forecast]` section of the configuration. Defaults to None.
+        """
+        settings = settings or {}
+        self.path = Path(path)
+        self.horizon_minutes = settings.get("horizon_minutes", 30)
+        self.prior_hours = settings.get("prior_hours", 4)
+        self.max_gap_seconds = settings.get("max_gap_seconds", 3600)
+        self.retrain_interval_seconds = settings.get("retrain_interval_seconds", 300)
+        self.history: AvailabilityHistory = None
+        self.fitted_at = float("-inf")
+        self.fit_time = 0.0
+        self.count_fits = 0
+        self.retrain_task: asyncio.Task = None
+        self.reset()
+
+    def reset(self):
+        """Forget the counts and the model."""
+        self.count_polls = 0
+        self.last_timestamp: int = None
+        self.previous = np.zeros((0, 0), dtype=bool)
+        # per hour of the week, store and part: the restocks and the hours the part was sold out
+        self.restocks = np.zeros((HOURS_PER_WEEK, 0, 0))
+        self.exposure = np.zeros((HOURS_PER_WEEK, 0, 0))
+        # the fitted model: the store numbers, part numbers, rates per hour of the week and availability after the last poll
+        self.model: tuple[list[str], list[str], np.ndarray, np.ndarray] = None
+
+    def resize(self, stores: int, parts: int):
+        """Make room for new stores and parts."""
+        old_stores, old_parts = self.previous.shape
+        if (stores, parts) == (old_stores, old_parts):
+            return
+        padding = ((0, stores - old_stores), (0, parts - old_parts))
+        self.previous = np.pad(self.previous, padding)
+        self.restocks = np.pad(self.restocks, ((0, 0), *padding))
+        self.exposure = np.pad(self.exposure, ((0, 0), *padding))
+
+    def add(self, timestamps: np.ndarray, grids: np.ndarray):
+        """Add a batch of polls, with their timestamps in nanoseconds and their (polls, stores, parts) availability.
+
+        Every interval between two consecutive polls counts towards the hour of the week it starts in, intervals longer than `max_gap_seconds` (e.g. while the monitor was not running) are left out.
+        """
+        if len(timestamps) == 0:
+            return
+        self.resize(grids.shape[1], grids.shape[2])
+        starts = np.concatenate(
+            [
+                [self.last_timestamp if self.last_timestamp is not None else -1],
+                timestamps[:-1],
+            ]
+        )
+        before = np.concatenate([self.previous[np.newaxis], grids[:-1]])
+        durations = (timestamps - starts) / NANOSECONDS_PER_HOUR
+        valid = (
+            (starts >= 0) & (durations > 0) & (durations <= self.max_gap_seconds / 3600)
+        )
+        if valid.any():
+            hours = hours_of_week(starts[valid])
+            sold_out = ~before[valid]
+            np.add.at(self.exposure, hours, sold_out * durations[valid, None, None])
+            np.add.at(self.restocks, hours, sold_out & grids[valid])
+        self.count_polls += len(timestamps)
+        self.last_timestamp = int(timestamps[-1])
+        self.previous = grids[-1].copy()
+
+    def get_rates(self) -> np.ndarray:
+        """The restock rate (restocks per sold out hour) per hour of the week, store and part."""
+        # overall rate with one pseudo-restock, so stores and parts that never restocked are not ruled out forever
+        overall = (self.restocks.sum() + 1) / (self.exposure.sum() + self.prior_hours)
+        cell_rates = (self.restocks.sum(axis=0) + self.prior_hours * overall) / (
+            self.exposure.sum(axis=0) + self.prior_hours
+        )
+        return (self.restocks + self.prior_hours * cell_rates) / (
+            self.exposure + self.prior_hours
+        )
+
+    def fit(self):
+        """Add the polls appended to the availability history since the last fit and replace the model. Blocking, runs in a background thread."""
+        start_time = time.perf_counter()
+        if self.history is None:
+            if not self.path.exists():
+                return
+            self.history = AvailabilityHistory(self.path, read_only=True)
+        else:
+            # pick up new stores and parts and a grown file
+            self.history.load()
+        count = len(self.history)
+        if count < self.count_polls:
+            # the history was replaced, start over
+            self.reset()
+        timestamps = self.history.get_timestamps()
+        while self.count_polls < count:
+            stop = min(count, self.count_polls + BATCH_SIZE)
+            self.add(
+                np.asarray(timestamps[self.count_polls : stop]),
+                self.history.unpack(self.count_polls, stop),
+            )
+        self.model = (
+            list(self.history.store_numbers),
+            list(self.history.part_numbers),
+            self.get_rates(),
+            self.previous.copy(),
+        )
+        self.fit_time = time.perf_counter() - start_time
+        self.count_fits += 1
+
+    def start_retraining(self):
+        """Fit the new polls in the background if the last fit is older than the retrain interval, unless a fit is already running."""
+        if self.retrain_task is not None and not self.retrain_task.done():
+            return
+        if time.time() - self.fitted_at < self.retrain_interval_seconds:
+            return
+        self.fitted_at = time.time()
+        self.retrain_task = asyncio.create_task(self.retrain())
+
+    async def retrain(self):
+        """Fit the new polls in a thread, so the event loop keeps running."""
+        try:
+            await asyncio.to_thread(self.fit)
+        except (OSError, ValueError) as error:
+            # e.g. the dictionary was read while it was being written, the next retraining tries again
+            print(f"Failed to retrain the restock forecast: {error}")
+
+    @staticmethod
+    def get_segments(now: float, hours: float) -> tuple[np.ndarray, np.ndarray]:
+        """Split the period of `hours` from `now` (epoch seconds) at the hour boundaries, returns the hour of the week and the length in hours of each segment."""
+        moment = datetime.fromtimestamp(now)
+        offset = moment.minute / 60 + moment.second / 3600
+        # the boundaries relative to now, the first and last segment can be partial
+        boundaries = np.arange(1 - offset, hours, 1.0)
+        edges = np.concatenate([[0.0], boundaries, [hours]])
+        lengths = np.diff(edges)
+        segment_hours = (hour_of_week(now) + np.arange(len(lengths))) % HOURS_PER_WEEK
+        keep = lengths > 0
+        return segment_hours[keep], lengths[keep]
+
+    def get_probabilities(self, minutes: float = None, now: float = None) -> np.ndarray:
+        """The probability of a restock within the next minutes per store and part, parts in stock count as restocked.
+
+        Returns an empty array if the model was not fitted yet.
+        """
+        if self.model is None:
+            return np.zeros((0, 0))
+        minutes = self.horizon_minutes if minutes is None else minutes
+        now = time.time() if now is None else now
+        _, _, rates, available = self.model
+        hours, lengths = self.get_segments(now, minutes / 60)
+        hazard = (rates[hours] * lengths[:, np.newaxis, np.newaxis]).sum(axis=0)
+        probabilities = 1 - np.exp(-hazard)
+        probabilities[available] = 1.0
+        return probabilities
+
+    def get_expected_hours(self, now: float = None) -> np.ndarray:
+        """The expected number of hours until the next restock per store and part, zero for parts in stock.
+
+        The survival function of the process is integrated over the coming week, as the rates repeat every week the weeks after follow as a geometric series.
+        """
+        if self.model is None:
+            return np.zeros((0, 0))
+        now = time.time() if now is None else now
+        _, _, rates, available = self.model
+        hours, lengths = self.get_segments(now, HOURS_PER_WEEK)
+        segment_rates = rates[hours]
+        segment_hazards = segment_rates * lengths[:, np.newaxis, np.newaxis]
+        hazard_before = np.cumsum(segment_hazards, axis=0) - segment_hazards
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # the integral of exp(-hazard) over each segment
+            integrals = np.exp(-hazard_before) * np.where(
+                segment_rates > 0,
+                -np.expm1(-segment_hazards) / segment_rates,
+                lengths[:, np.newaxis, np.newaxis],
+            )
+            expected = integrals.sum(axis=0) / -np.expm1(-segment_hazards.sum(axis=0))
+        expected[available] = 0.0
+        return expected
+
+    def get_part_probabilities(
+        self, minutes: float = None, now: float = None
+    ) -> dict[str, float]:
+        """The probability that a part restocks in any store within the next minutes."""
+        if self.model is None:
+            return dict()
+        _, part_numbers, _, _ = self.model
+        probabilities = self.get_probabilities(minutes, now)
+        anywhere = 1 - np.prod(1 - probabilities, axis=0)
+        return dict(zip(part_numbers, anywhere.tolist()))
+
+    def get_status(self) -> str:
+        """Generate a status message of the fits."""
+        return f"Fitted {self.count_fits} times on {self.count_polls} polls, the last fit took {round(self.fit_time, 3)} seconds."
+
+    def get_summary(
+        self,
+        store_names: dict = None,
+        part_titles: dict = None,
+        minutes: float = None,
+        top=10,
+        now: float = None,
+    ) -> str:
+        """Generate a HTML message with the stores and parts most likely to restock."""
+        if self.model is None:
+            return (
+                "The restock forecast is not trained yet, try again after a few polls."
+            )
+        store_names = store_names or {}
+        part_titles = part_titles or {}
+        minutes = self.horizon_minutes if minutes is None else minutes
+        store_numbers, part_numbers, _, available = self.model
+        probabilities = self.get_probabilities(minutes, now)
+        expected = self.get_expected_hours(now)
+        message = f"<b>Restock forecast</b> for the next {minutes} minutes \n"
+        # rank the sold out stores and parts, the ones in stock are already known
+        order = np.argsort(-np.where(available, -1, probabilities), axis=None)
+        ranked = [
+            np.unravel_index(position, probabilities.shape)
+            for position in order[: min(top, (~available).sum())]
+        ]
+        for row, column in ranked:
+            store_number = store_numbers[row]
+            part_number = part_numbers[column]
+            message += f"{part_titles.get(part_number) or part_number} at {store_names.get(store_number, store_number)}: {round(probabilities[row, column] * 100, 1)}%, expected in {format_duration(expected[row, column] * NANOSECONDS_PER_HOUR)}\n"
+        return message.strip("\n")
@@ -0,0 +1,248 @@
+"""Module for persisting the poll history append-only in a SQLite database and keeping the most recent polls in memory."""
+
+import sqlite3
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from utils import format_timestamp, parse_datetimestamp
+
+COLUMNS = ("availability", "timestamp", "processing_time")
+# the timestamps are in nanoseconds since the epoch (UTC), they are only formatted for display
+DTYPES = {"availability": bool, "timestamp": np.int64, "processing_time": np.float64}
+
+
+def parse_datetimestamps(datetimestamps) -> list:
+    """Parse the dates and times stored by earlier versions to epoch timestamps in nanoseconds, None for those that can not be parsed."""
+    timestamps = list()
+    for datetimestamp in datetimestamps:
+        try:
+            timestamps.append(parse_datetimestamp(str(datetimestamp)))
+        except ValueError:
+            timestamps.append(None)
+    return timestamps
+
+
+class HistoryStore:
+    """Class to append polls to a SQLite database in write-ahead-log mode, so saving only costs the new polls.
+
+    Each append is a single atomic transaction, an interrupted save never leaves a partially written history behind.
+    """
+
+    def __init__(self, path="data.sqlite"):
+        """Open (and create if needed) the database.
+
+        Args:
+            path (str, optional): the path to the database file. Defaults to "data.sqlite".
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # with a write-ahead log, a commit is durable against crashes of the process without syncing every write
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS polls (id INTEGER PRIMARY KEY, availability INTEGER NOT NULL, timestamp INTEGER NOT NULL, processing_time REAL NOT NULL)"
+            )
+        self.migrate_datetimestamps()
+
+    def migrate_datetimestamps(self):
+        """Convert a history with the formatted dates and times of earlier versions to epoch timestamps, once."""
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(polls)")
+        ]
+        if "datetimestamp" not in columns:
+            return
+        rows = self.connection.execute(
+            "SELECT availability, datetimestamp, processing_time FROM polls ORDER BY id"
+        ).fetchall()
+        timestamps = parse_datetimestamps(row[1] for row in rows)
+        with self.connection:
+            self.connection.execute("DROP TABLE polls")
+            self.connection.execute(
+                "CREATE TABLE polls (id INTEGER PRIMARY KEY, availability INTEGER NOT NULL, timestamp INTEGER NOT NULL, processing_time REAL NOT NULL)"
+            )
+            self.connection.executemany(
+                "INSERT INTO polls (availability, timestamp, processing_time) VALUES (?, ?, ?)",
+                (
+                    (availability, timestamp, processing_time)
+                    for (availability, _, processing_time), timestamp in zip(
+                        rows, timestamps
+                    )
+                    if timestamp is not None
+                ),
+            )
+
+    def count(self) -> int:
+        """The number of polls in the history."""
+        return self.connection.execute("SELECT COUNT(*) FROM polls").fetchone()[0]
+
+    def append(self, records: list[dict]):
+        """Append the polls to the history in a single transaction."""
+        if len(records) == 0:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO polls (availability, timestamp, processing_time) VALUES (?, ?, ?)",
+                (
+                    (
+                        bool(record["availability"]),
+                        int(record["timestamp"]),
+                        float(record["processing_time"]),
+                    )
+                    for record in records
+                ),
+            )
+
+    def load(self) -> list[dict]:
+        """Load all polls in the order they were recorded."""
+        cursor = self.connection.execute(
+            "SELECT availability, timestamp, processing_time FROM polls ORDER BY id"
+        )
+        return [
+            {
+                "availability": bool(availability),
+                "timestamp": timestamp,
+                "processing_time": processing_time,
+            }
+            for availability, timestamp, processing_time in cursor
+        ]
+
+    def load_columns(self, limit: int = None) -> dict[str, np.ndarray]:
+        """Load the last `limit` polls (all if None) as a column per field."""
+        query = "SELECT id, availability, timestamp, processing_time FROM polls"
+        if limit is not None:
+            query = f"SELECT * FROM ({query} ORDER BY id DESC LIMIT {int(limit)})"
+        rows = self.connection.execute(f"{query} ORDER BY id").fetchall()
+        return {
+            name: np.array([row[index] for row in rows], dtype=DTYPES[name])
+            for index, name in enumerate(COLUMNS, start=1)
+        }
+
+    def migrate_csv(self, csv_path) -> int:
+        """Import the polls of a CSV file written by earlier versions, if the history is still empty. Returns the number of imported polls."""
+        csv_path = Path(csv_path)
+        if not csv_path.exists() or self.count() > 0:
+            return 0
+        df = pd.read_csv(csv_path, index_col=[0])
+        if "timestamp" not in df.columns:
+            # earlier versions stored the local date and time as formatted text
+            df["timestamp"] = pd.Series(
+                parse_datetimestamps(df["datetimestamp"]), index=df.index, dtype=object
+            )
+        records = df[list(COLUMNS)].dropna().to_dict("records")
+        self.append(records)
+        return len(records)
+
+    def export_csv(self, csv_path) -> Path:
+        """Write the full history to a CSV file with the timestamps also formatted as local date and time, returns the path."""
+        csv_path = Path(csv_path)
+        df = pd.DataFrame(self.load(), columns=list(COLUMNS))
+        df["datetimestamp"] = [
+            format_timestamp(timestamp) for timestamp in df["timestamp"]
+        ]
+        df.to_csv(csv_path)
+        return csv_path
+
+    def close(self):
+        """Close the database."""
+        self.connection.close()
+
+
+class HistoryBuffer:
+    """Class keeping the most recent polls in memory as a numpy array per column.
+
+    The arrays grow in chunks up to `max_size` polls, after that the oldest chunk is dropped, first spilling the polls that were not saved yet.
+    The columns are returned as views without copying, which stay valid until the next append.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 100000,
+        chunk_size: int = 4096,
+        spill: Callable[[list[dict]], None] = None,
+    ):
+        """Initialization.
+
+        Args:
+            max_size (int, optional): the maximum number of polls kept in memory. Defaults to 100000.
+            chunk_size (int, optional): the number of polls the arrays grow or shrink by at once. Defaults to 4096.
+            spill (Callable, optional): function saving the unsaved polls that are about to be dropped. Defaults to None.
+        """
+        self.chunk_size = max(1, chunk_size)
+        self.max_size = max(self.chunk_size, max_size)
+        self.spill = spill
+        self.columns = {
+            name: np.empty(0, dtype=dtype) for name, dtype in DTYPES.items()
+        }
+        self.size = 0
+        self.count_saved = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def get_capacity(self) -> int:
+        return len(self.columns["availability"])
+
+    def column(self, name: str) -> np.ndarray:
+        """Get a view of a column of the polls in memory."""
+        return self.columns[name][: self.size]
+
+    def get_records(self, start: int, stop: int) -> list[dict]:
+        """Get the polls in a range as a record per poll."""
+        return [
+            dict(zip(COLUMNS, values))
+            for values in zip(
+                *(self.columns[name][start:stop].tolist() for name in COLUMNS)
+            )
+        ]
+
+    def get_unsaved_records(self) -> list[dict]:
+        """Get the polls that were appended since they were last marked as saved."""
+        return self.get_records(self.count_saved, self.size)
+
+    def mark_saved(self):
+        """Mark all polls in memory as saved."""
+        self.count_saved = self.size
+
+    def reserve(self):
+        """Make room for at least one more poll, by growing the arrays or dropping the oldest chunk."""
+        capacity = self.get_capacity()
+        if self.size < capacity:
+            return
+        if capacity < self.max_size:
+            capacity = min(self.max_size, capacity + self.chunk_size)
+            for name, column in self.columns.items():
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[: self.size] = column[: self.size]
+                self.columns[name] = grown
+            return
+        if self.count_saved < self.chunk_size and self.spill is not None:
+            self.spill(self.get_records(self.count_saved, self.chunk_size))
+        for column in self.columns.values():
+            column[: self.size - self.chunk_size] = column[self.chunk_size : self.size]
+        self.size -= self.chunk_size
+        self.count_saved = max(0, self.count_saved - self.chunk_size)
+
+    def append(self, availability: bool, timestamp: int, processing_time: float):
+        """Append a poll."""
+        self.reserve()
+        self.columns["availability"][self.size] = availability
+        self.columns["timestamp"][self.size] = timestamp
+        self.columns["processing_time"][self.size] = processing_time
+        self.size += 1
+
+    def load(self, columns: dict[str, np.ndarray]):
+        """Replace the polls in memory by the last `max_size` of the saved polls in the columns."""
+        size = min(self.max_size, len(columns["availability"]))
+        capacity = min(
+            self.max_size, -(-max(size, 1) // self.chunk_size) * self.chunk_size
+        )
+        for name, dtype in DTYPES.items():
+            self.columns[name] = np.empty(capacity, dtype=dtype)
+            self.columns[name][:size] = columns[name][len(columns[name]) - size :]
+        self.size = size
+        self.count_saved = size
@@ -0,0 +1,197 @@
+import random
+import threading
+import time
+from collections import deque
+
+__author__ = 'pgaref'
+
+
+class ProxyStats(object):
+    """ The track record of a proxy in the pool """
+    __slots__ = ('proxy', 'address', 'latency', 'success_rate', 'last_failure', 'consecutive_failures', 'in_use',
+                 'position', 'removed')
+
+    def __init__(self, proxy, latency):
+        self.proxy = proxy
+        self.address = proxy.get_address()
+        self.latency = latency
+        self.success_rate = 1.0
+        self.last_failure = None
+        self.consecutive_failures = 0
+        self.in_use = 0
+        # index in the list of active proxies, None while quarantined
+        self.position = None
+        self.removed = False
+
+    def get_score(self):
+        """ The expected time per successful request, lower is better """
+        return self.latency / max(self.success_rate, 0.01)
+
+
+class ProxyPool(object):
+    def __init__(self, proxies=(), max_in_use=2, ewma_alpha=0.3, quarantine_seconds=300, max_failures=3,
+                 initial_latency=5.0, sample_attempts=8):
+        """ Pool of proxies that prefers fast and reliable proxies, with O(1) selection, removal and quarantine
+
+        A proxy is chosen by the power of two choices: of two random proxies the one with the lowest expected time per
+        successful request (EWMA latency / EWMA success rate) is used.
+        The active proxies are kept in a list with the position of each proxy, so a proxy is removed by swapping it
+        with the last one. A failed proxy is quarantined for a fixed duration, so the quarantine is a FIFO queue.
+
+        :param proxies: The proxies (ProxyObject) to start with
+        :param max_in_use: The maximum number of requests using the same proxy at the same time
+        :param ewma_alpha: The weight of the newest measurement in the moving averages of latency and success rate
+        :param quarantine_seconds: How long a failed proxy is not used
+        :param max_failures: After how many consecutive failures a proxy is removed instead of quarantined
+        :param initial_latency: The latency in seconds assumed for a proxy that was not measured yet
+        :param sample_attempts: How many pairs are sampled to find a proxy below the concurrency cap
+        """
+        self.max_in_use = max_in_use
+        self.ewma_alpha = ewma_alpha
+        self.quarantine_seconds = quarantine_seconds
+        self.max_failures = max_failures
+        self.initial_latency = initial_latency
+        self.sample_attempts = sample_attempts
+        # selection happens on the event loop, the requests and their outcomes in worker threads
+        self.lock = threading.RLock()
+        self.stats = dict()
+        self.active = list()
+        self.quarantine = deque()
+        self.count_selections = 0
+        self.count_quarantined = 0
+        self.count_removed = 0
+        for proxy in proxies:
+            self.add(proxy)
+
+    def __len__(self):
+        """ The number of proxies that are not quarantined, after returning the proxies whose quarantine is over """
+        with self.lock:
+            self.release_quarantined(time.monotonic())
+            return len(self.active)
+
+    def is_empty(self):
+        """ Whether there are no proxies left at all, neither active nor quarantined """
+        with self.lock:
+            return len(self.stats) == 0
+
+    def add(self, proxy, latency=None):
+        """ Add a proxy, or update its latency if it is already in the pool """
+        with self.lock:
+            stats = self.stats.get(proxy.get_address())
+            if stats is None:
+                stats = ProxyStats(proxy, self.initial_latency if latency is None else latency)
+                self.stats[stats.address] = stats
+                self.activate(stats)
+            elif latency is not None:
+                stats.latency = latency
+            return stats
+
+    def activate(self, stats):
+        stats.position = len(self.active)
+        self.active.append(stats)
+
+    def deactivate(self, stats):
+        """ Take a proxy out of the active list by moving the last proxy into its place """
+        if stats.position is None:
+            return
+        last = self.active.pop()
+        if last is not stats:
+            self.active[stats.position] = last
+            last.position = stats.position
+        stats.position = None
+
+    def release_quarantined(self, now):
+        """ Put the proxies whose quarantine is over back into the active list """
+        while len(self.quarantine) > 0 and self.quarantine[0][0] <= now:
+            _, stats = self.quarantine.popleft()
+            if not stats.removed and stats.position is None:
+                self.activate(stats)
+
+    def get_stats(self, proxy):
+        return self.stats.get(proxy.get_address())
+
+    def select(self, acquire=False):
+        """ Choose a proxy by the power of two choices, or None if there are none
+
+        :param acquire: Whether to only choose a proxy below the concurrency cap and count it as in use, the caller
+            must then call `release` when its request is done. Returns None if all sampled proxies are at the cap.
+        """
+        with self.lock:
+            self.release_quarantined(time.monotonic())
+            if len(self.active) == 0:
+                return None
+            for _ in range(self.sample_attempts if acquire else 1):
+                candidates = [self.active[i] for i in random.sample(range(len(self.active)), min(2, len(self.active)))]
+                if acquire:
+                    candidates = [stats for stats in candidates if stats.in_use < self.max_in_use]
+                if len(candidates) == 0:
+                    continue
+                chosen = min(candidates, key=ProxyStats.get_score)
+                if acquire:
+                    chosen.in_use += 1
+                self.count_selections += 1
+                return chosen.proxy
+            return None
+
+    def acquire(self, proxy):
+        """ Count a proxy as in use, regardless of the cap (e.g. when the same proxy is sustained) """
+        with self.lock:
+            stats = self.get_stats(proxy) or self.add(proxy)
+            stats.in_use += 1
+
+    def release(self, proxy):
+        """ Count a proxy as no longer in use """
+        with self.lock:
+            stats = self.get_stats(proxy)
+            if stats is not None and stats.in_use > 0:
+                stats.in_use -= 1
+
+    def record_success(self, proxy, latency):
+        """ Update the moving averages of a proxy after a successful request that took `latency` seconds """
+        with self.lock:
+            stats = self.get_stats(proxy)
+            if stats is None:
+                return
+            stats.latency += self.ewma_alpha * (latency - stats.latency)
+            stats.success_rate += self.ewma_alpha * (1.0 - stats.success_rate)
+            stats.consecutive_failures = 0
+
+    def record_failure(self, proxy):
+        """ Update the success rate of a failed proxy and quarantine it, or remove it after too many failures """
+        with self.lock:
+            stats = self.get_stats(proxy)
+            if stats is None or stats.removed:
+                return
+            stats.success_rate -= self.ewma_alpha * stats.success_rate
+            stats.last_failure = time.time()
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.max_failures:
+                self.remove(proxy)
+            elif stats.position is not None:
+                self.deactivate(stats)
+                self.quarantine.append((time.monotonic() + self.quarantine_seconds, stats))
+                self.count_quarantined += 1
+
+    def remove(self, proxy):
+        """ Remove a proxy for good """
+        with self.lock:
+            stats = self.stats.pop(proxy.get_address(), None)
+            if stats is None:
+                return
+            self.deactivate(stats)
+            stats.removed = True
+            self.count_removed += 1
+
+    def get_proxies(self):
+        """ The proxies that are not quarantined """
+        with self.lock:
+            return [stats.proxy for stats in self.active]
+
+    def get_status(self):
+        with self.lock:
+            latencies = sorted(stats.latency for stats in self.active)
+            quarantined = len(self.stats) - len(self.active)
+        median = latencies[len(latencies) // 2] if len(latencies) > 0 else 0
+        return "{0} proxies active with a median latency of {1} seconds, {2} quarantined, {3} quarantines and {4} " \
+               "removals so far.".format(len(latencies), round(median, 3), quarantined, self.count_quarantined,
+                                         self.count_removed)
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+__author__ = 'pgaref'
+
+logger = logging.getLogger(__name__)
+
+
+class ProxyValidator(object):
+    def __init__(self, check_url='https://www.apple.com/robots.txt', timeout=3, max_concurrency=100):
+        """ Validator checking candidate proxies in parallel before they are admitted to the pool
+
+        A proxy passes if a request to the check URL via the proxy succeeds (status below 400) within the timeout.
+        The time the request took is its measured latency.
+
+        :param check_url: The URL requested via each proxy
+        :param timeout: The number of seconds a proxy has to answer
+        :param max_concurrency: The maximum number of proxies checked at the same time
+        """
+        self.check_url = check_url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.count_checked = 0
+        self.count_passed = 0
+        self.total_time = 0.0
+
+    async def check(self, proxy):
+        """ Check a single proxy
+
+        :return: The latency in seconds, or None if the proxy failed
+        """
+        transport = httpx.AsyncHTTPTransport(proxy=httpx.Proxy("http://{0}".format(proxy.get_address())))
+        start = time.perf_counter()
+        try:
+            async with httpx.AsyncClient(transport=transport, timeout=self.timeout) as client:
+                response = await client.get(self.check_url)
+        except (httpx.HTTPError, OSError) as error:
+            logger.debug("Proxy {0} failed validation: {1}".format(proxy, error))
+            return None
+        latency = time.perf_counter() - start
+        if response.status_code >= 400:
+            logger.debug("Proxy {0} failed validation: HTTP Response [{1}]".format(proxy, response.status_code))
+            return None
+        return latency
+
+    async def validate(self, proxies):
+        """ Check all proxies concurrently
+
+        :return: The responsive proxies with their latency, as (proxy, latency) tuples, fastest first
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def check_limited(proxy):
+            async with semaphore:
+                return await self.check(proxy)
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(check_limited(proxy) for proxy in proxies))
+        passed = sorted(((proxy, latency) for proxy, latency in zip(proxies, latencies) if latency is not None),
+                        key=lambda item: item[1])
+        self.total_time += time.perf_counter() - start
+        self.count_checked += len(proxies)
+        self.count_passed += len(passed)
+        logger.debug(self.get_status())
+        return passed
+
+    def run(self, proxies):
+        """ Check all proxies from synchronous code, blocking until they are checked
+
+        Runs its own event loop in a separate thread, so it also works from a thread of a running event loop. From a
+        coroutine, await `validate` instead or call this via `asyncio.to_thread`, so the event loop is not blocked.
+
+        :return: The responsive proxies with their latency, as (proxy, latency) tuples, fastest first
+        """
+        # a separate thread has its own event loop
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self.validate(list(proxies))).result()
+
+    def get_status(self):
+        throughput = self.count_checked / self.total_time if self.total_time > 0 else 0
+        pass_rate = self.count_passed / self.count_checked * 100 if self.count_checked > 0 else 0
+        return "Validated {0} proxies at {1} per second, {2} passed ({3}%).".format(
+            self.count_checked, round(throughput, 1), self.count_passed, round(pass_rate, 1))
@@ -1,6 +1,5 @@
 import logging
 import os
-import random
 import sys
 import time
 
@@ -11,6 +10,7 @@ from requests.exceptions import ConnectionError
 from requests.exceptions import ReadTimeout
 
 from http_request_randomizer.requests.proxy.ProxyObject import Protocol
+from http_request_randomizer.requests.proxy.ProxyPool import ProxyPool
 from http_request_randomizer.requests.errors.ProxyListException import ProxyListException
 from http_request_randomizer.requests.parsers.FreeProxyParser import FreeProxyParser
 from http_request_randomizer.requests.parsers.ProxyForEuParser import ProxyForEuParser
@@ -31,7 +31,8 @@ handler.setFormatter(formatter)
 
 
 class RequestProxy:
-    def __init__(self, web_proxy_list=[], sustain=False, timeout=5, protocol=Protocol.HTTP, log_level=0):
+    def __init__(self, web_proxy_list=[], sustain=False, timeout=5, protocol=Protocol.HTTP, log_level=0, pool_settings={},
+                 validator=None):
         self.logger = logging.getLogger()
         self.logger.addHandler(handler)
         self.logger.setLevel(log_level)
@@ -54,23 +55,37 @@ class RequestProxy:
 
         self.sustain = sustain
         self.parsers = parsers
-        self.proxy_list = web_proxy_list
+        proxy_list = list(web_proxy_list)
         for parser in parsers:
             try:
-                size = len(self.proxy_list)
-                self.proxy_list += parser.parse_proxyList()
-                self.logger.debug('Added {} proxies from {}'.format(len(self.proxy_list)-size, parser.id))
+                size = len(proxy_list)
+                proxy_list += parser.parse_proxyList()
+                self.logger.debug('Added {} proxies from {}'.format(len(proxy_list)-size, parser.id))
             except ReadTimeout:
                 self.logger.warning("Proxy Parser: '{}' TimedOut!".format(parser.url))
-        self.logger.debug('Total proxies = '+str(len(self.proxy_list)))
+        self.logger.debug('Total proxies = '+str(len(proxy_list)))
         # filtering the list of available proxies according to user preferences
-        self.proxy_list = [p for p in self.proxy_list if protocol in p.protocols]
-        self.logger.debug('Filtered proxies = '+str(len(self.proxy_list)))
+        proxy_list = [p for p in proxy_list if protocol in p.protocols]
+        self.logger.debug('Filtered proxies = '+str(len(proxy_list)))
+        self.validator = validator
+        if validator is not None:
+            # only admit the proxies that respond, their measured latency is their initial score
+            self.pool = ProxyPool(**pool_settings)
+            for proxy, latency in validator.run(proxy_list):
+                self.pool.add(proxy, latency)
+            self.logger.debug(validator.get_status())
+        else:
+            self.pool = ProxyPool(proxy_list, **pool_settings)
         self.current_proxy = self.randomize_proxy()
 
     def set_logger_level(self, level):
         self.logger.setLevel(level)
 
+    @property
+    def proxy_list(self):
+        """ The proxies that are not quarantined """
+        return self.pool.get_proxies()
+
     def get_proxy_list(self):
         return self.proxy_list
 
@@ -82,38 +97,55 @@ class RequestProxy:
         return headers
 
     def randomize_proxy(self):
-        if len(self.proxy_list) == 0:
+        rand_proxy = self.pool.select()
+        if rand_proxy is None:
             raise ProxyListException("list is empty")
-        rand_proxy = random.choice(self.proxy_list)
-        while not rand_proxy:
-            rand_proxy = random.choice(self.proxy_list)
         self.current_proxy = rand_proxy
         return rand_proxy
 
+    def acquire_proxy(self):
+        """ Choose a proxy below its concurrency cap for a request, to pass to `generate_proxied_request`
+
+        :return: The proxy, or None if all proxies are at their cap or quarantined
+        """
+        # only when no proxies are left at all, quarantined proxies return after their quarantine
+        if self.pool.is_empty():
+            raise ProxyListException("list is empty")
+        return self.pool.select(acquire=True)
+
     #####
     # Proxy format:
     # http://<USERNAME>:<PASSWORD>@<IP-ADDR>:<PORT>
     #####
-    def generate_proxied_request(self, url, method="GET", params={}, data={}, headers={}, req_timeout=30):
+    def generate_proxied_request(self, url, method="GET", params={}, data={}, headers={}, req_timeout=30, proxy=None):
+        """ Execute a request via a proxy, recording its latency or failure in the pool
+
+        :param proxy: The proxy to use, acquired with `acquire_proxy`. Defaults to a randomized (or the sustained) proxy
+        :return: The response, or None if the proxy failed, in which case it is quarantined
+        """
+        if proxy is not None:
+            self.current_proxy = proxy
+        else:
+            if not self.sustain:
+                self.randomize_proxy()
+            self.pool.acquire(self.current_proxy)
+        proxy = self.current_proxy
+        start = time.perf_counter()
         try:
-            random.shuffle(self.proxy_list)
             # req_headers = dict(params.items() + self.generate_random_request_headers().items())
 
             req_headers = dict(params.items())
             req_headers_random = dict(self.generate_random_request_headers().items())
             req_headers.update(req_headers_random)
 
-            if not self.sustain:
-                self.randomize_proxy()
-
             headers.update(req_headers)
 
             self.logger.debug("Using headers: {0}".format(str(headers)))
-            self.logger.debug("Using proxy: {0}".format(str(self.current_proxy)))
+            self.logger.debug("Using proxy: {0}".format(str(proxy)))
             request = requests.request(method, url, headers=headers, data=data, params=params, timeout=req_timeout,
                     proxies={
-                        "http": "http://{0}".format(self.current_proxy.get_address()),
-                        "https": "https://{0}".format(self.current_proxy.get_address())
+                        "http": "http://{0}".format(proxy.get_address()),
+                        "https": "https://{0}".format(proxy.get_address())
                     })
             # Avoid HTTP request errors
             if request.status_code == 409:
@@ -123,40 +155,15 @@ class RequestProxy:
             elif request.status_code == 503:
                 raise ConnectionError("HTTP Response [503] - Service unavailable error")
             self.logger.info('RR Status {}'.format(request.status_code))
+            self.pool.record_success(proxy, time.perf_counter() - start)
             return request
-        except ConnectionError:
-            try:
-                self.proxy_list.remove(self.current_proxy)
-            except ValueError:
-                pass
-            self.logger.debug("Proxy unreachable - Removed Straggling proxy: {0} PL Size = {1}".format(
-                self.current_proxy, len(self.proxy_list)))
-            self.randomize_proxy()
-        except ReadTimeout:
-            try:
-                self.proxy_list.remove(self.current_proxy)
-            except ValueError:
-                pass
-            self.logger.debug("Read timed out - Removed Straggling proxy: {0} PL Size = {1}".format(
-                self.current_proxy, len(self.proxy_list)))
-            self.randomize_proxy()
-        except ChunkedEncodingError:
-            try:
-                self.proxy_list.remove(self.current_proxy)
-            except ValueError:
-                pass
-            self.logger.debug("Wrong server chunked encoding - Removed Straggling proxy: {0} PL Size = {1}".format(
-                self.current_proxy, len(self.proxy_list)))
-            self.randomize_proxy()
-        except TooManyRedirects:
-            try:
-                self.proxy_list.remove(self.current_proxy)
-            except ValueError:
-                pass
-            self.logger.debug("Too many redirects - Removed Straggling proxy: {0} PL Size = {1}".format(
-                self.current_proxy, len(self.proxy_list)))
+        except (ConnectionError, ReadTimeout, ChunkedEncodingError, TooManyRedirects) as error:
+            self.pool.record_failure(proxy)
+            self.logger.debug("{0} - Quarantined straggling proxy: {1} PL Size = {2}".format(
+                type(error).__name__, proxy, len(self.pool)))
             self.randomize_proxy()
-
+        finally:
+            self.pool.release(proxy)
 
 if __name__ == '__main__':
 
@@ -16,7 +16,7 @@ class CallbacksAbstract(ABC):
         pass
 
     @abstractmethod
-    async def on_stock_available(self, message):
+    async def on_transitions(self, transitions: list):
         pass
 
     @abstractmethod
@@ -4,18 +4,27 @@ import time
 import asyncio
 from pathlib import Path
 from requests.exceptions import ConnectionError
-from copy import deepcopy
 from math import ceil
 from datetime import datetime
 from multiprocessing import Queue
+from typing import Callable
 
-import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
 
 from utils import past_time_formatter
 from interface import CallbacksAbstract
 from store_checker import StoreChecker
+from ratelimit import RateLimiter
+from retry import RetryPolicy, CircuitOpenError
+from scheduler import RequestBudget
+from transitions import TransitionType
 from confighandler import ConfigHandler
+from plotting import PlotRenderer
+from history import HistoryStore, HistoryBuffer
+from availability_history import AvailabilityHistory
+from analytics import AvailabilityAnalytics
+from forecasting import RestockForecaster
+from notifications import NotificationDispatcher
 
 
 def next_search_backoff(q: Queue):
@@ -33,31 +42,46 @@ class Monitor:
     """A class to constantly monitor stock at periodic intervals and report back via callbacks."""
 
     def __init__(
-        self, callbacks: CallbacksAbstract, path_to_config_file="./config.toml"
+        self,
+        callbacks: CallbacksAbstract,
+        path_to_config_file="./config.toml",
+        create_profile_callbacks: Callable[[dict], CallbacksAbstract] = None,
     ):
-        """Initialization."""
-        self.callbacks = callbacks
+        """Initialization.
+
+        Args:
+            callbacks (CallbacksAbstract): the callbacks of the main search.
+            path_to_config_file (str, optional): the path to the config file. Defaults to "./config.toml".
+            create_profile_callbacks (Callable, optional): function creating the callbacks of an additional search profile from its configuration. Defaults to None, in which case the profiles use the main callbacks.
+        """
+        # the callbacks are queued and delivered by worker tasks, so a slow client never delays the polling
+        self.callbacks = NotificationDispatcher(callbacks)
         self.path_to_config_file = path_to_config_file
+        self.create_profile_callbacks = create_profile_callbacks
 
         # initialize the ConfigHandler and store checker
         loop = asyncio.get_event_loop()
         init = loop.create_task(self.restart_handler())
         loop.run_until_complete(init)
 
-        # set up the dataframe to store data and the data buffer
-        if Path(self.confighandler.get(["general", "data_path"])).exists():
-            self.df = pd.read_csv(
-                self.confighandler.get(["general", "data_path"]), index_col=[0]
-            )
-        else:
-            self.df = pd.DataFrame(
-                {
-                    "availability": pd.Series(dtype="bool"),
-                    "datetimestamp": pd.Series(dtype="datetime64[ns]"),
-                    "processing_time": pd.Series(dtype="float64"),
-                }
-            )
-        self.data = self.df.to_dict("records")
+        # load the poll history, importing the CSV file of earlier versions once
+        self.history = HistoryStore(
+            self.confighandler.get(["general", "history_path"], "data.sqlite")
+        )
+        migrated = self.history.migrate_csv(
+            self.confighandler.get(["general", "data_path"])
+        )
+        if migrated > 0:
+            print(f"Imported {migrated} polls from the CSV file into the history")
+        # keep the most recent polls in memory, the older ones are only in the history
+        self.data = HistoryBuffer(
+            self.confighandler.get(["general", "buffer_size"], 100000),
+            spill=self.history.append,
+        )
+        self.data.load(self.history.load_columns(limit=self.data.max_size))
+        # the data version changes with every recorded poll, so cached plots of older versions are not reused
+        self.data_version = 0
+        self.plot_renderer = PlotRenderer()
         print("Apple Store Monitoring\n")
 
     async def restart_handler(self):
@@ -66,12 +90,144 @@ class Monitor:
         self.confighandler = ConfigHandler(self.path_to_config_file)
         asyncio.create_task(self.confighandler.watch_changes(self.restart_handler))
         await asyncio.sleep(0.1)  # to let the watcher finish setup
-        # initialize the store checker
-        self.store_checker = StoreChecker(
-            self.callbacks,
-            self.confighandler.searchconfig,
+        # close the connections of the previous store checkers before replacing them
+        if hasattr(self, "store_checker"):
+            for store_checker in self.get_store_checkers():
+                await store_checker.close()
+            for store_checker in self.profile_store_checkers:
+                if store_checker.callbacks is not self.callbacks:
+                    await store_checker.callbacks.close()
+        dispatcher_settings = self.confighandler.get(["dispatcher"]) or {}
+        self.callbacks.configure(dispatcher_settings)
+        # the request budget is shared by all searches
+        self.rate_limiter = RateLimiter(self.confighandler.get(["ratelimit"]) or {})
+        self.retry_policy = RetryPolicy(self.confighandler.get(["retry"]) or {})
+        self.request_budget = RequestBudget(
+            (self.confighandler.get(["scheduler"]) or {}).get(
+                "max_requests_per_hour", 0
+            )
+        )
+        # initialize the store checker of the main search and of the additional search profiles
+        self.store_checker = self.create_store_checker(
+            self.callbacks, self.confighandler.searchconfig
+        )
+        # the insights are aggregated from the availability history of the main search
+        self.analytics = AvailabilityAnalytics()
+        self.insights_task: asyncio.Task = None
+        self.profile_store_checkers = list()
+        for profile, searchconfig in self.confighandler.get_profiles():
+            callbacks = (
+                NotificationDispatcher(
+                    self.create_profile_callbacks(profile), dispatcher_settings
+                )
+                if self.create_profile_callbacks is not None
+                else self.callbacks
+            )
+            self.profile_store_checkers.append(
+                self.create_store_checker(
+                    callbacks, searchconfig, profile.get("name", "profile")
+                )
+            )
+
+    def create_store_checker(
+        self, callbacks: CallbacksAbstract, searchconfig, profile_name: str = None
+    ) -> StoreChecker:
+        """Create a store checker for a search configuration, with the general settings."""
+        scheduler_settings = dict(self.confighandler.get(["scheduler"]) or {})
+        # each profile saves what its scheduler learned and its availability history separately
+        if scheduler_settings.get("path") is not None:
+            scheduler_settings["path"] = self.get_profile_path(
+                scheduler_settings["path"], profile_name
+            )
+        availability_history_path = self.confighandler.get(
+            ["general", "availability_history_path"], "availability.bin"
+        )
+        availability_history = (
+            AvailabilityHistory(
+                self.get_profile_path(availability_history_path, profile_name)
+            )
+            if availability_history_path
+            else None
+        )
+        # the restock forecast is trained on the availability history
+        forecast_settings = self.confighandler.get(["forecast"]) or {}
+        forecaster = (
+            RestockForecaster(availability_history.path, forecast_settings)
+            if availability_history is not None
+            and forecast_settings.get("enabled", True)
+            else None
+        )
+        return StoreChecker(
+            callbacks,
+            searchconfig,
             randomize_proxies=self.confighandler.get(["general", "randomize_proxies"]),
+            proxy_settings=self.confighandler.get(["proxies"]) or {},
+            http_settings=self.confighandler.get(["http"]) or {},
+            cache_settings=self.confighandler.get(["cache"]) or {},
+            scheduler_settings=scheduler_settings,
+            request_budget=self.request_budget,
+            rate_limiter=self.rate_limiter,
+            retry_policy=self.retry_policy,
+            availability_history=availability_history,
+            forecaster=forecaster,
+        )
+
+    @staticmethod
+    def get_profile_path(path: str, profile_name: str = None) -> str:
+        """Get the path of a file of a search profile, the main search uses the path itself."""
+        if profile_name is None:
+            return path
+        path = Path(path)
+        return str(path.with_name(f"{path.stem}_{profile_name}{path.suffix}"))
+
+    def get_store_checkers(self) -> list[StoreChecker]:
+        """Get the store checkers of the main search and the additional search profiles."""
+        return [self.store_checker] + self.profile_store_checkers
+
+    async def refresh_all(self):
+        """Refresh the stock of the main search and all search profiles, returns the result of the main search.
+
+        Identical queries (same country, region and model) of different searches are fetched only once and shared.
+        """
+        if len(self.profile_store_checkers) == 0:
+            return await self.store_checker.refresh(verbose=False)
+
+        # collect the due targets of all searches, per country (base URL) and deduplicated by region and model
+        targets_per_base_url: dict[str, tuple[StoreChecker, dict]] = dict()
+        for store_checker in self.get_store_checkers():
+            await store_checker.ensure_devices(verbose=False)
+            fetcher, targets = targets_per_base_url.setdefault(
+                store_checker.base_url, (store_checker, dict())
+            )
+            for region, device in store_checker.get_due_targets(
+                store_checker.device_list
+            ):
+                targets.setdefault((region, device.get("model")), (region, device))
+
+        # fetch each target once, using the store checker of the first search in the country
+        base_urls = list(targets_per_base_url.keys())
+        fetched = await asyncio.gather(
+            *(
+                fetcher.fetch_targets(list(targets.values()), verbose=False)
+                for fetcher, targets in targets_per_base_url.values()
+            )
+        )
+        fetched_per_base_url = dict(zip(base_urls, fetched))
+
+        # let every search process the shared results
+        result = await self.store_checker.refresh(
+            verbose=False, prefetched=fetched_per_base_url[self.store_checker.base_url]
         )
+        for store_checker in self.profile_store_checkers:
+            await store_checker.refresh(
+                verbose=False, prefetched=fetched_per_base_url[store_checker.base_url]
+            )
+            if any(
+                transition.type is TransitionType.BECAME_AVAILABLE
+                for transition in store_checker.last_transitions
+            ):
+                await store_checker.callbacks.on_newly_available()
+        return result
 
     async def start_monitoring(self):
         """Start monitoring store stock."""
@@ -91,24 +247,24 @@ class Monitor:
             try:
                 # get the new data and write to the data and report buffers
                 start_time = time.perf_counter()
-                availability, datetimestamp, refresh_processing_time = (
-                    await self.store_checker.refresh(verbose=False)
-                )
-                self.data.append(
-                    {
-                        "availability": availability,
-                        "datetimestamp": datetimestamp,
-                        "processing_time": refresh_processing_time,
-                    }
+                availability, timestamp, refresh_processing_time = (
+                    await self.refresh_all()
                 )
-                newly_available = availability is True and (
-                    not found_availables or found_availables[-1] is False
+                self.data.append(availability, timestamp, refresh_processing_time)
+                self.data_version += 1
+                self.start_insights_update()
+                for store_checker in self.get_store_checkers():
+                    if store_checker.forecaster is not None:
+                        store_checker.forecaster.start_retraining()
+                newly_available = any(
+                    transition.type is TransitionType.BECAME_AVAILABLE
+                    for transition in self.store_checker.last_transitions
                 )
                 found_availables.append(availability)
                 count += 1
-                count_connection_errors += 1
+                count_connection_errors = 0
 
-                # if we just changed status from unavailable to available, spam the user to notify
+                # if a part just became available in a store, spam the user to notify
                 if newly_available:
                     await self.callbacks.on_newly_available()
 
@@ -128,16 +284,30 @@ class Monitor:
                     report_message = f"<b>Status Report</b> \nIn the past {past_time_formatter(count, polling_interval_seconds)}, iPhones were available {count_availables} out of {len(found_availables)} times. \nThe average processing time was {processing_time_average} seconds."
                     if self.confighandler.get(["general", "randomize_proxies"]):
                         report_message += f"\nProxy status: {self.get_proxystatus()}"
+                    report_message += (
+                        f"\nCache status: {self.store_checker.get_cachestatus()}"
+                    )
+                    report_message += (
+                        f"\nRate limit status: {self.rate_limiter.get_status()}"
+                    )
+                    report_message += (
+                        f"\nRetry status: {self.retry_policy.get_status()}"
+                    )
+                    report_message += (
+                        f"\nNotification status: {self.callbacks.get_status()}"
+                    )
+                    if self.store_checker.forecaster is not None:
+                        report_message += f"\nForecast status: {self.store_checker.forecaster.get_status()}"
                     await self.callbacks.on_auto_report(report_message)
                     print(report_message)
 
                     # write the collected data to dataframe and csv
-                    self.save_df()
+                    self.save_data()
 
                     # reset the counters for the next report
                     found_availables = list()
                     processing_time_list = list([0])
-                    self.store_checker.statuslist = list()
+                    self.store_checker.status_list.clear()
                     count = 0
 
                 # subtract the processing time from the sleep counter for accuracte polling intervals
@@ -145,35 +315,36 @@ class Monitor:
                 processing_time_list.append(processing_time)
                 sleep_time = polling_interval_seconds - processing_time
 
-                # if the processing took much longer than the set interval, crash the process and report
-                if processing_time > polling_interval_seconds * 20:
-                    raise RuntimeError(
-                        f"Processing took more than 20 times longer ({round(processing_time, 3)} seconds) than the set polling interval ({polling_interval_seconds} seconds). To avoid this, look into the cause of the delay (randomized proxies are slow) or increase the interval and reboot."
-                    )
-
-                # if the processing took longer than the interval, make up the difference by skipping the next polls
+                # the rate limiter paces the requests, so if the processing took longer than the interval, poll again right away
                 if processing_time >= polling_interval_seconds:
-                    additional_start_time = time.perf_counter()
-                    deficit = processing_time - polling_interval_seconds
-                    skips = ceil(deficit / polling_interval_seconds)
                     await self.callbacks.on_long_processing_warning(
-                        f"Processing took longer ({round(processing_time, 3)} seconds) than the set polling interval ({polling_interval_seconds} seconds). \nSkipping {skips} polling{'s' if skips != 1 else ''}. \nIf you get this message often, disable randomized proxies or increase the polling interval and reboot.",
-                    )
-                    count += skips
-                    additional_processing_time = (
-                        time.perf_counter() - additional_start_time
+                        f"Processing took longer ({round(processing_time, 3)} seconds) than the set polling interval ({polling_interval_seconds} seconds). \nPolling again right away. \nRate limit status: {self.rate_limiter.get_status()} \nIf you get this message often, disable randomized proxies, raise the request budget or increase the polling interval.",
                     )
-                    sleep_time = (
-                        polling_interval_seconds - (deficit % polling_interval_seconds)
-                    ) - additional_processing_time
+
+                # with adaptive scheduling, wait until the first target is due instead
+                seconds_until_due = [
+                    store_checker.scheduler.seconds_until_due()
+                    for store_checker in self.get_store_checkers()
+                ]
+                if None not in seconds_until_due:
+                    sleep_time = min(seconds_until_due)
 
                 # wait for the next polling
                 sleep_time = max(0, sleep_time)
                 await asyncio.sleep(sleep_time)
 
             except ConnectionError as error:
+                # wait until the circuit breaker lets a probe through, or back off exponentially with jitter
+                if isinstance(error, CircuitOpenError):
+                    backoff_time = round(error.retry_after, 1)
+                else:
+                    backoff_time = round(
+                        self.retry_policy.get_backoff(
+                            count_connection_errors, polling_interval_seconds
+                        ),
+                        1,
+                    )
                 count_connection_errors += 1
-                backoff_time = polling_interval_seconds * count_connection_errors
                 message = f"Connection error, the server has likely refused the request because of too many attempts. \nTaking a break for {backoff_time} seconds before attempting again. Error message: {error}"
                 print(message)
                 await self.callbacks.on_connection_error(message)
@@ -182,7 +353,7 @@ class Monitor:
             except BaseException as error:
                 print("Something went wrong!")
                 await self.callbacks.on_error(error, self.get_logfile_path())
-                self.save_df()
+                self.save_data()
                 raise error
 
     def get_logfile_path(self):
@@ -193,21 +364,40 @@ class Monitor:
     async def stop_monitoring(self):
         """Stop the monitoring process"""
         print("\nStopping the monitor")
-        self.save_df()
+        self.save_data()
+        for store_checker in self.get_store_checkers():
+            await store_checker.close()
+        self.plot_renderer.close()
+        self.history.close()
+        for store_checker in self.profile_store_checkers:
+            if store_checker.callbacks is not self.callbacks:
+                await store_checker.callbacks.close()
         await self.callbacks.on_stop()
 
-    def save_df(self):
-        """Save the data to a dataframe and to csv file"""
-        self.df = pd.DataFrame(self.data)
-        return self.df.to_csv(self.confighandler.get(["general", "data_path"]))
+    def save_data(self):
+        """Append the polls recorded since the last save to the history"""
+        self.history.append(self.data.get_unsaved_records())
+        self.data.mark_saved()
+
+    def export_data(self) -> Path:
+        """Save the data and export the full history to the csv file, return the filepath"""
+        self.save_data()
+        return self.history.export_csv(self.confighandler.get(["general", "data_path"]))
 
     def get_proxystatus(self):
         """Generate a proxy status message"""
-        if self.store_checker.randomize_proxies is True:
+        if (
+            self.store_checker.randomize_proxies is True
+            and self.store_checker.req_proxy is None
+        ):
+            message = "The list of proxies is being assembled."
+        elif self.store_checker.randomize_proxies is True:
             left = self.store_checker.get_num_proxies()
             initial = self.store_checker.initial_num_proxies
             proxy_list_refresh_count = self.store_checker.proxy_list_refresh_count
-            message = f"Proxies were succesful {self.store_checker.count_randomized_proxy_success} times. \nThere are {left} of the initial {initial} proxies left to use. \n{initial-left} proxies have been removed. \nThe proxy list has been assembled {proxy_list_refresh_count} time{'s' if proxy_list_refresh_count != 1 else ''}."
+            message = f"Proxies were succesful {self.store_checker.count_randomized_proxy_success} times. \nThere are {left} of the initial {initial} proxies left to use. \n{initial-left} proxies have been removed. \nThe proxy list has been assembled {proxy_list_refresh_count} time{'s' if proxy_list_refresh_count != 1 else ''}. \n{self.store_checker.req_proxy.pool.get_status()}"
+            if self.store_checker.req_proxy.validator is not None:
+                message += f" \n{self.store_checker.req_proxy.validator.get_status()}"
         else:
             if self.confighandler.get(["general", "randomize_proxies"]) is True:
                 message = "Randomized proxies were enabled, but there are no active proxies left. \nNon-proxied requests are used."
@@ -215,47 +405,67 @@ class Monitor:
                 message = "Randomized proxies are not enabled."
         return message
 
-    def plot_over_time(self, yaxis, ylabel) -> str:
-        """Plot a DF over time, write the plot to disk, return the filepath"""
-        self.save_df()
+    def start_insights_update(self):
+        """Add the new polls to the insights in the background, unless an update is already running."""
+        if self.store_checker.availability_history is None:
+            return
+        if self.insights_task is None or self.insights_task.done():
+            self.insights_task = asyncio.create_task(self.update_insights())
+
+    async def update_insights(self):
+        """Add the polls appended to the availability history since the last update to the insights, in a thread so the event loop keeps running."""
+        try:
+            await asyncio.to_thread(
+                self.analytics.read, self.store_checker.availability_history.path
+            )
+        except (OSError, ValueError) as error:
+            # e.g. the dictionary was read while it was being written, the next update tries again
+            print(f"Failed to update the insights: {error}")
+
+    async def get_insights(self) -> str:
+        """Generate an insights message from the aggregated availability history."""
+        if self.store_checker.availability_history is None:
+            return "The availability history is disabled, set availability_history_path in the general settings to collect insights."
+        self.start_insights_update()
+        await self.insights_task
+        index = self.store_checker.availability_index
+        return self.analytics.get_summary(
+            dict(zip(index.store_numbers, index.store_names)),
+            dict(zip(index.part_numbers, index.part_titles)),
+        )
 
-        # create a temporary dataframe
-        plot_df = deepcopy(self.df)
-        plot_df["availability"] = plot_df["availability"].astype(int)
-        plot_df = plot_df.set_index("datetimestamp")
-        plot_df.plot(y=yaxis)
+    def get_forecast(self, minutes: float = None) -> str:
+        """Generate a message with the stores and models most likely to restock within the next minutes."""
+        forecaster = self.store_checker.forecaster
+        if forecaster is None:
+            return "The restock forecast is disabled, set availability_history_path in the general settings and enable the forecast to use it."
+        index = self.store_checker.availability_index
+        return forecaster.get_summary(
+            dict(zip(index.store_numbers, index.store_names)),
+            dict(zip(index.part_numbers, index.part_titles)),
+            minutes,
+        )
 
-        # configure the plot
-        fig, ax = plt.gcf(), plt.gca()
-        fig.set_figheight(6)
-        fig.set_figwidth(12)
+    def get_series(self, yaxis) -> tuple[np.ndarray, np.ndarray]:
+        """Get views of the timestamps and values of a column of the polls in memory."""
+        return self.data.column("timestamp"), self.data.column(yaxis)
 
-        # set the labels
-        ax.set_xlabel("Time")
-        ax.set_ylabel(ylabel)
+    async def plot_over_time(self, yaxis, ylabel, hours: float = None) -> str:
+        """Plot a column of the data over time in a worker process, write the plot to disk, return the filepath"""
+        options = dict()
         if yaxis == "processing_time":
-            # plot the moving average
-            ma = (
-                plot_df["processing_time"]
-                .rolling(
-                    ceil(self.confighandler.get(["general", "report_after_n_counts"]))
-                )
-                .mean()
+            # plot the moving average and limit the y-axis
+            options["moving_average_window"] = ceil(
+                self.confighandler.get(["general", "report_after_n_counts"])
             )
-            plt.plot(ma)
-            # limit the y-axis
-            ylimmax = min(
-                plot_df[yaxis].max(),
-                self.confighandler.get(["general", "polling_interval_seconds"]),
+            options["ylimmax"] = self.confighandler.get(
+                ["general", "polling_interval_seconds"]
             )
-            ax.set_ylim(0, ylimmax)
-        # dates = self.df["datetimestamp"].to_list()
-        # dates = [datetime.strptime(x, '%d-%m-%Y %H:%M:%S') for x in dates]
-        # ax.set_xticks(dates)
-        fig.autofmt_xdate()
-        plt.grid()
-        plt.tight_layout()
-
-        # return the plot to the user
-        plt.savefig("plots/plot.png", dpi=200)
-        return "plots/plot.png"
+        return await self.plot_renderer.plot(
+            yaxis,
+            self.data_version,
+            lambda: self.get_series(yaxis),
+            ylabel,
+            hours,
+            **options,
+        )
@@ -0,0 +1,255 @@
+"""Module for delivering the callbacks of the monitor from a queue, so a slow client never delays the polling."""
+
+import time
+import asyncio
+from enum import IntEnum
+from pathlib import Path
+from collections import deque
+
+from interface import CallbacksAbstract
+
+
+class Priority(IntEnum):
+    """The lanes of the queue, a lower value is delivered first."""
+
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+# stock alerts go ahead of everything else, reports and warnings last
+EVENT_PRIORITIES = {
+    "on_transitions": Priority.HIGH,
+    "on_newly_available": Priority.HIGH,
+    "on_appointment_available": Priority.HIGH,
+    "on_error": Priority.HIGH,
+    "on_start": Priority.NORMAL,
+    "on_stop": Priority.NORMAL,
+    "on_proxy_depletion": Priority.NORMAL,
+    "on_connection_error": Priority.NORMAL,
+    "on_auto_report": Priority.LOW,
+    "on_long_processing_warning": Priority.LOW,
+}
+# events of which only the latest is worth delivering, a queued one is replaced by a newer one
+COALESCED_EVENTS = {
+    "on_newly_available",
+    "on_proxy_depletion",
+    "on_connection_error",
+    "on_auto_report",
+    "on_long_processing_warning",
+}
+
+
+class Notification:
+    """A queued callback."""
+
+    __slots__ = ("name", "args", "priority", "enqueued_at")
+
+    def __init__(self, name: str, args: tuple = ()):
+        self.name = name
+        self.args = args
+        self.priority = EVENT_PRIORITIES[name]
+        self.enqueued_at = time.perf_counter()
+
+
+class NotificationDispatcher(CallbacksAbstract):
+    """Class implementing the callbacks by queueing them, worker tasks deliver them to the wrapped callbacks.
+
+    Each priority has its own bounded lane, the workers always take from the highest priority lane first.
+    Stock alerts are delivered one at a time even with several workers, so e.g. "became available" never overtakes an earlier "became unavailable".
+    When the high priority lane is full the caller waits for room, stock alerts are never dropped.
+    When a lower priority lane is full its oldest notification is dropped.
+    Events of which only the latest matters replace their queued predecessor instead of queueing again.
+    `on_error` and `on_stop` wait until everything queued is delivered, as the monitor stops after them.
+    """
+
+    def __init__(self, callbacks: CallbacksAbstract, settings: dict = None):
+        """Initialization.
+
+        Args:
+            callbacks (CallbacksAbstract): the callbacks to deliver the notifications to.
+            settings (dict, optional): the `[dispatcher]` section of the configuration. Defaults to None.
+        """
+        self.callbacks = callbacks
+        self.lanes: list[deque[Notification]] = [deque() for _ in Priority]
+        self.queued: dict[str, Notification] = dict()
+        self.condition: asyncio.Condition = None
+        self.workers: list[asyncio.Task] = list()
+        self.in_flight = 0
+        # whether a stock alert is being delivered, the next one waits for it
+        self.high_in_flight = False
+        self.count_delivered = 0
+        self.count_failed = 0
+        self.count_dropped = 0
+        self.count_coalesced = 0
+        self.max_depth = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.configure(settings)
+        super().__init__()
+
+    def configure(self, settings: dict = None):
+        """Apply the settings, the number of workers takes effect when the workers are started."""
+        settings = settings or {}
+        self.num_workers = max(1, settings.get("workers", 1))
+        self.max_queue_size = max(1, settings.get("max_queue_size", 100))
+        self.flush_timeout_seconds = settings.get("flush_timeout_seconds", 30)
+
+    def get_depth(self) -> int:
+        """The number of queued notifications over all lanes."""
+        return sum(len(lane) for lane in self.lanes)
+
+    def start(self):
+        """Start the workers, unless they are running. Requires a running event loop."""
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        if len(self.workers) == 0:
+            self.workers = [
+                asyncio.create_task(self.work()) for _ in range(self.num_workers)
+            ]
+
+    async def put(self, notification: Notification):
+        """Queue a notification according to the policy of its priority and event."""
+        self.start()
+        async with self.condition:
+            if notification.name in COALESCED_EVENTS:
+                queued = self.queued.get(notification.name)
+                if queued is not None:
+                    # keep the place in the queue and the enqueue time, deliver the newest arguments
+                    queued.args = notification.args
+                    self.count_coalesced += 1
+                    return
+            lane = self.lanes[notification.priority]
+            if len(lane) >= self.max_queue_size:
+                if notification.priority is Priority.HIGH:
+                    await self.condition.wait_for(
+                        lambda: len(lane) < self.max_queue_size
+                    )
+                else:
+                    self.discard(lane.popleft())
+                    self.count_dropped += 1
+            lane.append(notification)
+            if notification.name in COALESCED_EVENTS:
+                self.queued[notification.name] = notification
+            self.max_depth = max(self.max_depth, self.get_depth())
+            self.condition.notify_all()
+
+    def discard(self, notification: Notification):
+        """Forget a notification that was taken from its lane."""
+        if self.queued.get(notification.name) is notification:
+            del self.queued[notification.name]
+
+    def get_next_lane(self) -> deque[Notification]:
+        """The highest priority lane that is not empty, skipping the stock alerts while another one is being delivered."""
+        for priority, lane in zip(Priority, self.lanes):
+            if len(lane) > 0 and not (
+                priority is Priority.HIGH and self.high_in_flight
+            ):
+                return lane
+        return None
+
+    def pop(self) -> Notification:
+        """Take the first notification of the next lane."""
+        lane = self.get_next_lane()
+        if lane is None:
+            return None
+        notification = lane.popleft()
+        self.discard(notification)
+        return notification
+
+    async def work(self):
+        """Deliver the queued notifications, one at a time."""
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: self.get_next_lane() is not None)
+                notification = self.pop()
+                self.in_flight += 1
+                high = notification.priority is Priority.HIGH
+                if high:
+                    self.high_in_flight = True
+                # there is room in the lane again
+                self.condition.notify_all()
+            try:
+                await self.deliver(notification)
+            finally:
+                async with self.condition:
+                    self.in_flight -= 1
+                    if high:
+                        self.high_in_flight = False
+                    self.condition.notify_all()
+
+    async def deliver(self, notification: Notification):
+        """Call the wrapped callback of a notification and record the latency since it was queued."""
+        try:
+            await getattr(self.callbacks, notification.name)(*notification.args)
+            self.count_delivered += 1
+        except Exception as error:
+            self.count_failed += 1
+            print(f"Failed to deliver the {notification.name} notification: {error}")
+        latency = time.perf_counter() - notification.enqueued_at
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    async def flush(self):
+        """Wait until every queued notification is delivered, or the flush timeout passed."""
+        if self.condition is None:
+            return
+        async with self.condition:
+            try:
+                await asyncio.wait_for(
+                    self.condition.wait_for(
+                        lambda: self.get_depth() == 0 and self.in_flight == 0
+                    ),
+                    self.flush_timeout_seconds,
+                )
+            except asyncio.TimeoutError:
+                print(
+                    f"Not all notifications were delivered within {self.flush_timeout_seconds} seconds, {self.get_depth()} are left."
+                )
+
+    async def close(self):
+        """Deliver what is queued and stop the workers."""
+        await self.flush()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = list()
+
+    def get_status(self) -> str:
+        """Generate a status message of the queue."""
+        handled = self.count_delivered + self.count_failed
+        average_latency = self.total_latency / handled if handled > 0 else 0.0
+        depths = "/".join(str(len(lane)) for lane in self.lanes)
+        return f"{self.count_delivered} notifications delivered with an average latency of {round(average_latency, 3)} seconds (at most {round(self.max_latency, 3)}), {self.count_failed} failed. {self.get_depth()} queued (high/normal/low {depths}, at most {self.max_depth}), {self.count_coalesced} coalesced and {self.count_dropped} dropped."
+
+    async def on_start(self):
+        await self.put(Notification("on_start"))
+
+    async def on_stop(self):
+        await self.put(Notification("on_stop"))
+        await self.close()
+
+    async def on_transitions(self, transitions: list):
+        await self.put(Notification("on_transitions", (transitions,)))
+
+    async def on_appointment_available(self, message):
+        await self.put(Notification("on_appointment_available", (message,)))
+
+    async def on_newly_available(self):
+        await self.put(Notification("on_newly_available"))
+
+    async def on_auto_report(self, report: str):
+        await self.put(Notification("on_auto_report", (report,)))
+
+    async def on_proxy_depletion(self, message: str):
+        await self.put(Notification("on_proxy_depletion", (message,)))
+
+    async def on_long_processing_warning(self, warning: str):
+        await self.put(Notification("on_long_processing_warning", (warning,)))
+
+    async def on_connection_error(self, error: str):
+        await self.put(Notification("on_connection_error", (error,)))
+
+    async def on_error(self, error: str, logfile_path: Path):
+        await self.put(Notification("on_error", (error, logfile_path)))
+        await self.flush()
@@ -0,0 +1,188 @@
+"""Module for rendering plots of the poll history in a worker process, caching the rendered images."""
+
+import asyncio
+import hashlib
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# the size of the rendered plots, the series are downsampled to at most one point per pixel
+FIGURE_WIDTH_INCHES = 12
+FIGURE_HEIGHT_INCHES = 6
+DPI = 200
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Select the indices of at most `threshold` points that preserve the shape of the series, using Largest-Triangle-Three-Buckets.
+
+    The first and last point are always kept, of every bucket in between the point forming the largest triangle with the previously selected point and the average of the next bucket is kept.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # relative to the first point, so large epoch timestamps keep their precision as floats
+    x = (np.asarray(x) - x[0]).astype(float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    indices = np.empty(threshold, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    selected = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+        else:
+            next_start, next_end = n - 1, n
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (x[selected] - average_x) * (y[start:end] - y[selected])
+            - (x[selected] - x[start:end]) * (average_y - y[selected])
+        )
+        selected = start + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+    return indices
+
+
+def render_plot(
+    path: str,
+    timestamps: np.ndarray,
+    values: np.ndarray,
+    yaxis: str,
+    ylabel: str,
+    moving_average_window: int = None,
+    ylimmax: float = None,
+    hours: float = None,
+) -> str:
+    """Render a series over time to a PNG file, returns the path. Runs in the worker process.
+
+    The timestamps are in nanoseconds since the epoch (UTC), they are converted to local time only for the axis.
+    If `hours` is given, only the last hours up to the last timestamp are plotted.
+    """
+    import pandas as pd
+    import matplotlib
+    from dateutil.tz import tzlocal
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+    # the moving average is computed before the series is cut and downsampled
+    moving_average = (
+        pd.Series(values).rolling(moving_average_window).mean().to_numpy()
+        if moving_average_window is not None
+        else None
+    )
+    first = 0
+    if hours is not None and len(timestamps) > 0:
+        first = int(
+            np.searchsorted(timestamps, timestamps[-1] - int(hours * 3600 * 10**9))
+        )
+    indices = first + lttb(
+        timestamps[first:], values[first:], FIGURE_WIDTH_INCHES * DPI
+    )
+    times = (
+        pd.to_datetime(timestamps[indices], utc=True)
+        .tz_convert(tzlocal())
+        .tz_localize(None)
+        .to_numpy()
+    )
+
+    fig, ax = plt.subplots(figsize=(FIGURE_WIDTH_INCHES, FIGURE_HEIGHT_INCHES))
+    ax.plot(times, values[indices], label=yaxis)
+    if moving_average is not None:
+        ax.plot(times, moving_average[indices])
+    ax.legend()
+
+    # set the labels
+    ax.set_xlabel("Time")
+    ax.set_ylabel(ylabel)
+    if ylimmax is not None and len(indices) > 0:
+        ax.set_ylim(0, min(values[indices].max(), ylimmax))
+    fig.autofmt_xdate()
+    ax.grid()
+    fig.tight_layout()
+    fig.savefig(path, dpi=DPI)
+    plt.close(fig)
+    return path
+
+
+class PlotRenderer:
+    """Class to render plots in a worker process, so the event loop keeps running.
+
+    The rendered images are cached by metric, data version and all rendering options: as long as no new polls were recorded and the options are the same, the same plot is returned right away.
+    """
+
+    def __init__(self, directory="plots"):
+        self.directory = Path(directory)
+        self.executor: ProcessPoolExecutor = None
+        self.cache: dict[tuple, str] = dict()
+        self.count_cache_hits = 0
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        """Get the worker process, starting it on first use."""
+        if self.executor is None:
+            # spawn instead of fork, the event loop and the threads of the parent process are not safe to copy
+            self.executor = ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self.executor
+
+    def get_path(self, key: tuple) -> Path:
+        """Get the path of the image of a cache key."""
+        metric, version, *options = key
+        digest = hashlib.sha1(repr(options).encode()).hexdigest()[:12]
+        return self.directory / f"plot_{metric}_{version}_{digest}.png"
+
+    async def plot(
+        self,
+        metric: str,
+        version: int,
+        get_series,
+        ylabel: str,
+        time_range: float = None,
+        **options,
+    ) -> str:
+        """Get the path of the plot of the metric at the data version, rendering it in the worker process if it is not cached.
+
+        `get_series` is only called on a cache miss and returns the timestamps and values to plot.
+        `time_range` is the number of hours to plot up to the last poll, or None to plot the full history.
+        """
+        moving_average_window = options.get("moving_average_window")
+        ylimmax = options.get("ylimmax")
+        key = (metric, version, time_range, ylabel, moving_average_window, ylimmax)
+        path = self.cache.get(key)
+        if path is not None and Path(path).exists():
+            self.count_cache_hits += 1
+            return path
+
+        timestamps, values = get_series()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = await asyncio.get_running_loop().run_in_executor(
+            self.get_executor(),
+            render_plot,
+            str(self.get_path(key)),
+            timestamps,
+            values,
+            metric,
+            ylabel,
+            moving_average_window,
+            ylimmax,
+            time_range,
+        )
+
+        # plots of older data versions will not be requested again
+        for old_key in [k for k in self.cache if k[0] == metric and k[1] != version]:
+            Path(self.cache.pop(old_key)).unlink(missing_ok=True)
+        self.cache[key] = path
+        return path
+
+    def close(self):
+        """Stop the worker process."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,142 @@
+"""Module for limiting the rate of outgoing requests with token buckets, globally, per host and per proxy."""
+
+import time
+import asyncio
+
+
+class TokenBucket:
+    """A bucket that refills with `rate` tokens per second up to `burst` tokens, each request takes a token."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        """Add the tokens that accumulated since the last update."""
+        # a moment taken before the bucket was created or last updated adds nothing
+        if now <= self.updated_at:
+            return
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def get_wait_time(self, now: float) -> float:
+        """The number of seconds until a token is available."""
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        """Take a token."""
+        self.refill(now)
+        self.tokens -= 1
+
+    def reserve(self, now: float) -> float:
+        """Take a token ahead of time, returns the number of seconds until it is available.
+
+        The tokens go negative while reservations are outstanding, so later reservations wait behind earlier ones.
+        """
+        self.take(now)
+        return max(0.0, -self.tokens / self.rate)
+
+
+class RateLimiter:
+    """Class to limit outgoing requests with a global token bucket and token buckets per host and per proxy.
+
+    A request reserves a token of each of its buckets right away and then waits until the last of them is available,
+    so waiting requests are served in the order in which they arrived per bucket, and a request waiting for a slow host
+    or proxy does not hold up requests to other hosts and proxies. A rate of 0 disables the corresponding bucket.
+    """
+
+    def __init__(self, settings: dict = None):
+        """Initialization.
+
+        Args:
+            settings (dict, optional): the `[ratelimit]` section of the configuration. Defaults to None, in which case nothing is limited.
+        """
+        settings = settings or {}
+        self.global_rate = settings.get("requests_per_second", 0)
+        self.global_burst = settings.get("burst", 5)
+        self.host_rate = settings.get("per_host_requests_per_second", 0)
+        self.host_burst = settings.get("per_host_burst", 5)
+        self.proxy_rate = settings.get("per_proxy_requests_per_second", 0)
+        self.proxy_burst = settings.get("per_proxy_burst", 2)
+        self.global_bucket = (
+            TokenBucket(self.global_rate, self.global_burst)
+            if self.global_rate > 0
+            else None
+        )
+        self.host_buckets: dict[str, TokenBucket] = dict()
+        self.proxy_buckets: dict[str, TokenBucket] = dict()
+        self.count_requests = 0
+        self.count_waits = 0
+        self.total_wait_time = 0.0
+        self.queued = 0
+
+    def get_buckets(self, host: str, proxy: str = None) -> list[TokenBucket]:
+        """Get the buckets a request to the host (via the proxy) takes a token from."""
+        buckets = list()
+        if self.global_bucket is not None:
+            buckets.append(self.global_bucket)
+        if self.host_rate > 0:
+            bucket = self.host_buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.host_rate, self.host_burst)
+                self.host_buckets[host] = bucket
+            buckets.append(bucket)
+        if proxy is not None and self.proxy_rate > 0:
+            bucket = self.proxy_buckets.get(proxy)
+            if bucket is None:
+                bucket = TokenBucket(self.proxy_rate, self.proxy_burst)
+                self.proxy_buckets[proxy] = bucket
+            buckets.append(bucket)
+        return buckets
+
+    def get_wait_time(self, host: str, proxy: str = None) -> float:
+        """The number of seconds a request to the host (via the proxy) would have to wait now, ignoring queued requests."""
+        now = time.monotonic()
+        return max(
+            (bucket.get_wait_time(now) for bucket in self.get_buckets(host, proxy)),
+            default=0.0,
+        )
+
+    async def acquire(self, host: str, proxy: str = None) -> float:
+        """Wait until a request to the host (via the proxy) is allowed, returns the number of seconds waited."""
+        buckets = self.get_buckets(host, proxy)
+        self.count_requests += 1
+        if len(buckets) == 0:
+            return 0.0
+        wait_time = max(bucket.reserve(time.monotonic()) for bucket in buckets)
+        if wait_time <= 0:
+            return 0.0
+        self.count_waits += 1
+        self.total_wait_time += wait_time
+        self.queued += 1
+        try:
+            await asyncio.sleep(wait_time)
+        finally:
+            self.queued -= 1
+        return wait_time
+
+    def get_remaining(self) -> float:
+        """The number of requests that can be made right away under the global budget, or None if there is no global budget."""
+        if self.global_bucket is None:
+            return None
+        self.global_bucket.refill(time.monotonic())
+        # the tokens are negative while reservations are outstanding
+        return max(0.0, self.global_bucket.tokens)
+
+    def get_status(self) -> str:
+        """Generate a message on the remaining budget and the time requests waited."""
+        remaining = self.get_remaining()
+        message = (
+            f"{int(remaining)} of {int(self.global_bucket.burst)} requests left in the global budget. \n"
+            if remaining is not None
+            else "There is no global request budget. \n"
+        )
+        message += f"{self.count_waits} of {self.count_requests} requests waited for the rate limit, {round(self.total_wait_time, 3)} seconds in total. \n{self.queued} requests are waiting now."
+        return message
@@ -2,38 +2,33 @@
 """Directly executable script for notifications and remote interaction via a Telegram bot."""
 
 import os
-import asyncio
 from pathlib import Path
-from requests.exceptions import ConnectionError as RequestConnectionError
 from telethon import TelegramClient, events, types, errors
 from monitor import Monitor, CallbacksAbstract
 from utils import reboot_pi, get_ip
 from confighandler import ConfigHandler
+from transitions import Transition, format_transitions
+from telegram_sender import TelegramSender
+from notifications import Priority
 
 
-async def send(client, username: str, message: str, retry_count=0):
-    """Send a Telegram message"""
+def get_number_argument(text: str):
+    """Get the positive number passed after a command (e.g. the hours in `/plotavailability 24`), or None if there is none"""
+    arguments = text.split()[1:]
     try:
-        await client.send_message(username, message)
-    except RequestConnectionError as error:
-        if retry_count >= 5:
-            print(f"Retried {retry_count} times, auto-rebooting now...")
-            reboot_pi()
-        backoff_time = 10
-        print(
-            f"ConnectionError on sending Telegram message, waiting {backoff_time} seconds to try again. Error: {error}"
-        )
-        await asyncio.sleep(backoff_time)
-        await send(client, message, retry_count + 1)
+        number = float(arguments[0]) if len(arguments) > 0 else None
+    except ValueError:
+        return None
+    return number if number is not None and number > 0 else None
 
 
 # setup callbacks
 
 class Callbacks(CallbacksAbstract):
-    def __init__(self, client: TelegramClient, username: str, notification_prefs: dict) -> None:
+    def __init__(self, client: TelegramClient, sender: TelegramSender, username: str, notification_prefs: dict) -> None:
         self.client = client
+        self.sender = sender
         self.username = username
-        self.meta = (client, username)
         self.notification_prefs = notification_prefs
         super().__init__()
 
@@ -41,48 +36,52 @@ class Callbacks(CallbacksAbstract):
         if self.notification_prefs.get("on_start", True):
             message = f"New monitoring session!\nIP address: {get_ip()}"
             print(message)
-            await send(*self.meta, message)
+            await self.sender.send(self.username, message)
 
     async def on_stop(self):
         if self.notification_prefs.get("on_stop", True):
-            await send(*self.meta, "This bot is done scouting the shelves, goodbye!")
+            await self.sender.send(self.username, "This bot is done scouting the shelves, goodbye!")
+        await self.sender.flush()
 
-    async def on_stock_available(self, message):
+    async def on_transitions(self, transitions: list[Transition]):
         if self.notification_prefs.get("on_stock_available", True):
-            await send(*self.meta, message)
+            await self.sender.send(self.username, format_transitions(transitions), priority=Priority.HIGH)
 
     async def on_appointment_available(self, message):
         if self.notification_prefs.get("on_appointment_available", True):
-            await send(*self.meta, message)
+            await self.sender.send(self.username, message, priority=Priority.HIGH)
 
     async def on_newly_available(self):
         if self.notification_prefs.get("on_newly_available", True):
+            # sent as separate messages to notify three times, the sender paces them
             for i in range(3):
-                await send(*self.meta, f"AVAILABLE! {i}")
-                await asyncio.sleep(1)
+                await self.sender.send(self.username, f"AVAILABLE! {i}", coalesce=False, priority=Priority.HIGH)
 
     async def on_auto_report(self, report: str):
         if self.notification_prefs.get("on_auto_report", True):
-            await send(*self.meta, report)
+            await self.sender.send(self.username, f"{report}\nTelegram status: {self.sender.get_status()}",
+                                   priority=Priority.LOW)
 
     async def on_proxy_depletion(self, message: str):
         if self.notification_prefs.get("on_proxy_depletion", True):
-            await send(*self.meta, message)
+            await self.sender.send(self.username, message)
 
     async def on_long_processing_warning(self, warning: str):
         if self.notification_prefs.get("on_long_processing_warning", True):
-            await send(*self.meta, warning)
+            await self.sender.send(self.username, warning, priority=Priority.LOW)
 
     async def on_connection_error(self, error):
         if self.notification_prefs.get("on_connection_error", True):
-            await send(*self.meta, error)
+            await self.sender.send(self.username, error)
 
     async def on_error(self, error: str, logfile_path: Path):
         if self.notification_prefs.get("on_error", True):
-            await send(
-                *self.meta,
+            await self.sender.send(
+                self.username,
                 f"<b>Oops!</b> Something went wrong, the monitor <i>crashed</i>.\n  Reason: {error}",
+                priority=Priority.HIGH,
             )
+            await self.sender.flush()
             await self.send_logfile(logfile_path)
 
     async def send_logfile(self, logfile_path):
@@ -96,8 +95,8 @@ class Callbacks(CallbacksAbstract):
                     caption="Here's the log file!",
                 )
         else:
-            await send(
-                *self.meta,
+            await self.sender.send(
+                self.username,
                 f"Can't send the log file because there isn't one at {logfile_path}!",
             )
 
@@ -121,6 +120,8 @@ class TelegramConnection:
         # creating a Telegram session and assigning it to a variable client
         client = TelegramClient(self.session_name, self.api_id, self.api_hash)
         client.parse_mode = "html"
+        # flood waits are handled by the sender, instead of Telethon sleeping on them silently
+        client.flood_sleep_threshold = 0
         client.start(bot_token=self.bot_token)
 
         # registering the possible user commands
@@ -128,8 +129,10 @@ class TelegramConnection:
             "status": "retrieve the most recent check",
             "liststatus": "retrieve the statuses over the past report interval",
             "proxystatus": "retrieve the current proxy status",
-            "plotprocessingtime": "plot the processing time over time",
-            "plotavailability": "plot the availability over time",
+            "insights": "retrieve the availability rates by hour, store and model and the restock statistics",
+            "forecast": "retrieve the stores and models most likely to restock, optionally within the next N minutes",
+            "plotprocessingtime": "plot the processing time over time, optionally of the last N hours",
+            "plotavailability": "plot the availability over time, optionally of the last N hours",
             "getdata": "get the collected data as a CSV file",
             "getlog": "get the log file as a TXT file",
             "getconfig": "get the configuration file as a JSON file",
@@ -145,8 +148,22 @@ class TelegramConnection:
         print(commands_available_txt)
 
         # set up the monitor
-        callbacks = Callbacks(client, self.username, self.notification_prefs)
-        self.monitor = Monitor(callbacks)
+        # all chats share the sender, so the overall message rate is paced too
+        sender = TelegramSender(client, telegramconfig)
+        callbacks = Callbacks(client, sender, self.username, self.notification_prefs)
+
+        def create_profile_callbacks(profile: dict) -> Callbacks:
+            """Create the callbacks of a search profile, which can have its own recipient and notification preferences."""
+            return Callbacks(
+                client,
+                sender,
+                profile.get("username", self.username),
+                {**self.notification_prefs, **(profile.get("notifications") or {})},
+            )
+
+        self.monitor = Monitor(
+            callbacks, create_profile_callbacks=create_profile_callbacks
+        )
 
         # registering Telegram responses to the requests ((?i) makes it case insensitive)
         # status handler
@@ -166,10 +183,22 @@ class TelegramConnection:
         async def handle_proxy_status(event):
             await event.respond(self.monitor.get_proxystatus())
 
+        # insights handler
+        @client.on(events.NewMessage(pattern="(?i)/insights"))
+        async def handle_insights(event):
+            await event.respond(await self.monitor.get_insights())
+
+        # forecast handler
+        @client.on(events.NewMessage(pattern="(?i)/forecast"))
+        async def handle_forecast(event):
+            await event.respond(
+                self.monitor.get_forecast(get_number_argument(event.raw_text))
+            )
+
         # termination handler
         @client.on(events.NewMessage(pattern="(?i)/terminate"))
         async def handle_terminate(event):
-            self.monitor.save_df()
+            self.monitor.save_data()
             await event.respond(
                 "Terminating the monitor... \nTo start the monitor again, reboot."
             )
@@ -178,18 +207,18 @@ class TelegramConnection:
         # reboot handler
         @client.on(events.NewMessage(pattern="(?i)/reboot"))
         async def handle_reboot(event):
-            self.monitor.save_df()
+            self.monitor.save_data()
             await event.respond("Rebooting, I'll be back...")
             reboot_pi()
 
         # getdata handler
         @client.on(events.NewMessage(pattern="(?i)/getdata"))
         async def handle_get_data(event):
-            self.monitor.save_df()
+            filepath = self.monitor.export_data()
             async with client.action(self.username, "document") as action:
                 await client.send_file(
                     self.username,
-                    "data.csv",
+                    filepath,
                     progress_callback=action.progress,
                     caption="Here's the data file!",
                 )
@@ -197,14 +226,14 @@ class TelegramConnection:
         # getlog handler
         @client.on(events.NewMessage(pattern="(?i)/getlog"))
         async def handle_get_log(event):
-            self.monitor.save_df()
+            self.monitor.save_data()
             await callbacks.send_logfile(self.monitor.get_logfile_path())
 
         # plotprocessingtime handler
         @client.on(events.NewMessage(pattern="(?i)/plotprocessingtime"))
         async def handle_plot_processing_time(event):
-            filepath = self.monitor.plot_over_time(
-                yaxis="processing_time", ylabel="Processing time in seconds"
+            filepath = await self.monitor.plot_over_time(
+                yaxis="processing_time", ylabel="Processing time in seconds", hours=get_number_argument(event.raw_text)
             )
             async with client.action(self.username, "photo") as action:
                 await client.send_file(
@@ -217,8 +246,8 @@ class TelegramConnection:
         # plotavailability handler
         @client.on(events.NewMessage(pattern="(?i)/plotavailability"))
         async def handle_plot_availability(event):
-            filepath = self.monitor.plot_over_time(
-                yaxis="availability", ylabel="Available"
+            filepath = await self.monitor.plot_over_time(
+                yaxis="availability", ylabel="Available", hours=get_number_argument(event.raw_text)
             )
             async with client.action(self.username, "photo") as action:
                 await client.send_file(
@@ -243,7 +272,7 @@ class TelegramConnection:
         @client.on(events.NewMessage(pattern="(?i)/setconfig"))
         async def handle_set_config(event):
             await event.respond(
-                f"Attach a new `{configurationhandler.configfile_path}` in your next message and it will be set! Don't forget to delete data.csv in case something relevant changed."
+                f"Attach a new `{configurationhandler.configfile_path}` in your next message and it will be set! Don't forget to delete the history (data.sqlite) in case something relevant changed."
             )
 
         # general handler for all uploaded files
@@ -0,0 +1,96 @@
+"""Module for rendering the result of a poll to a HTML message or console text, only when it is needed."""
+
+import crayons
+import numpy as np
+
+from utils import format_timestamp
+from availability import AvailabilityMatrix
+
+
+class PollResult:
+    """The structured result of a poll, `version` only changes when the availability matrix changed.
+
+    The `timestamp` is in nanoseconds since the epoch (UTC).
+    """
+
+    __slots__ = ("version", "matrix", "timestamp", "processing_time")
+
+    def __init__(
+        self,
+        version: int,
+        matrix: AvailabilityMatrix,
+        timestamp: int,
+        processing_time: float,
+    ):
+        self.version = version
+        self.matrix = matrix
+        self.timestamp = timestamp
+        self.processing_time = processing_time
+
+    @property
+    def stock_available(self) -> bool:
+        return self.matrix is not None and self.matrix.any_available()
+
+
+def get_store_order(matrix: AvailabilityMatrix) -> list[int]:
+    """Get the indices of the stores in the poll, sorted by their sequence."""
+    sequences = matrix.index.store_sequences
+    rows = np.flatnonzero(matrix.listed.any(axis=1)).tolist()
+    return sorted(rows, key=lambda row: sequences[row])
+
+
+def render_message(matrix: AvailabilityMatrix, base_url: str) -> str:
+    """Render the stock of all stores in the poll to a HTML message."""
+    index = matrix.index
+    message = ""
+    for row in get_store_order(matrix):
+        message += "\n\n <b>{}, {} ({})</b>\n".format(
+            index.store_names[row], index.store_cities[row], index.store_numbers[row]
+        )
+        for column in np.flatnonzero(matrix.listed[row]).tolist():
+            available = matrix.available[row, column]
+            message += "{} {}{}{} ({})\n".format(
+                "✅" if available else "❌",
+                (
+                    f'<a href="{index.part_links[column] or base_url}">'
+                    if available
+                    else ""
+                ),
+                index.part_titles[column],
+                "</a>" if available else "",
+                index.part_numbers[column],
+            )
+    return message
+
+
+def render_console(matrix: AvailabilityMatrix) -> str:
+    """Render the stock of all stores in the poll to coloured console text."""
+    index = matrix.index
+    lines = list()
+    for row in get_store_order(matrix):
+        lines.append(
+            "\n\n{}, {} ({})".format(
+                crayons.green(index.store_names[row]),
+                crayons.green(index.store_cities[row]),
+                crayons.green(index.store_numbers[row]),
+            )
+        )
+        for column in np.flatnonzero(matrix.listed[row]).tolist():
+            colour = crayons.green if matrix.available[row, column] else crayons.red
+            lines.append(
+                " - {} {} ({})".format(
+                    colour("✔" if matrix.available[row, column] else "✖"),
+                    colour(index.part_titles[column]),
+                    colour(index.part_numbers[column]),
+                )
+            )
+    return "\n".join(lines)
+
+
+def render_short_status(result: PollResult, emoji=False) -> str:
+    """Render a single line summarizing a poll."""
+    if emoji:
+        symbol = "✅" if result.stock_available else "❌"
+    else:
+        symbol = "✔" if result.stock_available else "✖"
+    return f"{symbol} {format_timestamp(result.timestamp)} (in {result.processing_time} seconds)"
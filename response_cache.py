@@ -0,0 +1,85 @@
+"""Module for detecting responses that are unchanged since the previous poll, so they don't have to be processed again."""
+
+import hashlib
+
+
+class CachedResponse:
+    """The validators, body digest and processed value of the last response of a URL."""
+
+    __slots__ = ("etag", "last_modified", "digest", "value")
+
+    def __init__(self, etag: str, last_modified: str, digest: bytes, value):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+        self.value = value
+
+
+class ResponseCache:
+    """Class to keep track of the last response per URL using conditional request headers and body digests."""
+
+    def __init__(self):
+        """Initialization."""
+        self.entries: dict[str, CachedResponse] = dict()
+        self.count_not_modified = 0
+        self.count_identical_body = 0
+        self.count_changed = 0
+
+    @staticmethod
+    def digest(content: bytes) -> bytes:
+        """Compute a fast digest of a response body."""
+        return hashlib.blake2b(content, digest_size=16).digest()
+
+    def get_conditional_headers(self, url: str) -> dict:
+        """Get the If-None-Match / If-Modified-Since headers for the URL, based on the last response."""
+        headers = dict()
+        entry = self.entries.get(url)
+        if entry is not None:
+            if entry.etag is not None:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified is not None:
+                headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def lookup(self, url: str, response) -> tuple[bool, object]:
+        """Check whether the response is unchanged since the last stored response of the URL.
+
+        Returns whether it is unchanged and, if so, the value stored with the last response.
+        """
+        entry = self.entries.get(url)
+        if entry is None:
+            self.count_changed += 1
+            return False, None
+        if response.status_code == 304:
+            self.count_not_modified += 1
+            return True, entry.value
+        if self.digest(response.content) == entry.digest:
+            self.count_identical_body += 1
+            entry.etag = response.headers.get("ETag", entry.etag)
+            entry.last_modified = response.headers.get(
+                "Last-Modified", entry.last_modified
+            )
+            return True, entry.value
+        self.count_changed += 1
+        return False, None
+
+    def store(self, url: str, response, value):
+        """Store the processed value of a changed response of the URL."""
+        self.entries[url] = CachedResponse(
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            self.digest(response.content),
+            value,
+        )
+
+    def forget(self, url: str):
+        """Remove the stored response of a URL that will not be requested again."""
+        self.entries.pop(url, None)
+
+    def get_status(self) -> str:
+        """Generate a message on how often the unchanged response short-circuit fired."""
+        total = self.count_not_modified + self.count_identical_body + self.count_changed
+        if total == 0:
+            return "No responses have been received yet."
+        unchanged = self.count_not_modified + self.count_identical_body
+        return f"{unchanged} of {total} responses ({round(unchanged / total * 100, 1)}%) were unchanged and not processed again ({self.count_not_modified} not modified, {self.count_identical_body} identical bodies)."
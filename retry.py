@@ -0,0 +1,239 @@
+"""Module for retrying failed requests with jittered exponential backoff, behind a circuit breaker per host."""
+
+import time
+import random
+import asyncio
+from enum import Enum
+from typing import Awaitable, Callable
+
+import httpx
+from requests.exceptions import ConnectionError, Timeout
+
+
+class FailureKind(Enum):
+    """The kinds of failure that are worth retrying."""
+
+    FORBIDDEN = "forbidden"
+    RATE_LIMITED = "rate limited"
+    UNAVAILABLE = "service unavailable"
+    TIMEOUT = "timeout"
+    RESET = "connection reset"
+
+
+FAILURE_STATUS_CODES = {
+    403: FailureKind.FORBIDDEN,
+    429: FailureKind.RATE_LIMITED,
+    502: FailureKind.UNAVAILABLE,
+    503: FailureKind.UNAVAILABLE,
+    504: FailureKind.UNAVAILABLE,
+}
+
+
+def full_jitter(attempt: int, base_seconds: float, max_seconds: float) -> float:
+    """Draw a delay uniformly between 0 and the exponentially growing cap of the attempt."""
+    return random.uniform(0, min(max_seconds, base_seconds * 2**attempt))
+
+
+def floored_jitter(attempt: int, base_seconds: float, max_seconds: float) -> float:
+    """Draw a delay uniformly between the base and the exponentially growing cap of the attempt."""
+    cap = min(max_seconds, base_seconds * 2**attempt)
+    return random.uniform(min(base_seconds, cap), cap)
+
+
+def classify_response(response) -> FailureKind:
+    """Classify a response, returns None if it should not be retried."""
+    return FAILURE_STATUS_CODES.get(response.status_code)
+
+
+def classify_error(error: BaseException) -> FailureKind:
+    """Classify an error raised by a request, returns None if it should not be retried."""
+    if isinstance(error, (Timeout, httpx.TimeoutException)) or isinstance(
+        error.__cause__, httpx.TimeoutException
+    ):
+        return FailureKind.TIMEOUT
+    if isinstance(error, (ConnectionError, httpx.TransportError)):
+        return FailureKind.RESET
+    return None
+
+
+class CircuitState(Enum):
+    """The states of a circuit breaker."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of sending a request while the circuit breaker of the host is open."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Class to stop sending requests to a host after repeated failures.
+
+    After `failure_threshold` consecutive failures the circuit opens and requests fail right away.
+    Once `recovery_seconds` passed, a single probe request is let through (half-open): if it succeeds the circuit closes, otherwise it opens again.
+    Requests arriving while the probe is in flight wait for its outcome.
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_seconds: float = 60):
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_seconds = recovery_seconds
+        self.consecutive_failures = 0
+        self.opened_at: float = None
+        self.probe: asyncio.Event = None
+        self.count_opened = 0
+
+    def get_state(self, now: float = None) -> CircuitState:
+        """Get the current state of the circuit."""
+        if self.opened_at is None:
+            return CircuitState.CLOSED
+        now = time.monotonic() if now is None else now
+        if now - self.opened_at < self.recovery_seconds:
+            return CircuitState.OPEN
+        return CircuitState.HALF_OPEN
+
+    def seconds_until_probe(self, now: float = None) -> float:
+        """The number of seconds until a probe request is let through, 0 if requests are let through now."""
+        if self.opened_at is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.opened_at + self.recovery_seconds - now)
+
+    async def acquire(self):
+        """Wait until a request may be sent, raises a `CircuitOpenError` if the circuit is open."""
+        while True:
+            state = self.get_state()
+            if state is CircuitState.CLOSED:
+                return
+            if state is CircuitState.OPEN:
+                retry_after = self.seconds_until_probe()
+                raise CircuitOpenError(
+                    f"The circuit is open after {self.consecutive_failures} consecutive failures, the next attempt is in {round(retry_after, 1)} seconds.",
+                    retry_after,
+                )
+            if self.probe is None:
+                # this request is the probe
+                self.probe = asyncio.Event()
+                return
+            await self.probe.wait()
+
+    def release_probe(self):
+        """Let the requests waiting for the probe re-evaluate the state."""
+        if self.probe is not None:
+            self.probe.set()
+            self.probe = None
+
+    def record_success(self):
+        """Record a successful request, closing the circuit."""
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.release_probe()
+
+    def record_failure(self):
+        """Record a failed request, opening the circuit if the threshold is reached or the probe failed."""
+        self.consecutive_failures += 1
+        state = self.get_state()
+        if state is CircuitState.HALF_OPEN or (
+            state is CircuitState.CLOSED
+            and self.consecutive_failures >= self.failure_threshold
+        ):
+            if state is CircuitState.CLOSED:
+                self.count_opened += 1
+            self.opened_at = time.monotonic()
+        self.release_probe()
+
+
+class RetryPolicy:
+    """Class to execute requests with retries, waiting a full-jitter exponential delay between attempts without blocking the event loop."""
+
+    def __init__(self, settings: dict = None):
+        """Initialization.
+
+        Args:
+            settings (dict, optional): the `[retry]` section of the configuration. Defaults to None, in which case the defaults are used.
+        """
+        settings = settings or {}
+        self.max_attempts = max(1, settings.get("max_attempts", 3))
+        self.base_delay_seconds = settings.get("base_delay_seconds", 1)
+        self.max_delay_seconds = settings.get("max_delay_seconds", 30)
+        self.failure_threshold = settings.get("failure_threshold", 5)
+        self.recovery_seconds = settings.get("recovery_seconds", 60)
+        self.max_backoff_seconds = settings.get("max_backoff_seconds", 900)
+        self.circuit_breakers: dict[str, CircuitBreaker] = dict()
+        self.count_retries = 0
+        self.count_failures: dict[FailureKind, int] = {kind: 0 for kind in FailureKind}
+
+    def get_circuit_breaker(self, host: str) -> CircuitBreaker:
+        """Get the circuit breaker of the host, creating it on first use."""
+        circuit_breaker = self.circuit_breakers.get(host)
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker(
+                self.failure_threshold, self.recovery_seconds
+            )
+            self.circuit_breakers[host] = circuit_breaker
+        return circuit_breaker
+
+    def get_delay(self, attempt: int, response=None) -> float:
+        """The delay before the next attempt, drawn uniformly up to the exponential cap, but at least the Retry-After of the response."""
+        delay = full_jitter(attempt, self.base_delay_seconds, self.max_delay_seconds)
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, min(self.max_delay_seconds, float(retry_after)))
+        return delay
+
+    def get_backoff(self, attempt: int, base_seconds: float) -> float:
+        """The delay before polling again after consecutive failed polls, growing from the polling interval up to the maximum backoff."""
+        return floored_jitter(attempt, base_seconds, self.max_backoff_seconds)
+
+    async def execute(self, host: str, request: Callable[[], Awaitable]):
+        """Execute the request with retries behind the circuit breaker of the host.
+
+        Returns the last response if all attempts failed with a retryable response, raises the last error if they all failed with an error.
+        """
+        circuit_breaker = self.get_circuit_breaker(host)
+        for attempt in range(self.max_attempts):
+            await circuit_breaker.acquire()
+            try:
+                response = await request()
+            except BaseException as error:
+                kind = classify_error(error)
+                if kind is None:
+                    circuit_breaker.release_probe()
+                    raise
+                self.count_failures[kind] += 1
+                circuit_breaker.record_failure()
+                if attempt + 1 >= self.max_attempts:
+                    raise
+                delay = self.get_delay(attempt)
+            else:
+                kind = classify_response(response)
+                if kind is None:
+                    circuit_breaker.record_success()
+                    return response
+                self.count_failures[kind] += 1
+                circuit_breaker.record_failure()
+                if attempt + 1 >= self.max_attempts:
+                    return response
+                delay = self.get_delay(attempt, response)
+            self.count_retries += 1
+            await asyncio.sleep(delay)
+
+    def get_status(self) -> str:
+        """Generate a message on the retried failures and the state of the circuit breakers."""
+        failures = ", ".join(
+            f"{count} {kind.value}"
+            for kind, count in self.count_failures.items()
+            if count > 0
+        )
+        message = f"{self.count_retries} requests were retried"
+        message += f" after failures ({failures})." if failures else "."
+        for host, circuit_breaker in self.circuit_breakers.items():
+            if circuit_breaker.count_opened > 0:
+                message += f" \nThe circuit of {host} opened {circuit_breaker.count_opened} times and is {circuit_breaker.get_state().value} now."
+        return message
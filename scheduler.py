@@ -0,0 +1,205 @@
+"""Module for adaptively scheduling the polling of each (region, model) target, based on when restocks happened before."""
+
+import time
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+
+HOURS_PER_WEEK = 7 * 24
+
+
+def hour_of_week(timestamp: float) -> int:
+    """Get the hour of the week (0 is Monday 00:00 local time) of an epoch timestamp."""
+    moment = datetime.fromtimestamp(timestamp)
+    return moment.weekday() * 24 + moment.hour
+
+
+class RequestBudget:
+    """The budget of requests per hour shared by the schedulers of all searches.
+
+    If the targets of all schedulers together would exceed the budget, their intervals are stretched by a common factor.
+    Intervals that would exceed their maximum are capped, and the other intervals are stretched further to make up for them.
+    """
+
+    def __init__(self, max_requests_per_hour: int = 0):
+        """Initialization.
+
+        Args:
+            max_requests_per_hour (int, optional): the budget over all targets, 0 for no budget. Defaults to 0.
+        """
+        self.max_requests_per_hour = max_requests_per_hour
+        self.schedulers: list["PollingScheduler"] = list()
+
+    def register(self, scheduler: "PollingScheduler"):
+        """Add a scheduler whose targets count towards the budget."""
+        self.schedulers.append(scheduler)
+
+    def get_stretch(self, now: float) -> float:
+        """The factor by which the intervals of all schedulers are stretched to stay within the budget."""
+        if self.max_requests_per_hour <= 0:
+            return 1.0
+        schedulers = [
+            scheduler
+            for scheduler in self.schedulers
+            if scheduler.enabled and len(scheduler.targets) > 0
+        ]
+        if len(schedulers) == 0:
+            return 1.0
+        # the targets with the lowest rates reach their maximum interval first
+        rates = np.concatenate(
+            [3600 / scheduler.get_base_intervals(now) for scheduler in schedulers]
+        )
+        order = np.argsort(rates)
+        rates = rates[order]
+        capped_rates = np.concatenate(
+            [
+                np.full(len(scheduler.targets), 3600 / scheduler.max_interval_seconds)
+                for scheduler in schedulers
+            ]
+        )[order]
+        if rates.sum() <= self.max_requests_per_hour:
+            return 1.0
+        # with the k slowest targets capped, the others share the rest of the budget
+        remaining_rates = np.cumsum(rates[::-1])[::-1]
+        for capped in range(len(rates)):
+            budget = self.max_requests_per_hour - capped_rates[:capped].sum()
+            if budget <= 0:
+                break
+            stretch = remaining_rates[capped] / budget
+            if rates[capped] / stretch >= capped_rates[capped]:
+                return stretch
+        # even at their maximum intervals the targets exceed the budget
+        return float("inf")
+
+
+class PollingScheduler:
+    """Class keeping a next-due time per target, with intervals derived from the learned hour-of-week restock likelihood.
+
+    The interval of a target lies between the minimum and maximum interval: it is shortest in the hours of the week in which the target restocked most often and while it is available.
+    If the intervals of all searches together would exceed the request budget, they are stretched proportionally, up to the maximum interval.
+    A target whose request failed is polled again after an exponential backoff, starting at the minimum interval.
+    When disabled, every target is always due.
+    """
+
+    def __init__(self, settings: dict = None, budget: RequestBudget = None):
+        """Initialization.
+
+        Args:
+            settings (dict, optional): the `[scheduler]` section of the configuration. Defaults to None, in which case the scheduler is disabled.
+            budget (RequestBudget, optional): the request budget shared with the schedulers of other searches. Defaults to None, in which case the scheduler has its own budget.
+        """
+        settings = settings or {}
+        self.enabled = settings.get("enabled", False)
+        self.min_interval_seconds = settings.get("min_interval_seconds", 60)
+        self.max_interval_seconds = settings.get("max_interval_seconds", 600)
+        self.budget = budget or RequestBudget(settings.get("max_requests_per_hour", 0))
+        self.budget.register(self)
+        self.path = Path(settings["path"]) if settings.get("path") is not None else None
+        self.targets: dict[tuple[str, str], int] = dict()
+        self.next_due = np.zeros(0)
+        self.available = np.zeros(0, dtype=bool)
+        self.failures = np.zeros(0, dtype=int)
+        self.observations = np.zeros((0, HOURS_PER_WEEK))
+        self.restocks = np.zeros((0, HOURS_PER_WEEK))
+        self.load()
+
+    def get_target(self, target: tuple[str, str]) -> int:
+        """Get the index of a target, adding it (due immediately) if it is new."""
+        index = self.targets.get(target)
+        if index is None:
+            index = len(self.targets)
+            self.targets[target] = index
+            self.next_due = np.append(self.next_due, 0.0)
+            self.available = np.append(self.available, False)
+            self.failures = np.append(self.failures, 0)
+            self.observations = np.vstack(
+                [self.observations, np.zeros((1, HOURS_PER_WEEK))]
+            )
+            self.restocks = np.vstack([self.restocks, np.zeros((1, HOURS_PER_WEEK))])
+        return index
+
+    def is_due(self, target: tuple[str, str], now: float = None) -> bool:
+        """Whether a target should be polled now."""
+        if not self.enabled:
+            return True
+        now = time.time() if now is None else now
+        index = self.get_target(target)
+        return self.next_due[index] <= now
+
+    def seconds_until_due(self, now: float = None) -> float:
+        """The number of seconds until the first target is due, or None if there are no targets or the scheduler is disabled."""
+        if not self.enabled or len(self.targets) == 0:
+            return None
+        now = time.time() if now is None else now
+        return max(0.0, float(self.next_due.min()) - now)
+
+    def get_likelihoods(self, hour: int) -> np.ndarray:
+        """The restock likelihood of all targets in the given hour of the week, relative to their most likely hour."""
+        # add-one smoothing so targets without history are treated as equally likely to restock at any time
+        rates = (self.restocks + 1) / (self.observations + 2)
+        return rates[:, hour] / rates.max(axis=1)
+
+    def get_base_intervals(self, now: float) -> np.ndarray:
+        """The polling interval of all targets at the given time, regardless of the request budget."""
+        likelihoods = self.get_likelihoods(hour_of_week(now))
+        intervals = self.max_interval_seconds - likelihoods * (
+            self.max_interval_seconds - self.min_interval_seconds
+        )
+        intervals[self.available] = self.min_interval_seconds
+        return intervals
+
+    def get_intervals(self, now: float = None) -> np.ndarray:
+        """The polling interval of all targets at the given time, stretched to stay within the request budget."""
+        now = time.time() if now is None else now
+        intervals = self.get_base_intervals(now) * self.budget.get_stretch(now)
+        return np.minimum(intervals, self.max_interval_seconds)
+
+    def record(self, results: dict[tuple[str, str], bool], now: float = None):
+        """Record the availability of the polled targets and schedule their next poll."""
+        now = time.time() if now is None else now
+        hour = hour_of_week(now)
+        indices = np.array([self.get_target(target) for target in results], dtype=int)
+        if len(indices) == 0:
+            return
+        available = np.array(list(results.values()), dtype=bool)
+        self.observations[indices, hour] += 1
+        self.restocks[indices, hour] += available & ~self.available[indices]
+        self.available[indices] = available
+        self.failures[indices] = 0
+        self.next_due[indices] = now + self.get_intervals(now)[indices]
+
+    def record_failures(self, targets: list[tuple[str, str]], now: float = None):
+        """Schedule the next poll of the targets whose request failed, backing off exponentially while they keep failing."""
+        now = time.time() if now is None else now
+        indices = np.array([self.get_target(target) for target in targets], dtype=int)
+        if len(indices) == 0:
+            return
+        self.failures[indices] += 1
+        backoff = self.min_interval_seconds * 2.0 ** (self.failures[indices] - 1)
+        self.next_due[indices] = now + np.minimum(backoff, self.max_interval_seconds)
+
+    def load(self):
+        """Load the learned restock statistics from disk, if they were saved before."""
+        if self.path is None or not self.path.exists():
+            return
+        with np.load(self.path, allow_pickle=False) as saved:
+            for target, observations, restocks in zip(
+                saved["targets"].tolist(), saved["observations"], saved["restocks"]
+            ):
+                index = self.get_target(tuple(target))
+                self.observations[index] = observations
+                self.restocks[index] = restocks
+
+    def save(self):
+        """Save the learned restock statistics to disk."""
+        if self.path is None or len(self.targets) == 0:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("wb") as fp:
+            np.savez(
+                fp,
+                targets=np.array(list(self.targets.keys()), dtype=str),
+                observations=self.observations,
+                restocks=self.restocks,
+            )
@@ -1,21 +1,49 @@
 """Core class for searching stores."""
 
 import time
+import asyncio
 import logging
-from datetime import datetime
+from math import ceil
+from collections import deque
+from datetime import datetime, timezone
 from typing import Tuple
+from urllib.parse import urlsplit
 
 import crayons
 import minibar
-import requests
+from requests.exceptions import ConnectionError
 
 from http_request_randomizer.requests.proxy.requestProxy import RequestProxy
+from http_request_randomizer.requests.proxy.ProxyValidator import ProxyValidator
 from http_request_randomizer.requests.errors.ProxyListException import (
     ProxyListException,
 )
 
+from utils import format_timestamp
 from interface import CallbacksAbstract
 from confighandler import Configuration
+from transport import Transport, ProxiesBusyError
+from ratelimit import RateLimiter
+from retry import RetryPolicy, classify_response
+from response_cache import ResponseCache
+from catalog import CatalogCache, DeviceMatcher, diff_devices
+from decoding import StoreRecord, decode_availability, loads
+from availability import AvailabilityIndex, AvailabilityMatrix
+from availability_history import AvailabilityHistory
+from forecasting import RestockForecaster
+from transitions import TransitionEngine
+from scheduler import PollingScheduler, RequestBudget
+from rendering import (
+    PollResult,
+    render_console,
+    render_message,
+    render_short_status,
+)
+
+# the proxy settings that configure the proxy pool
+PROXY_POOL_SETTINGS = ("max_in_use", "quarantine_seconds", "max_failures")
+# the maximum number of short statuses kept for the status overview
+MAX_STATUS_LIST_LENGTH = 1000
 
 
 class StoreChecker:
@@ -27,9 +55,11 @@ class StoreChecker:
     # End point for searching for all possible product combinations in the
     # given product family.
     PRODUCT_LOCATOR_URL = "{0}shop/product-locator-meta?family={1}"
-    # End point for searching for pickup state of a certain model at a certain
-    # location.
-    PRODUCT_AVAILABILITY_URL = "{0}shop/retail/pickup-message?pl=true&parts.0={1}&{2}"
+    # End point for searching for pickup state of one or more models at a
+    # certain location, the models are passed as `parts.N` parameters.
+    PRODUCT_AVAILABILITY_URL = "{0}shop/retail/pickup-message?pl=true&{1}&{2}"
+    # Query parameter for the N-th model in a pickup state request.
+    PRODUCT_AVAILABILITY_PART = "parts.{0}={1}"
     # URL for the store availabile
     STORE_APPOINTMENT_AVAILABILITY_URL = "https://retail-pz.cdn-apple.com/product-zone-prod/availability/{0}/{1}/availability.json"
     # URL for the product buy
@@ -40,42 +70,132 @@ class StoreChecker:
         callbacks: CallbacksAbstract,
         configuration: Configuration,
         randomize_proxies=False,
+        proxy_settings: dict = None,
+        http_settings: dict = None,
+        cache_settings: dict = None,
+        scheduler_settings: dict = None,
+        request_budget: RequestBudget = None,
+        rate_limiter: RateLimiter = None,
+        retry_policy: RetryPolicy = None,
+        availability_history: AvailabilityHistory = None,
+        forecaster: RestockForecaster = None,
     ):
         """Initialize the configuration for checking store(s) for stock."""
 
         self.configuration = configuration
         self.stores_list_with_stock = {}
         self.base_url = "https://www.apple.com/"
-        self.last_status = "No status available yet, store checker has not completed"
-        self.status_list = list()
+        self.last_result: PollResult = None
+        self.matrix_version = 0
+        self.rendered: dict[str, tuple[int, str]] = dict()
+        self.poll_unchanged = False
+        self.last_device_list = None
+        self.count_skipped_renders = 0
+        self.parse_time = 0.0
+        self.availability_index = AvailabilityIndex()
+        self.transition_engine = TransitionEngine()
+        self.last_transitions = list()
+        self.response_cache = ResponseCache()
+        self.scheduler = PollingScheduler(scheduler_settings, request_budget)
+        self.target_stores: dict[tuple[str, str], list[StoreRecord]] = dict()
+        self.appointment_url = None
+        self.appointment_checked_at = float("-inf")
+        self.status_list: deque[str] = deque(maxlen=MAX_STATUS_LIST_LENGTH)
         self.device_list = list()
+        self.device_matcher = DeviceMatcher(
+            self.configuration.selected_device_models,
+            self.configuration.selected_carriers,
+        )
+        self.catalog_cache = CatalogCache(cache_settings)
+        self.catalog_fetched_at = time.time()
+        self.catalog_refresh_task = None
         self.callbacks = callbacks
+        self.http_settings = http_settings or {}
+        self.transport = Transport(self.http_settings, rate_limiter)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.availability_history = availability_history
+        self.forecaster = forecaster
 
         # set up randomized proxies if specified
         self.randomize_proxies = randomize_proxies
+        self.proxy_settings = proxy_settings or {}
         self.count_randomized_proxy_success = 0
         self.proxy_list_refresh_count = 0
-        if self.randomize_proxies:
-            self.refresh_proxies()
+        self.initial_num_proxies = 0
+        # the proxies are assembled in the background on the first proxied request
+        self.req_proxy: RequestProxy = None
+        self.proxy_refresh_task: asyncio.Task = None
 
         # Since the URL only needs country code for non-US countries, switch the URL for country == US.
         if self.configuration.country_code.upper() != "US":
             self.base_url = self.APPLE_BASE_URL.format(self.configuration.country_code)
 
+    def get_rendered(self, kind: str, render) -> str:
+        """Get the text rendered by the function for the last availability matrix, only rendering it again if the matrix changed."""
+        version, text = self.rendered.get(kind, (None, None))
+        if version != self.last_result.version:
+            text = render(self.last_result.matrix)
+            self.rendered[kind] = (self.last_result.version, text)
+        return text
+
+    def get_message(self) -> str:
+        """Get the HTML message with the stock of all stores in the last poll."""
+        if self.last_result is None:
+            return ""
+        return self.get_rendered(
+            "message", lambda matrix: render_message(matrix, self.base_url)
+        )
+
     def get_last_status(self):
-        return self.last_status
+        if self.last_result is None:
+            return "No status available yet, store checker has not completed"
+        return f"<i>Status as of {format_timestamp(self.last_result.timestamp)} (took {self.last_result.processing_time} seconds):</i> \n{self.get_message()}"
 
     def get_statuslist(self):
-        statuslist = "\n".join(self.status_list)
-        statuslist = statuslist.replace("✔", "✅")
-        statuslist = statuslist.replace("✖", "❌")
-        return statuslist
+        return "\n".join(self.status_list)
+
+    def get_cachestatus(self) -> str:
+        """Generate a message on how often unchanged stock was not processed again."""
+        return f"{self.response_cache.get_status()} \nThe stock was not rendered again {self.count_skipped_renders} times."
+
+    async def refresh_proxies(self):
+        """Get a new list of proxies in a thread, so the event loop keeps running while they are scraped and validated.
+
+        Requests that need the proxies at the same time wait for the same refresh.
+        """
+        if self.proxy_refresh_task is None or self.proxy_refresh_task.done():
+            self.proxy_refresh_task = asyncio.create_task(
+                asyncio.to_thread(self.assemble_proxies)
+            )
+        await asyncio.shield(self.proxy_refresh_task)
 
-    def refresh_proxies(self):
-        """Get a new list of proxies"""
+    def assemble_proxies(self):
+        """Scrape a new list of proxies and validate them. Blocking, runs in a thread."""
         try:
             print("Assembling a list of proxies to use...\n")
-            self.req_proxy = RequestProxy(log_level=logging.CRITICAL)
+            # check the proxies in parallel first, so dead ones never enter the pool
+            validator = (
+                ProxyValidator(
+                    self.proxy_settings.get(
+                        "check_url", "https://www.apple.com/robots.txt"
+                    ),
+                    self.proxy_settings.get("check_timeout_seconds", 3),
+                    self.proxy_settings.get("max_concurrent_checks", 100),
+                )
+                if self.proxy_settings.get("validate", True)
+                else None
+            )
+            self.req_proxy = RequestProxy(
+                log_level=logging.CRITICAL,
+                pool_settings={
+                    key: self.proxy_settings[key]
+                    for key in PROXY_POOL_SETTINGS
+                    if key in self.proxy_settings
+                },
+                validator=validator,
+            )
+            if validator is not None:
+                print(validator.get_status())
             self.initial_num_proxies = self.get_num_proxies()
             self.proxy_list_refresh_count += 1
         except ProxyListException as error:
@@ -84,14 +204,12 @@ class StoreChecker:
 
     def get_num_proxies(self) -> int:
         """Get the number of proxies in the list"""
-        if self.randomize_proxies is True:
+        if self.randomize_proxies is True and self.req_proxy is not None:
             return len(self.req_proxy.get_proxy_list())
         return 0
 
-    async def refresh(self, verbose=True):
-        """Refresh information about the stock that is available on the Apple website, returns whether it is available"""
-        start_time = time.perf_counter()
-
+    async def ensure_devices(self, verbose=True):
+        """Look up the requested devices if that did not happen yet, or refresh them in the background if they are outdated."""
         # only look up the devices once, assuming this only needs to happen once per session
         if len(self.device_list) == 0:
             print("Looking up the requested devices...\n")
@@ -116,6 +234,14 @@ class StoreChecker:
                         )
                     )
             print("Retrieving stock and appointment information...")
+        elif self.catalog_cache.is_expired(self.catalog_fetched_at):
+            self.start_catalog_refresh()
+
+    async def refresh(self, verbose=True, prefetched: dict = None):
+        """Refresh information about the stock that is available on the Apple website, returns whether it is available"""
+        start_time = time.perf_counter()
+
+        await self.ensure_devices(verbose)
 
         # Downloading the list of products from the server.
         if verbose:
@@ -127,119 +253,115 @@ class StoreChecker:
                 )
             )
 
-        self.stores_list_with_stock = {}
-        for device in minibar.bar(self.device_list) if verbose else self.device_list:
-            await self.check_stores_for_device(device)
-
-        # Get all the stores and sort it by the sequence.
-        stores = list(self.stores_list_with_stock.values())
-        stores.sort(key=lambda k: k["sequence"])
-
-        # Boolean indicating if the stock is available for any of the items
-        # requested (used to play the sound)
-        stock_available = False
-
-        # Go through the stores and fetch the stock for all the devices/parts
-        # in the store and print their status.
-        message = ""
-
-        def getlink(device_list, partNumber: str) -> str:
-            for device in device_list:
-                if device.get("model") == partNumber:
-                    return device.get("link")
-            return self.base_url
-
-        for store in stores:
+        # only process and render the stock again if any of the responses or devices changed since the previous poll
+        self.poll_unchanged = self.device_list is self.last_device_list
+        self.last_device_list = self.device_list
+        self.parse_time = 0.0
+        stores_per_device = await self.fetch_stores_for_devices(
+            self.device_list, verbose, prefetched
+        )
+        if self.poll_unchanged and self.last_result is not None:
+            self.count_skipped_renders += 1
+            matrix = self.last_result.matrix
             if verbose:
-                print(
-                    "\n\n{}, {} ({})".format(
-                        crayons.green(store.get("storeName")),
-                        crayons.green(store.get("city")),
-                        crayons.green(store.get("storeId")),
-                    )
-                )
-            message += "\n\n <b>{}, {} ({})</b>\n".format(
-                store.get("storeName"), store.get("city"), store.get("storeId")
+                print("{}".format(crayons.blue("➜  Stock is unchanged")))
+        else:
+            self.stores_list_with_stock = {}
+            for stores in stores_per_device:
+                self.merge_stores(stores)
+            # build the availability matrix of this poll, it is only rendered when needed
+            self.availability_index.set_links(self.device_list)
+            matrix = AvailabilityMatrix.from_stores(
+                self.stores_list_with_stock.values(), self.availability_index
             )
-            for part_id, part in store.get("parts").items():
-                partNumber = part.get("partNumber")
-                available = (
-                    part.get("messageTypes").get("regular").get("storeSelectionEnabled")
-                )
-                if available:
-                    stock_available = True
-                storePickupProductTitle = (
-                    part.get("messageTypes")
-                    .get("regular")
-                    .get("storePickupProductTitle")
-                )
-                partNumber = part.get("partNumber")
-                if verbose:
-                    print(
-                        " - {} {} ({})".format(
-                            crayons.green("✔") if available else crayons.red("✖"),
-                            (
-                                crayons.green(storePickupProductTitle)
-                                if available
-                                else crayons.red(storePickupProductTitle)
-                            ),
-                            (
-                                crayons.green(partNumber)
-                                if available
-                                else crayons.red(partNumber)
-                            ),
-                        )
-                    )
-                message += "{} {}{}{} ({})\n".format(
-                    "✅" if available else "❌",
-                    (
-                        f'<a href="{getlink(self.device_list, partNumber)}">'
-                        if available
-                        else ""
-                    ),
-                    storePickupProductTitle,
-                    "</a>" if available else "",
-                    partNumber,
-                )
-
-        current_datetime = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+            self.matrix_version += 1
+            if verbose:
+                print(render_console(matrix))
+        stock_available = matrix.any_available()
+
+        # only notify about the parts in stores of which the availability changed since the previous poll
+        self.last_transitions = self.transition_engine.update(matrix)
+        changed_transitions = [
+            transition for transition in self.last_transitions if transition.changed
+        ]
+        if len(changed_transitions) > 0:
+            await self.callbacks.on_transitions(changed_transitions)
+
+        timestamp = time.time_ns()
         processing_time = round(time.perf_counter() - start_time, 3)
-        self.last_status = f"<i>Status as of {current_datetime} (took {processing_time} seconds):</i> \n{message}"
+        self.last_result = PollResult(
+            self.matrix_version, matrix, timestamp, processing_time
+        )
+        if self.availability_history is not None:
+            self.availability_history.append(timestamp, matrix, self.matrix_version)
 
-        # Play the sound if phone is available.
         if stock_available:
-            # immediately send a message!
-            await self.callbacks.on_stock_available(message)
             if verbose:
                 print(
                     "\n{}".format(crayons.green("Current Status - Stock is Available"))
                 )
-            else:
-                short_status = f"✔ {current_datetime} (in {processing_time} seconds)"
-                self.status_list.append(short_status)
-                print(crayons.green(short_status))
         elif verbose:
             print("\n{}".format(crayons.red("Current Status - No Stock Available")))
-        else:
-            short_status = f"✖ {current_datetime} (in {processing_time} seconds)"
-            self.status_list.append(short_status)
-            print(crayons.red(short_status))
+        if not verbose:
+            # only keep the rendered line, not the matrix of every poll
+            self.status_list.append(render_short_status(self.last_result, emoji=True))
+            short_status = render_short_status(self.last_result)
+            print(
+                crayons.green(short_status)
+                if stock_available
+                else crayons.red(short_status)
+            )
         if verbose:
+            print(f"Decoding the responses took {round(self.parse_time, 3)} seconds")
             print("\n")
 
-        # lookup the appointment slots if the user has this configured
-        if not not self.configuration.appointment_stores:
+        # lookup the appointment slots if the user has this configured, at its own interval
+        if (
+            not not self.configuration.appointment_stores
+            and time.monotonic() - self.appointment_checked_at
+            >= self.configuration.appointment_interval_seconds
+        ):
+            self.appointment_checked_at = time.monotonic()
             slots_found, message = await self.get_store_availability()
             if slots_found is True:
                 await self.callbacks.on_appointment_available(message)
 
-        return stock_available, current_datetime, processing_time
+        return stock_available, timestamp, processing_time
 
     async def find_devices(self, verbose=True):
-        """Find the required devices based on the configuration."""
-        # Store the information about the available devices for the family -
-        # title, model, carrier.
-        device_list = []
+        """Find the required devices based on the configuration, from the catalog cache if it is available."""
+        cached = self.catalog_cache.load(
+            self.configuration.country_code, self.configuration.device_family
+        )
+        if cached is not None:
+            products, self.catalog_fetched_at = cached
+            if verbose:
+                print("{}".format(crayons.blue("➜  Using the cached models list...")))
+            # serve the cached devices immediately, refresh them in the background if they are outdated
+            if self.catalog_cache.is_expired(self.catalog_fetched_at):
+                self.start_catalog_refresh()
+            device_list = self.device_matcher.filter(products)
+        else:
+            self.catalog_fetched_at = time.time()
+            products = await self.download_catalog(verbose)
+            if products is not None:
+                device_list = self.device_matcher.filter(products)
+            else:
+                device_list = list()
+                if self.configuration.selected_device_models is not None:
+                    if verbose:
+                        print(
+                            "{}".format(
+                                crayons.blue("➜  Looking for device models instead...")
+                            )
+                        )
+                    for model in self.configuration.selected_device_models:
+                        device_list.append({"model": model})
+        print(device_list)
+        return device_list
+
+    async def download_catalog(self, verbose=True) -> list[dict]:
+        """Download the list of products of the device family and store it in the catalog cache, returns None if it failed."""
         # Downloading the list of products from the server for the current
         # device family.
         if verbose:
@@ -247,14 +369,16 @@ class StoreChecker:
         product_locator_response = await self.get_request(
             self.PRODUCT_LOCATOR_URL.format(
                 self.base_url, self.configuration.device_family
-            )
+            ),
+            verbose=verbose,
         )
         if (
             product_locator_response.status_code != 200
             or product_locator_response.json() is None
         ):
-            print("----> HERE" + str(device_list))
-            return []
+            if verbose:
+                print("{}".format(crayons.red("✖  Failed to download the models list")))
+            return None
 
         try:
             product_list = (
@@ -265,93 +389,269 @@ class StoreChecker:
                 .get("products")
             )
             # Take out the product list and extract only the useful
-            # information.
-            for product in product_list:
-                model = product.get("partNumber")
-                carrier = product.get("carrierModel")
-                # Only add the requested models and requested carriers (device
-                # models are partially matched)
-                if (
-                    any(
-                        item in model
-                        for item in self.configuration.selected_device_models
-                    )
-                    or len(self.configuration.selected_device_models) == 0
-                ) and (
-                    carrier in self.configuration.selected_carriers
-                    or len(self.configuration.selected_carriers) == 0
-                ):
-                    device_list.append(
-                        {
-                            "title": product.get("productTitle"),
-                            "model": model,
-                            "carrier": carrier,
-                            "link": product.get("productLink"),
-                        }
-                    )
+            # information: title, model, carrier and link.
+            products = [
+                {
+                    "title": product.get("productTitle"),
+                    "model": product.get("partNumber"),
+                    "carrier": product.get("carrierModel"),
+                    "link": product.get("productLink"),
+                }
+                for product in product_list
+            ]
         except BaseException:
             if verbose:
                 print("{}".format(crayons.red("✖  Failed to find the device family")))
-            if self.configuration.selected_device_models is not None:
-                if verbose:
-                    print(
-                        "{}".format(
-                            crayons.blue("➜  Looking for device models instead...")
-                        )
-                    )
-                for model in self.configuration.selected_device_models:
-                    device_list.append({"model": model})
-        print(device_list)
-        return device_list
+            return None
+        self.catalog_cache.save(
+            self.configuration.country_code, self.configuration.device_family, products
+        )
+        return products
+
+    def start_catalog_refresh(self):
+        """Refresh the product catalog in the background, unless a refresh is already running."""
+        if self.catalog_refresh_task is None or self.catalog_refresh_task.done():
+            self.catalog_fetched_at = time.time()
+            self.catalog_refresh_task = asyncio.create_task(self.refresh_catalog())
+
+    async def refresh_catalog(self):
+        """Download the product catalog and update the devices if they changed."""
+        try:
+            products = await self.download_catalog(verbose=False)
+        except ConnectionError as error:
+            print(f"Failed to refresh the models list: {error}")
+            return
+        if products is None:
+            return
+        device_list = self.device_matcher.filter(products)
+        added, removed = diff_devices(self.device_list, device_list)
+        if len(device_list) > 0 and (len(added) > 0 or len(removed) > 0):
+            for device in added:
+                print(crayons.green(f"+ {device.get('title')} ({device.get('model')})"))
+            for device in removed:
+                print(crayons.red(f"- {device.get('title')} ({device.get('model')})"))
+            self.device_list = device_list
 
     async def check_stores_for_device(self, device, verbose=True):
         """Find all stores that have the device requested available (does not matter if it's in stock or not)."""
-
-        # Make a request per region
-        store_list: list[str] = list()
-        for region in self.configuration.regions:
-            product_availability_response = await self.get_request(
-                self.PRODUCT_AVAILABILITY_URL.format(
-                    self.base_url, device.get("model"), region
+        await self.check_stores_for_devices([device], verbose)
+
+    async def check_stores_for_devices(self, device_list: list, verbose=True):
+        """Fetch the stores for every device and region and merge them into the stores with stock."""
+        for stores in await self.fetch_stores_for_devices(device_list, verbose):
+            self.merge_stores(stores)
+
+    async def fetch_stores_for_devices(
+        self, device_list: list, verbose=True, prefetched: dict = None
+    ) -> list:
+        """Fetch the stores for every device and region that is due and group them per device.
+
+        Returns for each device in order the stores of all regions in region order, so merging them gives the same outcome as checking the devices one by one.
+        Regions of a device that are not due yet use the stores of their last poll.
+        A device is skipped if the request for any of its regions failed.
+        If the stores of the due targets were already fetched, e.g. shared with other search profiles, they can be passed as `prefetched`.
+        """
+        if prefetched is None:
+            targets = self.get_due_targets(device_list)
+            prefetched = await self.fetch_targets(targets, verbose)
+        else:
+            targets = [
+                (region, device)
+                for region in self.configuration.regions
+                for device in device_list
+                if (region, device.get("model")) in prefetched
+            ]
+
+        # keep the stores per target and let the scheduler learn from the targets that were polled
+        polled = dict()
+        failed = list()
+        for region, device in targets:
+            target = (region, device.get("model"))
+            stores = prefetched.get(target)
+            # unchanged responses are served from the response cache as the same objects
+            if stores is not self.target_stores.get(target, False):
+                self.poll_unchanged = False
+            self.target_stores[target] = stores
+            if stores is None:
+                failed.append(target)
+            else:
+                polled[target] = any(
+                    part.available
+                    for store in stores
+                    if self.is_selected_store(store.store_number)
+                    for part in store.parts.values()
                 )
+        self.scheduler.record(polled)
+        # back off on the failed targets, so they are not due again right away
+        self.scheduler.record_failures(failed)
+
+        # group the results per device, in region order
+        stores_per_device = list()
+        for device in device_list:
+            device_results = [
+                self.target_stores.get((region, device.get("model")))
+                for region in self.configuration.regions
+            ]
+            if any(stores is None for stores in device_results):
+                continue
+            stores_per_device.append(
+                [store for stores in device_results for store in stores]
             )
-            if verbose:
-                print(product_availability_response)
+        return stores_per_device
+
+    def get_due_targets(self, device_list: list) -> list[tuple[str, dict]]:
+        """Get the (region, device) targets that are due to be polled, or that were never polled.
+
+        With a restock forecast, the models most likely to restock come first, so their requests are sent first.
+        """
+        targets = [
+            (region, device)
+            for region in self.configuration.regions
+            for device in device_list
+            if self.scheduler.is_due((region, device.get("model")))
+            or (region, device.get("model")) not in self.target_stores
+        ]
+        if self.forecaster is not None:
+            probabilities = self.forecaster.get_part_probabilities()
+            targets.sort(
+                key=lambda target: -probabilities.get(target[1].get("model"), 0)
+            )
+        return targets
+
+    async def fetch_targets(
+        self, targets: list[tuple[str, dict]], verbose=True
+    ) -> dict[tuple[str, str], list[StoreRecord]]:
+        """Fetch the stores of the (region, device) targets, packing up to `parts_per_request` devices of a region in each request.
+
+        Unless disabled, the requests are made concurrently, bounded by the configured number of concurrent requests.
+        Returns the stores per (region, model), which are None if the request failed.
+        """
+        parts_per_request = max(1, self.http_settings.get("parts_per_request", 8))
+        devices_per_region: dict[str, list] = dict()
+        for region, device in targets:
+            devices_per_region.setdefault(region, list()).append(device)
+        queries = [
+            (devices[i : i + parts_per_request], region)
+            for region, devices in devices_per_region.items()
+            for i in range(0, len(devices), parts_per_request)
+        ]
+
+        if self.http_settings.get("concurrent_requests", True):
+            semaphore = asyncio.Semaphore(
+                self.http_settings.get("max_concurrent_requests", 8)
+            )
+
+            async def fetch_limited(chunk, region):
+                async with semaphore:
+                    return await self.fetch_stores(chunk, region, verbose=False)
+
+            results = await asyncio.gather(
+                *(fetch_limited(chunk, region) for chunk, region in queries)
+            )
+        else:
+            results = list()
+            for chunk, region in minibar.bar(queries) if verbose else queries:
+                results.append(await self.fetch_stores(chunk, region, verbose))
+
+        return {
+            (region, device.get("model")): stores
+            for (chunk, region), chunk_results in zip(queries, results)
+            for device, stores in zip(chunk, chunk_results)
+        }
+
+    async def fetch_stores(self, devices: list, region: str, verbose=True) -> list:
+        """Fetch the stores with the availability of the devices in the region in a single request.
+
+        Returns a list with for each device the stores limited to the availability of that device, or None if its request failed.
+        If a request for multiple devices is rejected (e.g. 400), it is retried in two halves until the devices are requested one by one.
+        """
+        url = self.PRODUCT_AVAILABILITY_URL.format(
+            self.base_url,
+            "&".join(
+                self.PRODUCT_AVAILABILITY_PART.format(index, device.get("model"))
+                for index, device in enumerate(devices)
+            ),
+            region,
+        )
+        product_availability_response = await self.get_request(
+            url,
+            verbose=verbose,
+            headers=self.response_cache.get_conditional_headers(url),
+        )
+        if verbose:
+            print(product_availability_response)
+
+        # reuse the stores of the previous poll if the response is unchanged
+        unchanged, stores_per_device = self.response_cache.lookup(
+            url, product_availability_response
+        )
+        if unchanged:
+            return stores_per_device
+
+        # decode the response once, timing it separately from the request
+        start_time = time.perf_counter()
+        stores = (
+            decode_availability(product_availability_response.content)
+            if product_availability_response.status_code == 200
+            else None
+        )
+        self.parse_time += time.perf_counter() - start_time
+        if stores is None:
+            # only split on responses that are not retried, e.g. a bad request because of one of the parts,
+            # an outage (e.g. 503 or 429 after the retries) would only multiply the requests
             if (
-                product_availability_response.status_code != 200
-                or product_availability_response.json() is None
+                len(devices) > 1
+                and classify_response(product_availability_response) is None
             ):
-                print("\n{}".format(crayons.red("Cannot get stores!")))
-                return
-            store_list.extend(
-                product_availability_response.json().get("body").get("stores")
+                half = ceil(len(devices) / 2)
+                return await self.fetch_stores(
+                    devices[:half], region, verbose
+                ) + await self.fetch_stores(devices[half:], region, verbose)
+            print("\n{}".format(crayons.red("Cannot get stores!")))
+            return [None]
+        if len(devices) == 1:
+            stores_per_device = [stores]
+        else:
+            stores_per_device = [
+                self.split_stores(stores, device.get("model")) for device in devices
+            ]
+        self.response_cache.store(url, product_availability_response, stores_per_device)
+        return stores_per_device
+
+    @staticmethod
+    def split_stores(stores: list[StoreRecord], part_number: str) -> list[StoreRecord]:
+        """Limit the availability of each store in a batched response to a single part."""
+        return [
+            store.with_parts(
+                {part_number: store.parts[part_number]}
+                if part_number in store.parts
+                else {}
             )
+            for store in stores
+        ]
+
+    def is_selected_store(self, store_number: str) -> bool:
+        """Whether the store is one of the user's preferred stores, all stores are if there are none."""
+        return (
+            store_number in self.configuration.selected_stores
+            or len(self.configuration.selected_stores) == 0
+        )
 
-        # Go through all the stores in the list and extract useful information.
-        # Group products by store (put the stock for this device in the store's
-        # parts attribute)
+    def merge_stores(self, store_list: list[StoreRecord]):
+        """Group the parts of the stores by store, only for the user's preferred stores."""
         for store in store_list:
-            current_store = self.stores_list_with_stock.get(store.get("storeNumber"))
-            if current_store is None:
-                current_store = {
-                    "storeId": store.get("storeNumber"),
-                    "storeName": store.get("storeName"),
-                    "city": store.get("city"),
-                    "sequence": store.get("storeListNumber"),
-                    "parts": {},
-                }
-            new_parts = store.get("partsAvailability")
-            old_parts = current_store.get("parts")
-            old_parts.update(new_parts)
-            current_store["parts"] = old_parts
-
             # If the store is in the list of user's preferred stores, add it to the
             # list to check for stock.
-            if (
-                store.get("storeNumber") in self.configuration.selected_stores
-                or len(self.configuration.selected_stores) == 0
-            ):
-                self.stores_list_with_stock[store.get("storeNumber")] = current_store
+            if not self.is_selected_store(store.store_number):
+                continue
+            current_store = self.stores_list_with_stock.get(store.store_number)
+            if current_store is None:
+                # copy the parts, as the decoded stores are reused for unchanged responses
+                self.stores_list_with_stock[store.store_number] = store.with_parts(
+                    dict(store.parts)
+                )
+            else:
+                current_store.parts.update(store.parts)
 
     async def get_store_availability(self) -> Tuple[bool, str]:
         """Get a list of all the stores to check appointment availability, returns the message to send"""
@@ -360,61 +660,98 @@ class StoreChecker:
                 crayons.blue("➜  Downloading store appointment availability...\n")
             )
         )
+        # the availability document is published per hour, only download it again if it changed
+        now = datetime.now(timezone.utc)
+        url = self.STORE_APPOINTMENT_AVAILABILITY_URL.format(
+            now.strftime("%Y-%m-%d"), now.strftime("%H")
+        )
+        if self.appointment_url is not None and self.appointment_url != url:
+            self.response_cache.forget(self.appointment_url)
+        self.appointment_url = url
         store_availability_list = await self.get_request(
-            self.STORE_APPOINTMENT_AVAILABILITY_URL.format(
-                datetime.now().strftime("%Y-%m-%d"), datetime.utcnow().strftime("%H")
-            )
+            url, verbose=False, headers=self.response_cache.get_conditional_headers(url)
         )
+        unchanged, appointment_index = self.response_cache.lookup(
+            url, store_availability_list
+        )
+        if not unchanged:
+            if store_availability_list.status_code != 200:
+                print(
+                    "{}".format(crayons.red("✖  Cannot get appointment availability"))
+                )
+                return False, ""
+            # index only the stores of interest by store number, in a single pass over all stores
+            appointment_stores = set(self.configuration.appointment_stores)
+            appointment_index = {
+                store.get("storeNumber"): store
+                for store in loads(store_availability_list.content)
+                if store.get("storeNumber") in appointment_stores
+            }
+            self.response_cache.store(url, store_availability_list, appointment_index)
+
         message = ""
         slots_found = False
-        for store in store_availability_list.json():
-            if store.get("storeNumber") in self.configuration.appointment_stores:
-                store_number = store.get("storeNumber")
-                if store.get("appointmentsAvailable") is True:
-                    appointment_datetime = datetime.utcfromtimestamp(
-                        int(store.get("firstAvailableAppointment"))
-                    ).strftime("%d-%m-%Y %H:%M:%S")
-                    message += f"First appointment slot available at {store_number}: {appointment_datetime}\n"
-                    print(
-                        " - Appointment Slot Available: {} {} ({})".format(
-                            crayons.green("✔"),
-                            store_number,
-                            appointment_datetime,
-                        )
+        for store_number in self.configuration.appointment_stores:
+            store = appointment_index.get(store_number)
+            if store is None:
+                continue
+            if store.get("appointmentsAvailable") is True:
+                appointment_datetime = datetime.fromtimestamp(
+                    int(store.get("firstAvailableAppointment")), timezone.utc
+                ).strftime("%d-%m-%Y %H:%M:%S")
+                message += f"First appointment slot available at {store_number}: {appointment_datetime}\n"
+                print(
+                    " - Appointment Slot Available: {} {} ({})".format(
+                        crayons.green("✔"),
+                        store_number,
+                        appointment_datetime,
                     )
-                    slots_found = True
-                else:
-                    print(" - {} {}".format(crayons.red("✖"), store_number))
+                )
+                slots_found = True
+            else:
+                print(" - {} {}".format(crayons.red("✖"), store_number))
         print("{}".format(crayons.blue("\n✔  Done\n")))
         return slots_found, message
 
-    async def get_request(
-        self, url: str, proxy_retry_count=0, verbose=True
-    ) -> requests.Response:
+    async def get_request(self, url: str, verbose=True, headers: dict = None):
+        """Wrapper function to execute a get request, retrying failures with backoff behind the circuit breaker of the host"""
         if verbose:
             print(url)
-        """ Wrapper function to execute a get request, optionally with a randomized proxy """
-        max_proxy_attempts = 1
-        if self.randomize_proxies is False or proxy_retry_count >= max_proxy_attempts:
-            if self.randomize_proxies is True:
+        return await self.retry_policy.execute(
+            urlsplit(url).netloc, lambda: self.get_response(url, headers)
+        )
+
+    async def get_response(self, url: str, headers: dict = None):
+        """Execute a single get request, via a randomized proxy if enabled, falling back to a non-proxied request if the proxy failed or all proxies are busy"""
+        if self.randomize_proxies is True and self.req_proxy is None:
+            await self.refresh_proxies()
+        # no proxies may have been found
+        if self.randomize_proxies is True:
+            try:
+                response = await self.transport.get(
+                    url, req_proxy=self.req_proxy, headers=headers
+                )
+                if response is not None:
+                    self.count_randomized_proxy_success += 1
+                    return response
                 print(
                     crayons.red(
-                        f"  randomized proxies failed {max_proxy_attempts} times, falling back to a non-proxied request. If this happens often, consider disabling randomized proxies."
+                        "  randomized proxy failed, falling back to a non-proxied request. If this happens often, consider disabling randomized proxies."
                     )
                 )
-            return requests.get(url)
-        else:
-            try:
-                response = self.req_proxy.generate_proxied_request(url, req_timeout=30)
-                if response is not None and isinstance(response, requests.Response):
-                    self.count_randomized_proxy_success += 1
-                    return response
-                else:
-                    time.sleep(3)
-                    return await self.get_request(url, proxy_retry_count + 1, verbose)
+            except ProxiesBusyError:
+                # every proxy is in use, only this request is sent directly
+                pass
             except ProxyListException:
                 message = f"Proxy list has been depleted, refreshing the proxy list..."
                 print(message)
                 await self.callbacks.on_proxy_depletion(message)
-                self.refresh_proxies()
-                return await self.get_request(url)
+                await self.refresh_proxies()
+        return await self.transport.get(url, headers=headers)
+
+    async def close(self):
+        """Close the pooled connections of the transport and save what the scheduler learned."""
+        self.scheduler.save()
+        if self.availability_history is not None:
+            self.availability_history.close()
+        await self.transport.aclose()
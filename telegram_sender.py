@@ -0,0 +1,186 @@
+"""Module for sending Telegram messages paced to the limits of Telegram, merging messages sent in quick succession."""
+
+import re
+import time
+import asyncio
+from collections import deque
+
+from telethon import errors
+
+from ratelimit import TokenBucket
+from retry import full_jitter
+from notifications import Priority
+
+# the maximum length of a Telegram message
+MAX_MESSAGE_LENGTH = 4096
+MESSAGE_SEPARATOR = "\n\n"
+# an opening or closing HTML tag, the first group is the slash of a closing tag
+HTML_TAG = re.compile(r"<(/?)[^<>]*>")
+
+
+def split_message(message: str, max_length: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """Split a message that is too long into parts at line breaks, so no HTML tag is cut in half.
+
+    A single line that is too long is split outside of its HTML elements where possible.
+    """
+    parts = list()
+    while len(message) > max_length:
+        cut = message.rfind("\n", 0, max_length + 1)
+        if cut <= 0:
+            cut = get_line_cut(message, max_length)
+        parts.append(message[:cut])
+        message = message[cut:].lstrip("\n")
+    parts.append(message)
+    return parts
+
+
+def get_line_cut(line: str, max_length: int) -> int:
+    """Get the position to cut a line that is too long at: the last space outside of HTML elements, or else right before an element."""
+    cut = 0
+    depth = 0
+    position = 0
+    for tag in HTML_TAG.finditer(line):
+        if tag.start() >= max_length:
+            break
+        if depth == 0:
+            cut = max(cut, line.rfind(" ", position, tag.start()), tag.start())
+        depth = max(0, depth + (-1 if tag.group(1) else 1))
+        position = tag.end()
+    if depth == 0:
+        cut = max(cut, line.rfind(" ", position, max_length))
+    # a line that is a single word or element is cut anyway
+    return cut if cut > 0 else max_length
+
+
+class ChatQueue:
+    """The messages waiting to be sent to a chat and when the chat may be sent to again."""
+
+    __slots__ = ("messages", "next_send_at", "task")
+
+    def __init__(self):
+        # (message, whether it may be merged with other messages, priority)
+        self.messages: deque[tuple[str, bool, Priority]] = deque()
+        self.next_send_at = 0.0
+        self.task: asyncio.Task = None
+
+
+class TelegramSender:
+    """Class to send Telegram messages from a queue per chat, so a burst of notifications does not run into flood limits.
+
+    Messages of the same priority queued within the coalescing window are merged into a single message of at most 4096 characters.
+    Each chat is sent at most one message per `min_interval_seconds`, and all chats together at most `messages_per_second`.
+    When Telegram still asks to wait (`FloodWaitError`), the chat waits exactly the requested time before sending again.
+    Connection errors are retried with backoff, after `max_attempts` the message is given up on.
+    """
+
+    def __init__(self, client, settings: dict = None):
+        """Initialization.
+
+        Args:
+            client (TelegramClient): the client to send the messages with.
+            settings (dict, optional): the `[telegram]` section of the configuration. Defaults to None.
+        """
+        settings = settings or {}
+        self.client = client
+        self.coalesce_window_seconds = settings.get("coalesce_window_seconds", 0.5)
+        self.min_interval_seconds = settings.get("min_interval_seconds", 1)
+        self.bucket = TokenBucket(settings.get("messages_per_second", 30), 1)
+        self.max_attempts = settings.get("max_attempts", 5)
+        self.chats: dict[str, ChatQueue] = dict()
+        self.count_sent = 0
+        self.count_merged = 0
+        self.count_flood_waits = 0
+        self.count_failed = 0
+
+    async def send(
+        self,
+        chat: str,
+        message: str,
+        coalesce=True,
+        priority: Priority = Priority.NORMAL,
+    ):
+        """Queue a message to a chat, returns right away.
+
+        Unless `coalesce` is disabled, it can be merged with the messages of the same priority queued around the same time, so a stock alert is never folded into a report.
+        """
+        queue = self.chats.setdefault(chat, ChatQueue())
+        for part in split_message(str(message)):
+            queue.messages.append((part, coalesce, priority))
+        if queue.task is None or queue.task.done():
+            queue.task = asyncio.create_task(self.run(chat, queue))
+
+    async def flush(self):
+        """Wait until the queued messages of all chats are sent."""
+        await asyncio.gather(
+            *(queue.task for queue in self.chats.values() if queue.task is not None),
+            return_exceptions=True,
+        )
+
+    def take(self, queue: ChatQueue) -> str:
+        """Take the next message, merged with the mergeable messages of the same priority after it as long as they fit."""
+        message, coalesce, priority = queue.messages.popleft()
+        while coalesce and len(queue.messages) > 0:
+            following, following_coalesce, following_priority = queue.messages[0]
+            merged_length = len(message) + len(MESSAGE_SEPARATOR) + len(following)
+            if (
+                not following_coalesce
+                or following_priority is not priority
+                or merged_length > MAX_MESSAGE_LENGTH
+            ):
+                break
+            queue.messages.popleft()
+            message += MESSAGE_SEPARATOR + following
+            self.count_merged += 1
+        return message
+
+    async def run(self, chat: str, queue: ChatQueue):
+        """Send the queued messages of a chat until there are none left."""
+        # let the messages of the same burst arrive first
+        await asyncio.sleep(self.coalesce_window_seconds)
+        while len(queue.messages) > 0:
+            await asyncio.sleep(max(0.0, queue.next_send_at - time.monotonic()))
+            await self.deliver(chat, queue, self.take(queue))
+
+    async def deliver(self, chat: str, queue: ChatQueue, message: str):
+        """Send a message, waiting out flood waits and retrying connection errors, other errors give up on the message."""
+        attempt = 0
+        while True:
+            wait_time = self.bucket.get_wait_time(time.monotonic())
+            while wait_time > 0:
+                await asyncio.sleep(wait_time)
+                wait_time = self.bucket.get_wait_time(time.monotonic())
+            self.bucket.take(time.monotonic())
+            try:
+                await self.client.send_message(chat, message)
+                self.count_sent += 1
+                queue.next_send_at = time.monotonic() + self.min_interval_seconds
+                return
+            except (errors.FloodWaitError, errors.SlowModeWaitError) as error:
+                # Telegram tells exactly how long to wait, this does not count as a failed attempt
+                self.count_flood_waits += 1
+                print(f"Telegram asked to wait {error.seconds} seconds before sending")
+                queue.next_send_at = time.monotonic() + error.seconds
+                await asyncio.sleep(error.seconds)
+            except (ConnectionError, OSError, asyncio.TimeoutError) as error:
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    self.count_failed += 1
+                    print(
+                        f"Giving up on sending a Telegram message after {attempt} attempts. Error: {error}"
+                    )
+                    return
+                backoff_time = full_jitter(attempt, 1, 60)
+                print(
+                    f"Connection error on sending Telegram message, waiting {round(backoff_time, 1)} seconds to try again. Error: {error}"
+                )
+                await asyncio.sleep(backoff_time)
+            except Exception as error:
+                # e.g. an unknown username or another error of Telegram, retrying will not help, but the next messages of the chat are still sent
+                self.count_failed += 1
+                print(f"Failed to send a Telegram message to {chat}: {error}")
+                return
+
+    def get_status(self) -> str:
+        """Generate a status message of the sender."""
+        queued = sum(len(queue.messages) for queue in self.chats.values())
+        return f"{self.count_sent} messages sent, {self.count_merged} merged into others, {queued} queued. Waited for flood limits {self.count_flood_waits} times, {self.count_failed} messages failed."
@@ -0,0 +1,92 @@
+import numpy as np
+
+from analytics import AvailabilityAnalytics, hours_of_week
+from availability import AvailabilityIndex, AvailabilityMatrix
+from availability_history import AvailabilityHistory
+from test.test_availability import create_store
+
+START = 1704067200 * 10**9
+MINUTE = 60 * 10**9
+
+
+def test_restocks_across_batches():
+    """Test whether the restock durations and gaps are the same when the polls arrive one by one or all at once."""
+    # a single store and part: available at minutes 1-2, 5 and 8-9
+    series = np.array([0, 1, 1, 0, 0, 1, 0, 0, 1, 1], dtype=bool)
+    timestamps = START + np.arange(len(series), dtype=np.int64) * MINUTE
+    grids = series.reshape(-1, 1, 1)
+
+    at_once = AvailabilityAnalytics()
+    at_once.add(timestamps, grids)
+    one_by_one = AvailabilityAnalytics()
+    for poll in range(len(series)):
+        one_by_one.add(timestamps[poll : poll + 1], grids[poll : poll + 1])
+
+    for analytics in (at_once, one_by_one):
+        assert analytics.count_polls == 10
+        assert analytics.available_per_store.tolist() == [5]
+        # two completed restocks of 2 and 1 minutes, the last one is still going on
+        assert analytics.duration_count.sum() == 2
+        assert analytics.get_mean_duration() == 1.5 * MINUTE
+        # restocks started at minutes 1, 5 and 8
+        assert analytics.gap_count.sum() == 2
+        assert analytics.get_mean_gap() == 3.5 * MINUTE
+        assert analytics.get_rate_by_hour()[hours_of_week(timestamps[:1])[0]] == 0.5
+
+
+def test_update_from_history(tmp_path):
+    """Test whether only the new polls of the history are added, including stores and parts that appear later."""
+    history = AvailabilityHistory(tmp_path / "availability.bin")
+    index = AvailabilityIndex()
+    first = AvailabilityMatrix.from_stores(
+        [create_store("R044", {"A": True, "B": False})], index
+    )
+    history.append(START, first)
+    history.append(START + MINUTE, first)
+    analytics = AvailabilityAnalytics()
+    analytics.update(history)
+    assert analytics.count_polls == 2
+
+    second = AvailabilityMatrix.from_stores(
+        [
+            create_store("R044", {"A": False, "B": False}),
+            create_store("R089", {"C": True}),
+        ],
+        index,
+    )
+    history.append(START + 2 * MINUTE, second)
+    analytics.update(history)
+    assert analytics.count_polls == 3
+    assert analytics.get_rate_by_store() == {"R044": 2 / 3, "R089": 1 / 3}
+    assert analytics.get_rate_by_part() == {"A": 2 / 3, "B": 0, "C": 1 / 3}
+    assert analytics.get_mean_duration(axis=0)[0] == 2 * MINUTE
+    summary = analytics.get_summary({"R044": "Fifth Avenue"}, {"A": "iPhone"})
+    assert "Fifth Avenue (R044): 66.7%" in summary
+    assert "iPhone (A): 66.7%, restocks last 2.0 minutes" in summary
+    history.close()
+
+
+def test_read_while_appending(tmp_path):
+    """Test whether reading the history file leaves a record that is still being appended alone."""
+    path = tmp_path / "availability.bin"
+    history = AvailabilityHistory(path)
+    index = AvailabilityIndex()
+    matrix = AvailabilityMatrix.from_stores([create_store("R044", {"A": True})], index)
+    history.append(START, matrix)
+    # half of the next record is written
+    with path.open("ab") as fp:
+        fp.write(b"\0" * (history.record_size // 2))
+    size = path.stat().st_size
+
+    analytics = AvailabilityAnalytics()
+    analytics.read(path)
+    assert analytics.count_polls == 1
+    assert path.stat().st_size == size
+
+    # the monitor finishes the record and appends another one
+    with path.open("r+b") as fp:
+        fp.truncate(size - history.record_size // 2)
+    history.append(START + MINUTE, matrix)
+    analytics.read(path)
+    assert analytics.count_polls == 2
+    history.close()
@@ -0,0 +1,44 @@
+import numpy as np
+
+from availability import AvailabilityIndex, AvailabilityMatrix
+from decoding import PartRecord, StoreRecord
+
+
+def create_store(store_number: str, availability: dict) -> StoreRecord:
+    """Create a store record with the given availability per part number."""
+    return StoreRecord(
+        store_number,
+        f"Store {store_number}",
+        "Palo Alto",
+        0,
+        {
+            part_number: PartRecord(part_number, f"iPhone {part_number}", available)
+            for part_number, available in availability.items()
+        },
+    )
+
+
+def test_matrix_and_diff():
+    """Test whether the matrix keeps stable indices and finds the changes between polls."""
+    index = AvailabilityIndex()
+    first = AvailabilityMatrix.from_stores(
+        [create_store("R044", {"A": False, "B": True})], index
+    )
+    assert first.shape == (1, 2)
+    assert first.any_available()
+
+    second = AvailabilityMatrix.from_stores(
+        [
+            create_store("R089", {"A": True}),
+            create_store("R044", {"A": True, "B": False}),
+        ],
+        index,
+    )
+    assert index.store_numbers == ["R044", "R089"]
+    assert second.count_per_store().tolist() == [1, 1]
+    assert second.count_per_part().tolist() == [2, 0]
+    assert not second.listed[1, 1]
+
+    became_available, became_unavailable = second.diff(first)
+    assert np.argwhere(became_available).tolist() == [[0, 0], [1, 0]]
+    assert np.argwhere(became_unavailable).tolist() == [[0, 1]]
@@ -0,0 +1,67 @@
+import numpy as np
+
+from availability import AvailabilityIndex, AvailabilityMatrix
+from availability_history import AvailabilityHistory
+from test.test_availability import create_store
+
+START = 1704067200 * 10**9
+
+
+def test_append_and_query(tmp_path):
+    """Test whether the availability of every poll is appended and can be queried per store and part after reopening."""
+    path = tmp_path / "availability.bin"
+    history = AvailabilityHistory(path)
+    index = AvailabilityIndex()
+    first = AvailabilityMatrix.from_stores(
+        [create_store("R044", {"A": True, "B": False})], index
+    )
+    history.append(START, first, version=1)
+    history.append(START + 1, first, version=1)
+    second = AvailabilityMatrix.from_stores(
+        [
+            create_store("R044", {"A": False, "B": False}),
+            create_store("R089", {"B": True}),
+        ],
+        index,
+    )
+    history.append(START + 2, second, version=2)
+    history.close()
+
+    # a record that was only partially written is dropped
+    with path.open("ab") as fp:
+        fp.write(b"\x01\x02\x03")
+    history = AvailabilityHistory(path)
+    assert len(history) == 3
+    assert history.get_timestamps().tolist() == [START, START + 1, START + 2]
+    assert isinstance(history.get_view(), np.memmap)
+    assert history.get_series("R044", "A").tolist() == [True, True, False]
+    assert history.get_series("R089", "B").tolist() == [False, False, True]
+    assert history.get_series("R999", "A") is None
+    assert history.unpack().shape == (3, 2, 2)
+
+    # a new index (e.g. after a restart) is mapped onto the dictionary of the file
+    index = AvailabilityIndex()
+    third = AvailabilityMatrix.from_stores([create_store("R089", {"A": True})], index)
+    history.append(START + 3, third)
+    assert history.get_series("R089", "A").tolist() == [False, False, False, True]
+    history.close()
+
+
+def test_grow(tmp_path):
+    """Test whether the file is rewritten with a larger capacity once there are more stores and parts than fit."""
+    history = AvailabilityHistory(
+        tmp_path / "availability.bin", store_capacity=2, part_capacity=1
+    )
+    index = AvailabilityIndex()
+    first = AvailabilityMatrix.from_stores([create_store("R001", {"A": True})], index)
+    history.append(START, first)
+    stores = [
+        create_store(f"R00{number}", {"A": False, "B": True}) for number in range(5)
+    ]
+    second = AvailabilityMatrix.from_stores(stores, index)
+    history.append(START + 1, second)
+    assert (history.store_capacity, history.part_capacity) == (8, 2)
+    assert history.get_series("R001", "A").tolist() == [True, False]
+    assert history.get_series("R004", "B").tolist() == [False, True]
+    assert history.unpack(1).sum() == 5
+    history.close()
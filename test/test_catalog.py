@@ -0,0 +1,38 @@
+import time
+
+from catalog import CatalogCache, DeviceMatcher, diff_devices
+
+PRODUCTS = [
+    {"title": "iPhone 16 Pro", "model": "MYM93LL/A", "carrier": "UNLOCKED/US"},
+    {"title": "iPhone 16 Pro", "model": "MYMD3LL/A", "carrier": "UNLOCKED/US"},
+    {"title": "iPhone 16 Pro", "model": "MYMD3LL/A", "carrier": "VERIZON/US"},
+    {"title": "iPhone 16 Pro", "model": "MYMH3LL/A", "carrier": "UNLOCKED/US"},
+]
+
+
+def test_device_matcher():
+    """Test whether the matcher partially matches models and exactly matches carriers."""
+    matcher = DeviceMatcher(["MYM93", "MYMD3LL/A"], ["UNLOCKED/US"])
+    assert [p["model"] for p in matcher.filter(PRODUCTS)] == ["MYM93LL/A", "MYMD3LL/A"]
+    assert len(DeviceMatcher([], []).filter(PRODUCTS)) == len(PRODUCTS)
+    assert matcher.matches("MYM93LL/A", "UNLOCKED/US") is True
+    assert matcher.matches(None, "UNLOCKED/US") is False
+
+
+def test_catalog_cache(tmp_path):
+    """Test whether catalogs are stored per country and family and expire after the TTL."""
+    cache = CatalogCache({"path": str(tmp_path), "catalog_ttl_seconds": 60})
+    assert cache.load("us", "iphone_16_pro") is None
+    cache.save("us", "iphone_16_pro", PRODUCTS)
+    products, fetched_at = cache.load("us", "iphone_16_pro")
+    assert products == PRODUCTS
+    assert cache.load("nl", "iphone_16_pro") is None
+    assert not cache.is_expired(fetched_at)
+    assert cache.is_expired(time.time() - 61)
+
+
+def test_diff_devices():
+    """Test whether added and removed devices are found."""
+    added, removed = diff_devices(PRODUCTS[:2], PRODUCTS[1:])
+    assert [d["model"] for d in added] == ["MYMH3LL/A"]
+    assert [d["model"] for d in removed] == ["MYM93LL/A"]
@@ -49,3 +49,12 @@ async def test_watch_changes_callback():
     assert ch.get(["search", "device_family"]) == "iphone_15_pro"
     # restore to original for next test
     ch_new.set(["search", "device_family"], "iphone_16_pro")
+
+
+def test_get_default():
+    """Test whether missing keys, e.g. of configs of earlier versions, get the default instead of raising."""
+    ch = ConfigHandler(CONFIGFILE_PATH)
+    assert ch.get(["general", "history_path"], "data.sqlite") == "data.sqlite"
+    assert ch.get(["scheduler", "max_requests_per_hour"], 0) == 0
+    assert ch.get(["general", "history_path"]) is None
+    assert ch.get(["general", "data_path"], "other.csv") == "data.csv"
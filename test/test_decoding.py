@@ -0,0 +1,49 @@
+import json
+
+from decoding import decode_availability
+
+
+def encode(stores) -> bytes:
+    return json.dumps({"body": {"stores": stores}}).encode()
+
+
+def test_decode_availability():
+    """Test whether parts are decoded and missing message types count as unavailable."""
+    content = encode(
+        [
+            {
+                "storeNumber": "R001",
+                "storeName": "Fifth Avenue",
+                "partsAvailability": {
+                    "MYM93LL/A": {
+                        "messageTypes": {
+                            "regular": {
+                                "storePickupProductTitle": "iPhone 16 Pro",
+                                "storeSelectionEnabled": True,
+                            }
+                        }
+                    },
+                    "MYMD3LL/A": {"messageTypes": None},
+                },
+            }
+        ]
+    )
+    [store] = decode_availability(content)
+    assert store.parts["MYM93LL/A"].available is True
+    assert store.parts["MYM93LL/A"].title == "iPhone 16 Pro"
+    assert store.parts["MYMD3LL/A"].available is False
+
+
+def test_decode_unexpected_payload():
+    """Test whether unexpected payloads are rejected instead of raising."""
+    assert decode_availability(b"not json") is None
+    assert decode_availability(b"[]") is None
+    assert decode_availability(json.dumps({"body": None}).encode()) is None
+    assert decode_availability(encode(42)) is None
+    assert decode_availability(encode(["store"])) is None
+    assert (
+        decode_availability(
+            encode([{"partsAvailability": {"MYM93LL/A": {"messageTypes": "regular"}}}])
+        )
+        is None
+    )
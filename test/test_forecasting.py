@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from availability import AvailabilityIndex, AvailabilityMatrix
+from availability_history import AvailabilityHistory
+from forecasting import RestockForecaster
+from test.test_availability import create_store
+
+START = 1704067200 * 10**9
+MINUTE = 60 * 10**9
+
+
+def test_hourly_restocks(tmp_path):
+    """Test whether a part that restocks every hour is forecast to restock soon, and a part that never restocks is not."""
+    # two weeks of a poll every minute, part A is available in the first 10 minutes of every hour and part B never
+    minutes = np.arange(14 * 24 * 60, dtype=np.int64)
+    timestamps = START + minutes * MINUTE
+    grids = np.zeros((len(minutes), 1, 2), dtype=bool)
+    grids[:, 0, 0] = minutes % 60 < 10
+    forecaster = RestockForecaster(tmp_path / "availability.bin")
+    forecaster.add(timestamps, grids)
+    forecaster.model = (["R044"], ["A", "B"], forecaster.get_rates(), grids[-1])
+
+    now = timestamps[-1] / 10**9
+    probabilities = forecaster.get_probabilities(30, now)
+    # one restock per 50 sold out minutes, slightly shrunk towards the rate of all parts
+    assert probabilities[0, 0] == pytest.approx(1 - np.exp(-30 / 50), rel=0.02)
+    assert probabilities[0, 1] < 0.01
+    expected = forecaster.get_expected_hours(now)
+    assert expected[0, 0] == pytest.approx(50 / 60, rel=0.02)
+    assert expected[0, 1] > 100
+    parts = forecaster.get_part_probabilities(30, now)
+    assert parts["A"] > parts["B"]
+    assert "A at R044" in forecaster.get_summary(now=now).split("\n")[1]
+
+
+@pytest.mark.asyncio
+async def test_retrain_from_history(tmp_path):
+    """Test whether the forecaster fits only the new polls of the history in the background."""
+    path = tmp_path / "availability.bin"
+    history = AvailabilityHistory(path)
+    index = AvailabilityIndex()
+    sold_out = AvailabilityMatrix.from_stores(
+        [create_store("R044", {"A": False})], index
+    )
+    for minute in range(3):
+        history.append(START + minute * MINUTE, sold_out)
+
+    forecaster = RestockForecaster(path, {"retrain_interval_seconds": 0})
+    assert forecaster.get_summary().startswith("The restock forecast is not trained")
+    forecaster.start_retraining()
+    await forecaster.retrain_task
+    assert forecaster.count_polls == 3 and forecaster.count_fits == 1
+
+    # a new store and part and a grown file are picked up
+    restocked = AvailabilityMatrix.from_stores(
+        [
+            create_store(f"R{number:03d}", {"A": True, "B": True})
+            for number in range(70)
+        ],
+        index,
+    )
+    history.append(START + 3 * MINUTE, restocked)
+    forecaster.start_retraining()
+    await forecaster.retrain_task
+    assert forecaster.count_polls == 4
+    # stores and parts that were not listed before count as sold out, like in the history file
+    assert forecaster.restocks.sum() == 140
+    store_numbers, part_numbers, rates, available = forecaster.model
+    assert len(store_numbers) == 70 and part_numbers == ["A", "B"]
+    assert available.all()
+    history.close()
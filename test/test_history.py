@@ -0,0 +1,127 @@
+import sqlite3
+
+import pandas as pd
+
+from history import COLUMNS, HistoryStore, HistoryBuffer
+from utils import format_timestamp
+
+# 01-01-2024 00:00:00 UTC in nanoseconds since the epoch
+START = 1704067200 * 10**9
+
+
+def create_records(start: int, stop: int) -> list[dict]:
+    return [
+        {
+            "availability": index % 2 == 0,
+            "timestamp": START + index * 60 * 10**9,
+            "processing_time": index / 10,
+        }
+        for index in range(start, stop)
+    ]
+
+
+def format_records(records: list[dict]) -> list[dict]:
+    """Format the records the way earlier versions stored them."""
+    return [
+        {
+            "availability": record["availability"],
+            "datetimestamp": format_timestamp(record["timestamp"]),
+            "processing_time": record["processing_time"],
+        }
+        for record in records
+    ]
+
+
+def test_append_only(tmp_path):
+    """Test whether polls are appended in separate transactions and survive reopening."""
+    history = HistoryStore(tmp_path / "data.sqlite")
+    assert history.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    history.append(create_records(0, 3))
+    history.append(create_records(3, 5))
+    history.append([])
+    history.close()
+
+    history = HistoryStore(tmp_path / "data.sqlite")
+    assert history.count() == 5
+    assert history.load() == create_records(0, 5)
+    history.close()
+
+
+def test_migrate_and_export_csv(tmp_path):
+    """Test whether a CSV file of earlier versions is imported once and the history can be exported."""
+    csv_path = tmp_path / "data.csv"
+    pd.DataFrame(format_records(create_records(0, 4))).to_csv(csv_path)
+    history = HistoryStore(tmp_path / "data.sqlite")
+    assert history.migrate_csv(csv_path) == 4
+    assert history.migrate_csv(csv_path) == 0
+    assert history.migrate_csv(tmp_path / "missing.csv") == 0
+    history.append(create_records(4, 6))
+
+    export_path = history.export_csv(tmp_path / "export.csv")
+    exported = pd.read_csv(export_path, index_col=[0])
+    assert exported[list(COLUMNS)].to_dict("records") == create_records(0, 6)
+    assert exported["datetimestamp"].tolist() == [
+        record["datetimestamp"] for record in format_records(create_records(0, 6))
+    ]
+    history.close()
+
+    # an exported file can be imported again
+    history = HistoryStore(tmp_path / "reimported.sqlite")
+    assert history.migrate_csv(export_path) == 6
+    assert history.load() == create_records(0, 6)
+    history.close()
+
+
+def test_migrate_datetimestamps(tmp_path):
+    """Test whether a history with formatted dates and times is converted to epoch timestamps once."""
+    path = tmp_path / "data.sqlite"
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE polls (id INTEGER PRIMARY KEY, availability INTEGER NOT NULL, datetimestamp TEXT NOT NULL, processing_time REAL NOT NULL)"
+    )
+    connection.executemany(
+        "INSERT INTO polls (availability, datetimestamp, processing_time) VALUES (?, ?, ?)",
+        [tuple(record.values()) for record in format_records(create_records(0, 3))],
+    )
+    connection.commit()
+    connection.close()
+
+    history = HistoryStore(path)
+    assert history.load() == create_records(0, 3)
+    history.close()
+    history = HistoryStore(path)
+    assert history.count() == 3
+    history.close()
+
+
+def test_buffer_grows_and_spills(tmp_path):
+    """Test whether the buffer grows in chunks, keeps the most recent polls and spills unsaved polls before dropping them."""
+    history = HistoryStore(tmp_path / "data.sqlite")
+    buffer = HistoryBuffer(max_size=8, chunk_size=4, spill=history.append)
+    records = create_records(0, 11)
+    for record in records[:2]:
+        buffer.append(**record)
+    assert buffer.get_capacity() == 4
+    history.append(buffer.get_unsaved_records())
+    buffer.mark_saved()
+    for record in records[2:]:
+        buffer.append(**record)
+
+    # the oldest chunk was dropped, the unsaved polls in it were spilled first
+    assert len(buffer) == 7
+    assert buffer.column("timestamp").tolist() == [
+        record["timestamp"] for record in records[4:]
+    ]
+    assert history.count() == 4
+    history.append(buffer.get_unsaved_records())
+    buffer.mark_saved()
+    assert history.load() == records
+
+    # views share the memory of the buffer
+    assert buffer.column("processing_time").base is buffer.columns["processing_time"]
+
+    reloaded = HistoryBuffer(max_size=8, chunk_size=4)
+    reloaded.load(history.load_columns(limit=reloaded.max_size))
+    assert reloaded.get_records(0, len(reloaded)) == records[3:]
+    assert reloaded.get_unsaved_records() == []
+    history.close()
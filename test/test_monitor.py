@@ -0,0 +1,19 @@
+import asyncio
+import shutil
+from pathlib import Path
+
+from monitor import Monitor
+from test.test_store_checker import DummyCallbacks
+
+CONFIGFILE_PATH = "./test/config.toml"
+
+
+def test_config_of_earlier_version(tmp_path, monkeypatch):
+    """Test whether a monitor starts from a config without the keys added in later versions, using their defaults."""
+    shutil.copy(CONFIGFILE_PATH, tmp_path / "config.toml")
+    monkeypatch.chdir(tmp_path)
+    monitor = Monitor(DummyCallbacks(), "config.toml")
+    assert Path("data.sqlite").exists()
+    assert monitor.data.max_size == 100000
+    assert monitor.store_checker.availability_history.path == Path("availability.bin")
+    asyncio.get_event_loop().run_until_complete(monitor.store_checker.close())
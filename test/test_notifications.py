@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from interface import CallbacksAbstract
+from notifications import NotificationDispatcher
+
+
+class RecordingCallbacks(CallbacksAbstract):
+    """Callbacks recording the calls, the first call waits until the gate opens."""
+
+    def __init__(self):
+        self.calls = list()
+        self.gate = asyncio.Event()
+
+    async def record(self, name, *args):
+        await self.gate.wait()
+        self.calls.append((name, *args))
+
+    async def on_start(self):
+        await self.record("on_start")
+
+    async def on_stop(self):
+        await self.record("on_stop")
+
+    async def on_transitions(self, transitions):
+        await self.record("on_transitions", transitions)
+
+    async def on_appointment_available(self, message):
+        await self.record("on_appointment_available", message)
+
+    async def on_newly_available(self):
+        await self.record("on_newly_available")
+
+    async def on_auto_report(self, report):
+        await self.record("on_auto_report", report)
+
+    async def on_proxy_depletion(self, message):
+        await self.record("on_proxy_depletion", message)
+
+    async def on_long_processing_warning(self, warning):
+        await self.record("on_long_processing_warning", warning)
+
+    async def on_connection_error(self, error):
+        await self.record("on_connection_error", error)
+
+    async def on_error(self, error, logfile_path):
+        raise RuntimeError("client is down")
+
+
+@pytest.mark.asyncio
+async def test_priorities_and_policies():
+    """Test whether stock alerts are delivered first, reports are coalesced and dropped when full, and stopping delivers everything."""
+    callbacks = RecordingCallbacks()
+    dispatcher = NotificationDispatcher(callbacks, {"workers": 1, "max_queue_size": 1})
+    await dispatcher.on_start()
+    # let the worker take the start notification, it waits at the gate
+    await asyncio.sleep(0)
+    await dispatcher.on_auto_report("report 1")
+    await dispatcher.on_auto_report("report 2")
+    # the lane of reports and warnings is full, the oldest is dropped
+    await dispatcher.on_long_processing_warning("slow")
+    await dispatcher.on_long_processing_warning("slower")
+    await dispatcher.on_connection_error("error 1")
+    await dispatcher.on_transitions(["R044"])
+    assert dispatcher.get_depth() == 3
+
+    callbacks.gate.set()
+    await dispatcher.on_error("crash", None)
+    await dispatcher.on_stop()
+    assert callbacks.calls == [
+        ("on_start",),
+        ("on_transitions", ["R044"]),
+        ("on_connection_error", "error 1"),
+        ("on_long_processing_warning", "slower"),
+        ("on_stop",),
+    ]
+    assert dispatcher.count_coalesced == 2
+    assert dispatcher.count_dropped == 1
+    assert dispatcher.count_failed == 1
+    assert dispatcher.workers == []
+    assert "5 notifications delivered" in dispatcher.get_status()
+
+
+@pytest.mark.asyncio
+async def test_full_high_priority_lane_waits():
+    """Test whether stock alerts are never dropped, the caller waits for room instead."""
+    callbacks = RecordingCallbacks()
+    dispatcher = NotificationDispatcher(callbacks, {"workers": 1, "max_queue_size": 1})
+    await dispatcher.on_transitions([1])
+    await asyncio.sleep(0)
+    await dispatcher.on_transitions([2])
+    waiting = asyncio.create_task(dispatcher.on_transitions([3]))
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+    callbacks.gate.set()
+    await waiting
+    await dispatcher.close()
+    assert [call[1] for call in callbacks.calls] == [[1], [2], [3]]
+    assert dispatcher.count_dropped == 0
+
+
+@pytest.mark.asyncio
+async def test_stock_alerts_stay_ordered():
+    """Test whether stock alerts are delivered one at a time with several workers, while other notifications go ahead."""
+    callbacks = RecordingCallbacks()
+    dispatcher = NotificationDispatcher(callbacks, {"workers": 2})
+    assert NotificationDispatcher(callbacks).num_workers == 1
+    await dispatcher.on_transitions(["became unavailable"])
+    await dispatcher.on_transitions(["became available"])
+    await dispatcher.on_auto_report("report")
+    await asyncio.sleep(0.01)
+    # the second worker delivers the report instead of the second stock alert
+    assert dispatcher.in_flight == 2 and dispatcher.get_depth() == 1
+    callbacks.gate.set()
+    await dispatcher.close()
+    assert [call[1] for call in callbacks.calls if call[0] == "on_transitions"] == [
+        ["became unavailable"],
+        ["became available"],
+    ]
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from plotting import PlotRenderer, lttb
+
+
+def test_lttb():
+    """Test whether downsampling keeps the endpoints and the extremes of the series."""
+    x = np.arange(10000)
+    y = np.sin(x / 500)
+    y[4321] = 10
+    indices = lttb(x, y, 100)
+    assert len(indices) == 100
+    assert indices[0] == 0 and indices[-1] == len(x) - 1
+    assert np.all(np.diff(indices) > 0)
+    assert 4321 in indices
+    # short series are not downsampled
+    assert np.array_equal(lttb(x[:50], y[:50], 100), np.arange(50))
+
+
+@pytest.mark.asyncio
+async def test_plot_cache(tmp_path):
+    """Test whether a plot is only rendered again when the data version or a rendering option changes."""
+    # a poll every minute, in nanoseconds since the epoch
+    timestamps = 1704067200 * 10**9 + np.arange(5000, dtype=np.int64) * 60 * 10**9
+    values = np.random.default_rng(0).random(5000)
+    calls = list()
+
+    def get_series():
+        calls.append(1)
+        return timestamps, values
+
+    renderer = PlotRenderer(tmp_path)
+    try:
+        first = await renderer.plot("processing_time", 1, get_series, "Seconds")
+        second = await renderer.plot("processing_time", 1, get_series, "Seconds")
+        assert first == second
+        assert len(calls) == 1 and renderer.count_cache_hits == 1
+        last_hours = await renderer.plot(
+            "processing_time", 1, get_series, "Seconds", time_range=24
+        )
+        assert last_hours != first
+        # every rendering option is part of the cache key
+        limited = await renderer.plot(
+            "processing_time", 1, get_series, "Seconds", ylimmax=0.5
+        )
+        assert limited not in (first, last_hours)
+        assert (
+            await renderer.plot(
+                "processing_time", 1, get_series, "Seconds", ylimmax=0.5
+            )
+            == limited
+        )
+        newer = await renderer.plot(
+            "processing_time", 2, get_series, "Seconds", moving_average_window=10
+        )
+        assert len(calls) == 4
+        assert (tmp_path / newer.split("/")[-1]).exists()
+        # plots of the older version are removed
+        assert not (tmp_path / first.split("/")[-1]).exists()
+    finally:
+        renderer.close()
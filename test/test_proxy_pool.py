@@ -0,0 +1,67 @@
+import time
+from collections import Counter
+
+from http_request_randomizer.requests.proxy.ProxyObject import ProxyObject
+from http_request_randomizer.requests.proxy.ProxyPool import ProxyPool
+
+
+def create_proxies(count: int) -> list[ProxyObject]:
+    return [ProxyObject("test", f"10.0.0.{i}", 8080, None) for i in range(count)]
+
+
+def test_prefers_fast_proxies():
+    """Test whether fast and reliable proxies are chosen more often than slow or failing ones."""
+    proxies = create_proxies(4)
+    pool = ProxyPool(proxies, max_failures=100, quarantine_seconds=0)
+    pool.record_success(proxies[0], 0.1)
+    pool.record_failure(proxies[3])
+    counts = Counter(pool.select().get_address() for _ in range(2000))
+    assert counts[proxies[0].get_address()] > counts[proxies[1].get_address()]
+    assert counts[proxies[3].get_address()] < counts[proxies[1].get_address()]
+
+
+def test_quarantine_and_removal():
+    """Test whether failed proxies are quarantined, return after the quarantine and are removed after repeated failures."""
+    proxies = create_proxies(3)
+    pool = ProxyPool(proxies, quarantine_seconds=0.05, max_failures=2)
+    pool.record_failure(proxies[0])
+    assert len(pool) == 2
+    assert proxies[0] not in pool.get_proxies()
+    assert all(pool.select() is not proxies[0] for _ in range(50))
+    time.sleep(0.06)
+    pool.select()
+    assert len(pool) == 3
+    pool.record_failure(proxies[0])
+    assert len(pool) == 2 and pool.count_removed == 1
+    time.sleep(0.06)
+    pool.select()
+    assert proxies[0] not in pool.get_proxies()
+    # the positions stay consistent after swapping proxies out
+    for stats in pool.active:
+        assert pool.active[stats.position] is stats
+    assert "2 proxies active" in pool.get_status()
+
+
+def test_concurrency_cap():
+    """Test whether a proxy is not acquired more often than the cap until it is released."""
+    proxies = create_proxies(2)
+    pool = ProxyPool(proxies, max_in_use=2)
+    acquired = [pool.select(acquire=True) for _ in range(4)]
+    assert Counter(acquired) == {proxies[0]: 2, proxies[1]: 2}
+    assert pool.select(acquire=True) is None
+    pool.release(proxies[1])
+    assert pool.select(acquire=True) is proxies[1]
+
+
+def test_quarantine_expires_without_selection():
+    """Test whether quarantined proxies count again once their quarantine is over, and a quarantined pool is not empty."""
+    proxies = create_proxies(2)
+    pool = ProxyPool(proxies, quarantine_seconds=0.05)
+    for proxy in proxies:
+        pool.record_failure(proxy)
+    assert len(pool) == 0 and not pool.is_empty()
+    time.sleep(0.06)
+    assert len(pool) == 2
+    for proxy in proxies:
+        pool.remove(proxy)
+    assert pool.is_empty()
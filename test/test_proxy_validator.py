@@ -0,0 +1,64 @@
+import asyncio
+import socket
+
+import pytest
+
+from http_request_randomizer.requests.proxy.ProxyObject import ProxyObject
+from http_request_randomizer.requests.proxy.ProxyValidator import ProxyValidator
+
+# plain HTTP, so the request goes to the proxy itself instead of being tunneled
+CHECK_URL = "http://check.test/robots.txt"
+
+
+def create_proxy(port: int) -> ProxyObject:
+    return ProxyObject("test", "127.0.0.1", port, None)
+
+
+def get_free_port() -> int:
+    """Get a port nothing listens on, so connecting to it is refused."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def answer(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Local stand-in for a working proxy, answering every request right away."""
+    await reader.readuntil(b"\r\n\r\n")
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+    await writer.drain()
+    writer.close()
+
+
+async def hang(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Local stand-in for a proxy that accepts connections but never answers."""
+    await asyncio.sleep(10)
+    writer.close()
+
+
+@pytest.mark.asyncio
+async def test_only_responsive_proxies_pass():
+    """Test whether only the proxy that answers within the timeout passes, with its latency."""
+    working = await asyncio.start_server(answer, "127.0.0.1", 0)
+    hanging = await asyncio.start_server(hang, "127.0.0.1", 0)
+    working_proxy = create_proxy(working.sockets[0].getsockname()[1])
+    proxies = [
+        create_proxy(get_free_port()),
+        working_proxy,
+        create_proxy(hanging.sockets[0].getsockname()[1]),
+    ]
+    validator = ProxyValidator(CHECK_URL, timeout=0.2)
+    async with working, hanging:
+        passed = await validator.validate(proxies)
+    assert [proxy for proxy, _ in passed] == [working_proxy]
+    assert 0 < passed[0][1] < 0.2
+    assert validator.count_checked == 3 and validator.count_passed == 1
+    assert "Validated 3 proxies" in validator.get_status()
+    assert "1 passed (33.3%)" in validator.get_status()
+
+
+@pytest.mark.asyncio
+async def test_run_within_event_loop():
+    """Test whether the synchronous entry point also works while an event loop is running."""
+    validator = ProxyValidator(CHECK_URL, timeout=0.2)
+    assert validator.run([create_proxy(get_free_port())]) == []
+    assert validator.count_checked == 1
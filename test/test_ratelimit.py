@@ -0,0 +1,93 @@
+import time
+import asyncio
+
+from ratelimit import RateLimiter, TokenBucket
+
+
+def test_token_bucket_burst_and_refill():
+    """Test whether a bucket allows a burst and then refills at its rate."""
+    bucket = TokenBucket(rate=2, burst=3)
+    now = bucket.updated_at
+    for _ in range(3):
+        assert bucket.get_wait_time(now) == 0
+        bucket.take(now)
+    assert abs(bucket.get_wait_time(now) - 0.5) < 1e-9
+    assert bucket.get_wait_time(now + 0.5) == 0
+
+
+def test_requests_are_paced_in_arrival_order():
+    """Test whether requests beyond the burst wait for the budget, first come first served, per host."""
+    limiter = RateLimiter(
+        {
+            "requests_per_second": 50,
+            "burst": 2,
+            "per_host_requests_per_second": 20,
+            "per_host_burst": 1,
+        }
+    )
+    order = list()
+
+    async def request(number: int, host: str):
+        await limiter.acquire(host)
+        order.append(number)
+
+    async def run():
+        start_time = time.perf_counter()
+        await asyncio.gather(*(request(number, "a") for number in range(4)))
+        return time.perf_counter() - start_time
+
+    duration = asyncio.run(run())
+    assert order == [0, 1, 2, 3]
+    # one request in the burst of the host, the other three at 20 per second
+    assert duration >= 0.14
+    assert limiter.count_requests == 4
+    assert limiter.count_waits == 3
+    # another host has its own budget
+    assert limiter.get_wait_time("b") == 0
+    assert limiter.get_wait_time("a") > 0
+    assert "requests waited for the rate limit" in limiter.get_status()
+
+
+def test_disabled_and_per_proxy():
+    """Test whether a disabled limiter never waits, and a proxy budget only applies to that proxy."""
+    limiter = RateLimiter()
+    assert asyncio.run(limiter.acquire("a")) == 0
+    assert limiter.get_status().startswith("There is no global request budget.")
+
+    limiter = RateLimiter({"per_proxy_requests_per_second": 1, "per_proxy_burst": 1})
+    asyncio.run(limiter.acquire("a", "1.2.3.4:80"))
+    assert limiter.get_wait_time("a", "1.2.3.4:80") > 0
+    assert limiter.get_wait_time("a", "5.6.7.8:80") == 0
+    assert limiter.get_wait_time("a") == 0
+
+
+def test_slow_bucket_does_not_block_others():
+    """Test whether a request waiting for a slow proxy does not hold up requests via other proxies."""
+    limiter = RateLimiter(
+        {
+            "requests_per_second": 100,
+            "per_proxy_requests_per_second": 0.2,
+            "per_proxy_burst": 1,
+        }
+    )
+    finished = list()
+
+    async def request(proxy: str):
+        await limiter.acquire("a", proxy)
+        finished.append(proxy)
+
+    async def run():
+        await limiter.acquire("a", "slow:80")
+        slow = asyncio.create_task(request("slow:80"))
+        await asyncio.sleep(0)
+        start_time = time.perf_counter()
+        await asyncio.gather(*(request(f"fast{i}:80") for i in range(3)))
+        duration = time.perf_counter() - start_time
+        assert limiter.queued == 1
+        slow.cancel()
+        await asyncio.gather(slow, return_exceptions=True)
+        return duration
+
+    assert asyncio.run(run()) < 0.5
+    assert finished == ["fast0:80", "fast1:80", "fast2:80"]
+    assert limiter.queued == 0
@@ -0,0 +1,109 @@
+import asyncio
+
+import httpx
+import pytest
+from requests.exceptions import ConnectionError
+
+from retry import (
+    CircuitBreaker,
+    CircuitOpenError,
+    CircuitState,
+    FailureKind,
+    RetryPolicy,
+    classify_error,
+    classify_response,
+)
+
+
+class FakeResponse:
+    """Minimal stand-in for a HTTP response."""
+
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def create_request(outcomes: list):
+    """Create a request function returning or raising the outcomes in order."""
+    calls = list()
+
+    async def request():
+        outcome = outcomes[min(len(calls), len(outcomes) - 1)]
+        calls.append(outcome)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    return request, calls
+
+
+def test_classification_and_jitter():
+    """Test whether responses and errors are classified and delays stay within the exponential cap."""
+    assert classify_response(FakeResponse(429)) is FailureKind.RATE_LIMITED
+    assert classify_response(FakeResponse(403)) is FailureKind.FORBIDDEN
+    assert classify_response(FakeResponse(503)) is FailureKind.UNAVAILABLE
+    assert classify_response(FakeResponse(200)) is None
+    assert classify_response(FakeResponse(400)) is None
+    timeout = ConnectionError("timed out")
+    timeout.__cause__ = httpx.ReadTimeout("timed out")
+    assert classify_error(timeout) is FailureKind.TIMEOUT
+    assert classify_error(ConnectionError("reset")) is FailureKind.RESET
+    assert classify_error(ValueError()) is None
+
+    policy = RetryPolicy({"base_delay_seconds": 1, "max_delay_seconds": 5})
+    assert all(0 <= policy.get_delay(0) <= 1 for _ in range(100))
+    assert all(0 <= policy.get_delay(10) <= 5 for _ in range(100))
+    assert policy.get_delay(0, FakeResponse(429, {"Retry-After": "3"})) >= 3
+    # the backoff between polls never drops below the polling interval
+    policy = RetryPolicy({"max_backoff_seconds": 100})
+    assert all(10 <= policy.get_backoff(0, 10) <= 10 for _ in range(100))
+    assert all(10 <= policy.get_backoff(2, 10) <= 40 for _ in range(100))
+    assert all(10 <= policy.get_backoff(10, 10) <= 100 for _ in range(100))
+
+
+@pytest.mark.asyncio
+async def test_retries_until_success():
+    """Test whether retryable failures are retried and other responses are returned right away."""
+    policy = RetryPolicy({"max_attempts": 3, "base_delay_seconds": 0.001})
+    request, calls = create_request(
+        [FakeResponse(503), ConnectionError("reset"), FakeResponse(200)]
+    )
+    response = await policy.execute("www.apple.com", request)
+    assert response.status_code == 200
+    assert len(calls) == 3
+    assert policy.count_retries == 2
+
+    request, calls = create_request([FakeResponse(404)])
+    assert (await policy.execute("www.apple.com", request)).status_code == 404
+    assert len(calls) == 1
+
+    request, calls = create_request([ConnectionError("reset")])
+    with pytest.raises(ConnectionError):
+        await policy.execute("www.apple.com", request)
+    assert len(calls) == 3
+    assert "requests were retried" in policy.get_status()
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_half_open_probe():
+    """Test whether the circuit opens after repeated failures and a single probe closes it again."""
+    circuit_breaker = CircuitBreaker(failure_threshold=2, recovery_seconds=0.05)
+    for _ in range(2):
+        await circuit_breaker.acquire()
+        circuit_breaker.record_failure()
+    assert circuit_breaker.get_state() is CircuitState.OPEN
+    with pytest.raises(CircuitOpenError) as error:
+        await circuit_breaker.acquire()
+    assert 0 < error.value.retry_after <= 0.05
+
+    await asyncio.sleep(0.06)
+    assert circuit_breaker.get_state() is CircuitState.HALF_OPEN
+    await circuit_breaker.acquire()
+    # requests arriving while the probe is in flight wait for its outcome
+    waiting = asyncio.create_task(circuit_breaker.acquire())
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+    circuit_breaker.record_success()
+    await waiting
+    assert circuit_breaker.get_state() is CircuitState.CLOSED
+    assert circuit_breaker.count_opened == 1
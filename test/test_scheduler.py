@@ -0,0 +1,75 @@
+from datetime import datetime
+
+from scheduler import PollingScheduler, RequestBudget, hour_of_week
+
+SETTINGS = {
+    "enabled": True,
+    "min_interval_seconds": 60,
+    "max_interval_seconds": 600,
+}
+# a Monday at 10:00 and 03:00 local time
+RESTOCK_HOUR = datetime(2024, 1, 1, 10).timestamp()
+DEAD_HOUR = datetime(2024, 1, 1, 3).timestamp()
+TARGET = ("location=94061", "MYM93LL/A")
+
+
+def test_intervals_follow_restock_history():
+    """Test whether targets are polled more often in hours in which they restocked before."""
+    scheduler = PollingScheduler(SETTINGS)
+    assert scheduler.is_due(TARGET, RESTOCK_HOUR)
+    for week in range(4):
+        offset = week * 7 * 24 * 3600
+        scheduler.record({TARGET: False}, RESTOCK_HOUR + offset - 3600)
+        scheduler.record({TARGET: True}, RESTOCK_HOUR + offset)
+        scheduler.record({TARGET: False}, DEAD_HOUR + offset)
+    assert hour_of_week(RESTOCK_HOUR) == 10
+    restock_interval = scheduler.get_intervals(RESTOCK_HOUR)[0]
+    dead_interval = scheduler.get_intervals(DEAD_HOUR)[0]
+    assert restock_interval == 60
+    assert 60 < dead_interval <= 600
+    assert not scheduler.is_due(TARGET, DEAD_HOUR + 3 * 7 * 24 * 3600 + 30)
+
+
+def test_request_budget(tmp_path):
+    """Test whether intervals are stretched to stay within the budget, and statistics survive a restart."""
+    settings = dict(
+        SETTINGS, max_requests_per_hour=30, path=str(tmp_path / "scheduler.npz")
+    )
+    scheduler = PollingScheduler(settings)
+    scheduler.record({(f"store=R00{i}", "MYM93LL/A"): False for i in range(5)})
+    intervals = scheduler.get_intervals()
+    assert round((3600 / intervals).sum()) == 30
+    scheduler.save()
+    assert len(PollingScheduler(settings).targets) == 5
+    assert PollingScheduler({}).seconds_until_due() is None
+
+
+def test_shared_request_budget():
+    """Test whether the budget holds over the schedulers of all searches, without exceeding the maximum interval."""
+    budget = RequestBudget(90)
+    first = PollingScheduler(SETTINGS, budget)
+    second = PollingScheduler(SETTINGS, budget)
+    first.record({(f"store=R00{i}", "MYM93LL/A"): False for i in range(5)}, DEAD_HOUR)
+    second.record({("store=R044", "MYM93LL/A"): True}, DEAD_HOUR)
+    intervals = [scheduler.get_intervals(DEAD_HOUR) for scheduler in (first, second)]
+    assert round(sum((3600 / i).sum() for i in intervals)) == 90
+    assert all((i <= 600).all() for i in intervals)
+    assert intervals[1][0] < intervals[0][0]
+
+    # a budget too small for all targets at their maximum interval caps them all
+    budget.max_requests_per_hour = 10
+    assert (first.get_intervals(DEAD_HOUR) == 600).all()
+
+
+def test_failed_targets_back_off():
+    """Test whether a failing target is not due right away, and backs off further while it keeps failing."""
+    scheduler = PollingScheduler(SETTINGS)
+    scheduler.record_failures([TARGET], DEAD_HOUR)
+    assert scheduler.seconds_until_due(DEAD_HOUR) == 60
+    scheduler.record_failures([TARGET], DEAD_HOUR)
+    assert scheduler.seconds_until_due(DEAD_HOUR) == 120
+    for _ in range(10):
+        scheduler.record_failures([TARGET], DEAD_HOUR)
+    assert scheduler.seconds_until_due(DEAD_HOUR) == 600
+    scheduler.record({TARGET: True}, DEAD_HOUR)
+    assert scheduler.failures[0] == 0
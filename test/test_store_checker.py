@@ -0,0 +1,391 @@
+import json
+import time
+import asyncio
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+
+from confighandler import ConfigHandler
+from interface import CallbacksAbstract
+from retry import RetryPolicy
+from transport import ProxiesBusyError
+import store_checker as store_checker_module
+from store_checker import StoreChecker
+from transitions import TransitionType
+
+CONFIGFILE_PATH = "./test/config.toml"
+
+
+class DummyCallbacks(CallbacksAbstract):
+    """Callbacks that record the messages instead of sending them."""
+
+    def __init__(self) -> None:
+        self.messages = list()
+        self.transitions = list()
+
+    async def on_start(self):
+        pass
+
+    async def on_stop(self):
+        pass
+
+    async def on_transitions(self, transitions: list):
+        self.transitions.append(transitions)
+
+    async def on_appointment_available(self, message):
+        self.messages.append(message)
+
+    async def on_newly_available(self):
+        pass
+
+    async def on_auto_report(self, report: str):
+        pass
+
+    async def on_proxy_depletion(self, message: str):
+        pass
+
+    async def on_long_processing_warning(self, warning: str):
+        pass
+
+    async def on_connection_error(self, error: str):
+        pass
+
+    async def on_error(self, error: str, logfile_path):
+        pass
+
+
+class FakeResponse:
+    """Minimal stand-in for a HTTP response."""
+
+    def __init__(self, payload, status_code=200, headers=None):
+        self.content = json.dumps(payload).encode()
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeTransport:
+    """Transport that answers pickup-message requests from a table of (store, part) availabilities."""
+
+    def __init__(self, available: dict, delay=0.0, max_parts=None):
+        self.available = available
+        self.delay = delay
+        self.max_parts = max_parts
+        self.failing_parts = set()
+        self.unavailable = False
+        self.appointments = list()
+        self.urls = list()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get(self, url, req_proxy=None, headers=None):
+        if req_proxy is not None:
+            # every proxy is busy
+            raise ProxiesBusyError()
+        self.urls.append(url)
+        if url.endswith("availability.json"):
+            return FakeResponse(self.appointments)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        if self.unavailable:
+            return FakeResponse(None, status_code=503)
+        query = parse_qs(urlsplit(url).query)
+        parts = [
+            values[0]
+            for key, values in sorted(query.items())
+            if key.startswith("parts.")
+        ]
+        if self.max_parts is not None and len(parts) > self.max_parts:
+            return FakeResponse(None, status_code=400)
+        if any(part in self.failing_parts for part in parts):
+            return FakeResponse(None, status_code=400)
+        stores = list()
+        for index, store_number in enumerate(["R044", "R089", "R999"]):
+            stores.append(
+                {
+                    "storeNumber": store_number,
+                    "storeName": f"Store {store_number}",
+                    "city": "Palo Alto",
+                    "storeListNumber": index,
+                    "partsAvailability": {
+                        part: {
+                            "partNumber": part,
+                            "messageTypes": {
+                                "regular": {
+                                    "storeSelectionEnabled": self.available.get(
+                                        (store_number, part), False
+                                    ),
+                                    "storePickupProductTitle": f"iPhone {part}",
+                                }
+                            },
+                        }
+                        for part in parts
+                    },
+                }
+            )
+        return FakeResponse({"body": {"stores": stores}})
+
+    async def aclose(self):
+        pass
+
+
+def create_store_checker(transport: FakeTransport, http_settings=None):
+    """Create a store checker with the test configuration and a fake transport."""
+    ch = ConfigHandler(CONFIGFILE_PATH)
+    store_checker = StoreChecker(
+        DummyCallbacks(), ch.searchconfig, http_settings=http_settings
+    )
+    store_checker.transport = transport
+    store_checker.device_list = [
+        {"model": model, "link": f"https://www.apple.com/{model}"}
+        for model in ["MYM93LL/A", "MYMD3LL/A", "MYMH3LL/A"]
+    ]
+    return store_checker
+
+
+@pytest.mark.asyncio
+async def test_concurrent_fan_out_matches_sequential():
+    """Test whether the concurrent fan-out merges the stores in the same way as the sequential checks."""
+    available = {("R044", "MYMD3LL/A"): True}
+    sequential = create_store_checker(
+        FakeTransport(available), {"concurrent_requests": False, "parts_per_request": 1}
+    )
+    concurrent = create_store_checker(
+        FakeTransport(available, delay=0.01),
+        {"max_concurrent_requests": 2, "parts_per_request": 1},
+    )
+    sequential_result = await sequential.refresh(verbose=False)
+    concurrent_result = await concurrent.refresh(verbose=False)
+    assert sequential_result[0] is True and concurrent_result[0] is True
+    assert sequential.get_message() == concurrent.get_message()
+    assert list(concurrent.stores_list_with_stock.keys()) == ["R044", "R089"]
+    assert 1 < concurrent.transport.max_in_flight <= 2
+
+
+@pytest.mark.asyncio
+async def test_batched_parts():
+    """Test whether multiple models are requested at once and split per model."""
+    available = {("R089", "MYMH3LL/A"): True}
+    single = create_store_checker(FakeTransport(available), {"parts_per_request": 1})
+    batched = create_store_checker(FakeTransport(available), {"parts_per_request": 8})
+    await single.refresh(verbose=False)
+    await batched.refresh(verbose=False)
+    assert len(single.transport.urls) == 3
+    assert len(batched.transport.urls) == 1
+    assert "parts.2=MYMH3LL/A" in batched.transport.urls[0]
+    assert single.get_message() == batched.get_message()
+
+
+@pytest.mark.asyncio
+async def test_batched_parts_fallback():
+    """Test whether a failing batched request is retried with smaller batches."""
+    available = {("R044", "MYM93LL/A"): True}
+    store_checker = create_store_checker(
+        FakeTransport(available, max_parts=1), {"parts_per_request": 8}
+    )
+    stock_available, _, _ = await store_checker.refresh(verbose=False)
+    assert stock_available is True
+    # one failing request for all three, one failing request for the first two, then three single requests
+    assert len(store_checker.transport.urls) == 5
+    assert len(store_checker.stores_list_with_stock["R044"].parts) == 3
+
+
+@pytest.mark.asyncio
+async def test_batched_parts_outage():
+    """Test whether a batched request failing because of an outage is not split."""
+    store_checker = create_store_checker(FakeTransport({}), {"parts_per_request": 8})
+    store_checker.retry_policy = RetryPolicy({"max_attempts": 1})
+    store_checker.transport.unavailable = True
+    stock_available, _, _ = await store_checker.refresh(verbose=False)
+    assert stock_available is False
+    assert len(store_checker.transport.urls) == 1
+
+
+@pytest.mark.asyncio
+async def test_unchanged_response_short_circuit():
+    """Test whether identical responses are not processed and rendered again."""
+    available = {("R044", "MYM93LL/A"): True}
+    store_checker = create_store_checker(FakeTransport(available))
+    await store_checker.refresh(verbose=False)
+    first_message = store_checker.get_message()
+    await store_checker.refresh(verbose=False)
+    assert store_checker.count_skipped_renders == 1
+    assert store_checker.response_cache.count_identical_body == 1
+    assert store_checker.get_message() is first_message
+
+    # a change in stock must be processed again
+    store_checker.transport.available[("R089", "MYM93LL/A")] = True
+    await store_checker.refresh(verbose=False)
+    assert store_checker.count_skipped_renders == 1
+    assert store_checker.get_message().count("✅") == 2
+    assert store_checker.get_statuslist().count("✅") == 3
+
+
+@pytest.mark.asyncio
+async def test_transitions():
+    """Test whether only the changes in availability per store and part are passed to the callbacks."""
+    available = {("R044", "MYM93LL/A"): True}
+    store_checker = create_store_checker(FakeTransport(available))
+    await store_checker.refresh(verbose=False)
+    await store_checker.refresh(verbose=False)
+    store_checker.transport.available = {("R089", "MYM93LL/A"): True}
+    await store_checker.refresh(verbose=False)
+
+    transitions = store_checker.callbacks.transitions
+    assert len(transitions) == 2
+    assert [(t.type, t.store_number) for t in transitions[1]] == [
+        (TransitionType.BECAME_UNAVAILABLE, "R044"),
+        (TransitionType.BECAME_AVAILABLE, "R089"),
+    ]
+    assert transitions[0][0].link == "https://www.apple.com/MYM93LL/A"
+
+
+@pytest.mark.asyncio
+async def test_transitions_after_failed_request():
+    """Test whether a part missing from a failed request keeps its availability instead of flapping."""
+    available = {("R044", "MYM93LL/A"): True, ("R089", "MYMD3LL/A"): True}
+    store_checker = create_store_checker(FakeTransport(available))
+    await store_checker.refresh(verbose=False)
+    store_checker.transport.failing_parts = {"MYM93LL/A"}
+    await store_checker.refresh(verbose=False)
+    store_checker.transport.failing_parts = set()
+    await store_checker.refresh(verbose=False)
+
+    transitions = store_checker.callbacks.transitions
+    assert len(transitions) == 1
+    assert [(t.type, t.part_number) for t in transitions[0]] == [
+        (TransitionType.BECAME_AVAILABLE, "MYM93LL/A"),
+        (TransitionType.BECAME_AVAILABLE, "MYMD3LL/A"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_appointment_availability():
+    """Test whether appointment slots are looked up at their own interval and unchanged documents are not parsed again."""
+    store_checker = create_store_checker(FakeTransport({}))
+    store_checker.configuration.appointment_stores = ["R044", "R089"]
+    store_checker.configuration.appointment_interval_seconds = 3600
+    store_checker.transport.appointments = [
+        {"storeNumber": "R001", "appointmentsAvailable": True},
+        {
+            "storeNumber": "R044",
+            "appointmentsAvailable": True,
+            "firstAvailableAppointment": 1700000000,
+        },
+        {"storeNumber": "R089", "appointmentsAvailable": False},
+    ]
+    await store_checker.refresh(verbose=False)
+    await store_checker.refresh(verbose=False)
+    appointment_urls = [
+        url for url in store_checker.transport.urls if url.endswith("availability.json")
+    ]
+    assert len(appointment_urls) == 1
+    assert store_checker.callbacks.messages == [
+        "First appointment slot available at R044: 14-11-2023 22:13:20\n"
+    ]
+
+    slots_found, _ = await store_checker.get_store_availability()
+    assert slots_found is True
+    assert store_checker.response_cache.count_identical_body >= 1
+
+
+@pytest.mark.asyncio
+async def test_scheduled_targets():
+    """Test whether only the targets that are due are requested, reusing the last stores of the others."""
+    store_checker = create_store_checker(FakeTransport({("R044", "MYM93LL/A"): True}))
+    store_checker.scheduler.enabled = True
+    await store_checker.refresh(verbose=False)
+    assert len(store_checker.transport.urls) == 1
+    first_message = store_checker.get_message()
+
+    # only the first model is due again
+    store_checker.scheduler.next_due[1:] = float("inf")
+    store_checker.scheduler.next_due[0] = 0
+    await store_checker.refresh(verbose=False)
+    assert len(store_checker.transport.urls) == 2
+    assert "parts.1" not in store_checker.transport.urls[-1]
+    assert store_checker.get_message() == first_message
+
+
+@pytest.mark.asyncio
+async def test_failed_targets_are_not_due():
+    """Test whether a target whose request failed is not due again right away, so the polling loop does not spin."""
+    store_checker = create_store_checker(FakeTransport({}))
+    store_checker.scheduler.enabled = True
+    store_checker.transport.failing_parts = {"MYM93LL/A"}
+    await store_checker.refresh(verbose=False)
+    assert store_checker.scheduler.seconds_until_due() > 0
+    assert store_checker.get_due_targets(store_checker.device_list) == []
+
+
+@pytest.mark.asyncio
+async def test_busy_proxies_fall_back_to_direct_requests():
+    """Test whether requests sent directly because every proxy is busy are not counted as proxied."""
+    store_checker = create_store_checker(FakeTransport({("R044", "MYM93LL/A"): True}))
+    store_checker.randomize_proxies = True
+    store_checker.req_proxy = object()
+    stock_available, _, _ = await store_checker.refresh(verbose=False)
+    assert stock_available is True
+    assert store_checker.count_randomized_proxy_success == 0
+
+
+@pytest.mark.asyncio
+async def test_proxy_refresh_does_not_block(monkeypatch):
+    """Test whether scraping and validating the proxies runs in a thread, once for all requests waiting for it."""
+    created = list()
+
+    class SlowRequestProxy:
+        def __init__(self, **kwargs):
+            time.sleep(0.2)
+            created.append(kwargs)
+            self.validator = kwargs["validator"]
+
+        def get_proxy_list(self):
+            return []
+
+    monkeypatch.setattr(store_checker_module, "RequestProxy", SlowRequestProxy)
+    store_checker = create_store_checker(FakeTransport({}))
+    store_checker.proxy_settings = {"validate": False}
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.gather(
+        store_checker.refresh_proxies(), store_checker.refresh_proxies()
+    )
+    ticker.cancel()
+    await asyncio.gather(ticker, return_exceptions=True)
+    assert ticks >= 10
+    assert len(created) == 1
+    assert store_checker.proxy_list_refresh_count == 1
+
+
+@pytest.mark.asyncio
+async def test_shared_prefetched_targets():
+    """Test whether targets fetched once can be shared between the store checkers of several searches."""
+    transport = FakeTransport({("R044", "MYMD3LL/A"): True})
+    first = create_store_checker(transport)
+    second = create_store_checker(FakeTransport({}))
+    second.device_list = first.device_list[1:]
+    targets = {
+        (region, device.get("model")): (region, device)
+        for store_checker in (first, second)
+        for region, device in store_checker.get_due_targets(store_checker.device_list)
+    }
+    prefetched = await first.fetch_targets(list(targets.values()), verbose=False)
+    assert len(transport.urls) == 1
+    await first.refresh(verbose=False, prefetched=prefetched)
+    await second.refresh(verbose=False, prefetched=prefetched)
+    assert len(transport.urls) == 1
+    assert len(second.transport.urls) == 0
+    assert second.get_message().count("✅") == 1
+    assert "MYM93LL/A" not in second.get_message()
@@ -0,0 +1,102 @@
+import pytest
+from telethon import errors
+
+from notifications import Priority
+from telegram_sender import TelegramSender, MAX_MESSAGE_LENGTH, split_message
+
+SETTINGS = {"coalesce_window_seconds": 0.01, "min_interval_seconds": 0.01}
+
+
+class FakeClient:
+    """Client recording the sent messages, raising the queued errors first."""
+
+    def __init__(self, errors_to_raise=None):
+        self.sent = list()
+        self.errors_to_raise = list(errors_to_raise or [])
+
+    async def send_message(self, chat, message):
+        if len(self.errors_to_raise) > 0:
+            raise self.errors_to_raise.pop(0)
+        self.sent.append((chat, message))
+
+
+@pytest.mark.asyncio
+async def test_coalescing():
+    """Test whether messages sent in quick succession are merged per chat, up to the maximum length."""
+    client = FakeClient()
+    sender = TelegramSender(client, SETTINGS)
+    await sender.send("alice", "first")
+    await sender.send("alice", "second")
+    await sender.send("bob", "third")
+    for i in range(2):
+        await sender.send("alice", f"AVAILABLE! {i}", coalesce=False)
+    await sender.send("alice", "x" * (MAX_MESSAGE_LENGTH + 10))
+    await sender.flush()
+    sent_to = lambda chat: [message for to, message in client.sent if to == chat]
+    assert sent_to("bob") == ["third"]
+    assert sent_to("alice") == [
+        "first\n\nsecond",
+        "AVAILABLE! 0",
+        "AVAILABLE! 1",
+        "x" * MAX_MESSAGE_LENGTH,
+        "x" * 10,
+    ]
+    assert sender.count_sent == 6 and sender.count_merged == 1
+
+
+@pytest.mark.asyncio
+async def test_flood_wait_and_failures():
+    """Test whether a flood wait is waited out without counting as an attempt, and connection errors give up after the attempts."""
+    client = FakeClient(
+        [
+            errors.FloodWaitError(request=None, capture=0),
+            errors.FloodWaitError(request=None, capture=0),
+            ConnectionError("disconnected"),
+        ]
+    )
+    sender = TelegramSender(client, {**SETTINGS, "max_attempts": 1})
+    await sender.send("alice", "lost")
+    await sender.flush()
+    assert client.sent == []
+    assert sender.count_flood_waits == 2 and sender.count_failed == 1
+    await sender.send("alice", "delivered")
+    await sender.flush()
+    assert client.sent == [("alice", "delivered")]
+    assert "1 messages sent" in sender.get_status()
+
+
+@pytest.mark.asyncio
+async def test_other_errors_and_priorities():
+    """Test whether other errors only fail their message, and messages of different priorities are not merged."""
+    client = FakeClient(
+        [
+            ValueError("Cannot find any entity corresponding to alice"),
+            errors.RPCError(None, "CHAT_WRITE_FORBIDDEN"),
+        ]
+    )
+    sender = TelegramSender(client, SETTINGS)
+    await sender.send("alice", "unknown user")
+    await sender.send("alice", "forbidden", coalesce=False)
+    await sender.send("alice", "report", priority=Priority.LOW)
+    await sender.send("alice", "stock alert", priority=Priority.HIGH)
+    await sender.send("alice", "another stock alert", priority=Priority.HIGH)
+    await sender.flush()
+    assert client.sent == [
+        ("alice", "report"),
+        ("alice", "stock alert\n\nanother stock alert"),
+    ]
+    assert sender.count_failed == 2
+
+
+def test_split_message_keeps_html_intact():
+    """Test whether long messages are split at line breaks, and long lines outside of HTML elements."""
+    lines = [f'<a href="https://www.apple.com/{i}">iPhone {i}</a>' for i in range(200)]
+    parts = split_message("\n".join(lines))
+    assert len(parts) > 1
+    assert all(len(part) <= MAX_MESSAGE_LENGTH for part in parts)
+    assert "\n".join(parts).split("\n") == lines
+    line = " ".join(lines)
+    parts = split_message(line)
+    assert all(len(part) <= MAX_MESSAGE_LENGTH for part in parts)
+    assert all(part.count("<a ") == part.count("</a>") for part in parts)
+    assert "".join(parts) == line
@@ -0,0 +1,117 @@
+"""Module for detecting the changes in availability per store and part between polls."""
+
+from enum import Enum
+
+import numpy as np
+
+from availability import AvailabilityMatrix
+
+
+class TransitionType(Enum):
+    """The types of change in availability of a part in a store."""
+
+    BECAME_AVAILABLE = "became available"
+    BECAME_UNAVAILABLE = "became unavailable"
+    STILL_AVAILABLE = "still available"
+
+
+class Transition:
+    """The change in availability of a part in a store since the previous poll."""
+
+    __slots__ = (
+        "type",
+        "store_number",
+        "store_name",
+        "city",
+        "part_number",
+        "title",
+        "link",
+    )
+
+    def __init__(
+        self,
+        type: TransitionType,
+        store_number: str,
+        store_name: str,
+        city: str,
+        part_number: str,
+        title: str,
+        link: str,
+    ):
+        self.type = type
+        self.store_number = store_number
+        self.store_name = store_name
+        self.city = city
+        self.part_number = part_number
+        self.title = title
+        self.link = link
+
+    @property
+    def changed(self) -> bool:
+        return self.type is not TransitionType.STILL_AVAILABLE
+
+    def __repr__(self) -> str:
+        return (
+            f"Transition({self.type.name}, {self.store_number!r}, {self.part_number!r})"
+        )
+
+
+class TransitionEngine:
+    """Class to compare each poll with the previous one and emit the transitions per store and part."""
+
+    def __init__(self):
+        """Initialization."""
+        # the last known availability of every part in every store
+        self.previous: AvailabilityMatrix = None
+
+    def update(self, matrix: AvailabilityMatrix) -> list[Transition]:
+        """Compare the matrix with the previous poll, returns the transitions ordered by store and part index."""
+        became_available, became_unavailable = matrix.diff(self.previous)
+        still_available = matrix.available & ~became_available
+        # a part that was not listed keeps its last known availability, so it does not flap after a failed request
+        self.previous = matrix.carried_forward(self.previous)
+
+        cells = sorted(
+            (store_index, part_index, transition_type)
+            for transition_type, mask in (
+                (TransitionType.BECAME_AVAILABLE, became_available),
+                (TransitionType.BECAME_UNAVAILABLE, became_unavailable),
+                (TransitionType.STILL_AVAILABLE, still_available),
+            )
+            for store_index, part_index in np.argwhere(mask).tolist()
+        )
+        index = matrix.index
+        return [
+            Transition(
+                transition_type,
+                index.store_numbers[store_index],
+                index.store_names[store_index],
+                index.store_cities[store_index],
+                index.part_numbers[part_index],
+                index.part_titles[part_index],
+                index.part_links[part_index],
+            )
+            for store_index, part_index, transition_type in cells
+        ]
+
+
+def format_transitions(transitions: list[Transition]) -> str:
+    """Render the transitions to a HTML message, grouped by store."""
+    message = ""
+    current_store = None
+    for transition in transitions:
+        if transition.store_number != current_store:
+            current_store = transition.store_number
+            message += "\n <b>{}, {} ({})</b>\n".format(
+                transition.store_name, transition.city, transition.store_number
+            )
+        available = transition.type is not TransitionType.BECAME_UNAVAILABLE
+        message += "{} {}{}{} ({}) {}\n".format(
+            "✅" if available else "❌",
+            f'<a href="{transition.link}">' if available and transition.link else "",
+            transition.title,
+            "</a>" if available and transition.link else "",
+            transition.part_number,
+            transition.type.value,
+        )
+    return message.strip("\n")
@@ -0,0 +1,125 @@
+"""Asynchronous HTTP transport used by the store checker, keeps a pooled keep-alive client per host."""
+
+import asyncio
+from urllib.parse import urlsplit
+
+import httpx
+from requests.exceptions import ConnectionError
+
+from http_request_randomizer.requests.proxy.requestProxy import RequestProxy
+from ratelimit import RateLimiter
+
+
+class ProxiesBusyError(Exception):
+    """Raised instead of sending a proxied request while every proxy is at its concurrency cap or quarantined."""
+
+
+class Transport:
+    """Class to execute GET requests either directly over pooled keep-alive connections or via a randomized proxy."""
+
+    def __init__(self, settings: dict = None, rate_limiter: RateLimiter = None):
+        """Initialize the connection pool limits and timeouts.
+
+        Args:
+            settings (dict, optional): the `[http]` section of the configuration. Defaults to None, in which case the defaults are used.
+            rate_limiter (RateLimiter, optional): the rate limiter every request waits for, may be shared between transports. Defaults to None, in which case requests are not rate limited.
+        """
+        settings = settings or {}
+        self.limits = httpx.Limits(
+            max_connections=settings.get("max_connections", 10),
+            max_keepalive_connections=settings.get("max_keepalive_connections", 5),
+            keepalive_expiry=settings.get("keepalive_expiry_seconds", 30),
+        )
+        self.timeout = httpx.Timeout(
+            settings.get("timeout_seconds", 15),
+            connect=settings.get("connect_timeout_seconds", 5),
+        )
+        self.proxy_timeout = settings.get("proxy_timeout_seconds", 30)
+        self.max_concurrent_requests_per_host = settings.get(
+            "max_concurrent_requests_per_host", 0
+        )
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.clients: dict[str, httpx.AsyncClient] = dict()
+        self.host_semaphores: dict[str, asyncio.Semaphore] = dict()
+
+    def get_client(self, url: str) -> httpx.AsyncClient:
+        """Get the pooled client for the host of the URL, creating it on first use."""
+        host = urlsplit(url).netloc
+        client = self.clients.get(host)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=self.limits, timeout=self.timeout, follow_redirects=True
+            )
+            self.clients[host] = client
+        return client
+
+    def get_host_semaphore(self, url: str) -> asyncio.Semaphore:
+        """Get the semaphore capping the concurrent requests to the host of the URL, or None if there is no cap."""
+        if self.max_concurrent_requests_per_host <= 0:
+            return None
+        host = urlsplit(url).netloc
+        semaphore = self.host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrent_requests_per_host)
+            self.host_semaphores[host] = semaphore
+        return semaphore
+
+    async def get(self, url: str, req_proxy: RequestProxy = None, headers: dict = None):
+        """Execute a GET request, via a proxy of the randomized proxy pool if one is given.
+
+        Both paths return an object with `status_code`, `headers`, `content` and `json()`.
+        A direct request raises a `ConnectionError` if the server can not be reached, a proxied request returns None if the proxy failed.
+        A proxied request raises a `ProxiesBusyError` if no proxy is available right now, so the caller can send it directly instead.
+        """
+        semaphore = self.get_host_semaphore(url)
+        if semaphore is None:
+            return await self.get_unlimited(url, req_proxy, headers)
+        async with semaphore:
+            return await self.get_unlimited(url, req_proxy, headers)
+
+    async def get_unlimited(
+        self, url: str, req_proxy: RequestProxy = None, headers: dict = None
+    ):
+        """Execute a GET request without applying the per-host cap, after waiting for the rate limiter."""
+        host = urlsplit(url).netloc
+        if req_proxy is not None:
+            # choose the proxy up front, so the request also waits for the budget of the proxy
+            proxy = req_proxy.acquire_proxy()
+            if proxy is not None:
+                try:
+                    await self.rate_limiter.acquire(host, proxy.get_address())
+                except BaseException:
+                    req_proxy.pool.release(proxy)
+                    raise
+                return await self.get_proxied(url, req_proxy, headers, proxy)
+            raise ProxiesBusyError(
+                "Every proxy is at its concurrency cap or quarantined"
+            )
+        await self.rate_limiter.acquire(host)
+        return await self.get_direct(url, headers)
+
+    async def get_direct(self, url: str, headers: dict = None) -> httpx.Response:
+        """Execute a GET request over the pooled keep-alive client of the host."""
+        try:
+            return await self.get_client(url).get(url, headers=headers)
+        except httpx.TransportError as error:
+            raise ConnectionError(error) from error
+
+    async def get_proxied(
+        self, url: str, req_proxy: RequestProxy, headers: dict = None, proxy=None
+    ):
+        """Execute a GET request via the given (acquired) or a randomized proxy in a worker thread, so the event loop is not blocked."""
+        return await asyncio.to_thread(
+            req_proxy.generate_proxied_request,
+            url,
+            headers=dict(headers or {}),
+            req_timeout=self.proxy_timeout,
+            proxy=proxy,
+        )
+
+    async def aclose(self):
+        """Close all pooled clients and their connections."""
+        clients = list(self.clients.values())
+        self.clients = dict()
+        for client in clients:
+            await client.aclose()
@@ -2,6 +2,10 @@
 
 import socket
 from math import floor
+from datetime import datetime
+
+# the format in which dates and times are displayed, and were stored by earlier versions
+DATETIME_FORMAT = "%d-%m-%Y %H:%M:%S"
 
 
 def reboot_pi():
@@ -25,6 +29,16 @@ def get_ip():
     return IP
 
 
+def format_timestamp(timestamp: int) -> str:
+    """Format an epoch timestamp in nanoseconds (UTC) as local date and time, only for display"""
+    return datetime.fromtimestamp(timestamp / 1e9).strftime(DATETIME_FORMAT)
+
+
+def parse_datetimestamp(datetimestamp: str) -> int:
+    """Parse a local date and time as stored by earlier versions to an epoch timestamp in nanoseconds (UTC)"""
+    return int(datetime.strptime(datetimestamp, DATETIME_FORMAT).timestamp()) * 10**9
+
+
 def past_time_formatter(count, polling_interval_seconds):
     past_seconds = count * polling_interval_seconds
     whole_hours = floor(past_seconds / (60 * 60))